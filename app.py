@@ -21,6 +21,11 @@ import requests
 import zipfile
 import tempfile
 import shutil
+import contextvars
+import mimetypes
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
 import sys
 import fitz  # PyMuPDF
 import docx
@@ -53,6 +58,19 @@ from edumate.utils.quiz_manager import QuizManager
 from edumate.utils.show_course_students import show_course_students
 from edumate.utils.ai_career_advisor import AICareerAdvisor
 from edumate.utils.classroom_manager import ClassroomManager
+from edumate.utils.plagiarism_detector import PlagiarismDetector
+from edumate.utils.text_utils import extract_text_from_file
+from edumate.utils.document_extraction import (
+    extract_pdf_pages, extract_docx_text, pages_without_text
+)
+from edumate.services.job_queue import get_job_queue, PRIORITY_HIGH, STATUS_QUEUED, STATUS_RUNNING, STATUS_FAILED
+from edumate.services.ai_service import AIService
+from edumate.services.batch_grading import BatchGrader, RETRYABLE_STATUS_CODES, is_retryable_error
+from edumate.utils.token_budget import estimate_tokens
+from edumate.utils.llm_metrics import get_llm_metrics, llm_feature
+from edumate.utils.gemini_payload import get_payload_cache
+from edumate.utils.http_client import get_http_session
+from edumate.utils.image_preprocessing import preprocess_image_file, render_pdf_for_model
 
 # Load environment variables from .env file
 load_dotenv()
@@ -177,11 +195,45 @@ if not os.path.exists('data/career/course_recommendations.json'):
             ]
         }, f, indent=4)
 
+try:
+    import fcntl
+except ImportError:  # Windows: only in-process locking
+    fcntl = None
+
+_data_locks = {}
+_data_locks_guard = threading.Lock()
+
 # Load data
 def load_data(file_name):
     with open(f'data/{file_name}.json', 'r') as f:
         return json.load(f)
 
+@contextmanager
+def data_lock(file_name):
+    """Hold the lock of a data file, shared by threads and processes"""
+    with _data_locks_guard:
+        thread_lock = _data_locks.setdefault(file_name, threading.Lock())
+    
+    with thread_lock:
+        if fcntl is None:
+            yield
+            return
+        os.makedirs('data', exist_ok=True)
+        with open(f'data/{file_name}.json.lock', 'a') as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+def _write_data(file_name, data):
+    """Write a data file atomically so readers never see a half-written file"""
+    os.makedirs('data', exist_ok=True)
+    tmp_path = f'data/{file_name}.json.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=4)
+    os.replace(tmp_path, f'data/{file_name}.json')
+
 def save_data(file_name, data):
     """Save data to a JSON file with consistent parameter order
     file_name: the name of the file without extension
@@ -191,14 +243,22 @@ def save_data(file_name, data):
     if isinstance(file_name, list) and isinstance(data, str):
         # Parameters are in reversed order, swap them
         file_name, data = data, file_name
-        
-    # Ensure data directory exists
-    import os
-    os.makedirs('data', exist_ok=True)
     
-    # Save the data
-    with open(f'data/{file_name}.json', 'w') as f:
-        json.dump(data, f, indent=4)
+    with data_lock(file_name):
+        _write_data(file_name, data)
+
+def update_data(file_name, update):
+    """Read, modify and save a data file under its lock
+    
+    update is called with the freshly loaded data, changes it in place and
+    returns a value that is passed back to the caller. Background jobs use
+    this so concurrent updates of other records are not lost.
+    """
+    with data_lock(file_name):
+        data = load_data(file_name)
+        result = update(data)
+        _write_data(file_name, data)
+        return result
 
 # Generate unique course code
 def generate_unique_course_code():
@@ -565,6 +625,13 @@ def submit_assignment(assignment_id, student_id, content, uploaded_file=None):
     submissions.append(new_submission)
     save_data('submissions', submissions)
     
+    # Check plagiarism in the background so the student doesn't wait on it
+    job_queue.enqueue(
+        'plagiarism_check',
+        {'submission_id': new_submission['id']},
+        key=f"plagiarism_check:{new_submission['id']}"
+    )
+    
     # Calculate time until deadline
     time_remaining = due_date - current_time
     days_remaining = time_remaining.days
@@ -639,33 +706,27 @@ GEMINI_MODELS = {
 }
 GEMINI_API_BASE_URL = "https://generativelanguage.googleapis.com/v1/models"
 
-def analyze_with_gemini(content_type, file_path, prompt, mime_type, model="gemini-1.5-pro"):
-    """Analyze content using specific Gemini model"""
+# Seconds each model gets to answer in a multi-model evaluation
+MODEL_EVALUATION_TIMEOUT = 90
+
+def analyze_with_gemini(content_type, file_path, prompt, mime_type, model="gemini-1.5-pro",
+                        timeout=None, show_status=True, raise_retryable=False):
+    """Analyze content using specific Gemini model
+    
+    With file_path=None only the prompt text is sent. Pass show_status=False
+    when calling from a worker thread, where Streamlit elements cannot render.
+    With raise_retryable=True, rate-limit (429) and server (5xx) responses
+    raise requests.HTTPError instead of returning an error message.
+    """
     if not GEMINI_API_KEY:
-        st.error("Gemini API key not found. Please add GEMINI_API_KEY to your .env file.")
+        if show_status:
+            st.error("Gemini API key not found. Please add GEMINI_API_KEY to your .env file.")
         return "Error: Valid Gemini API key not configured."
     
     try:
-        # Read the file and encode it as base64
-        with open(file_path, "rb") as file:
-            file_data = base64.b64encode(file.read()).decode('utf-8')
-        
-        # Prepare the request payload
-        payload = {
-            "contents": [
-                {
-                    "parts": [
-                        {"text": prompt},
-                        {
-                            "inline_data": {
-                                "mime_type": mime_type,
-                                "data": file_data
-                            }
-                        }
-                    ]
-                }
-            ]
-        }
+        # Files are encoded once per content and streamed into the request,
+        # or uploaded once and referenced by handle when they are large
+        body = get_payload_cache().build_request_body(prompt, file_path, mime_type, api_key=GEMINI_API_KEY)
         
         headers = {
             "Content-Type": "application/json",
@@ -674,39 +735,109 @@ def analyze_with_gemini(content_type, file_path, prompt, mime_type, model="gemin
         
         api_url = f"{GEMINI_API_BASE_URL}/{model}:generateContent"
         
-        st.info(f"Using model: {model}...")
-        response = requests.post(
-            api_url,
-            headers=headers,
-            json=payload
-        )
-        
-        if response.status_code == 200:
-            result = response.json()
-            if 'candidates' in result and len(result['candidates']) > 0:
-                if 'content' in result['candidates'][0] and 'parts' in result['candidates'][0]['content']:
-                    for part in result['candidates'][0]['content']['parts']:
-                        if 'text' in part:
-                            st.success(f"Successfully used model: {model}")
-                            return part['text']
-        
+        if show_status:
+            st.info(f"Using model: {model}...")
+        with get_llm_metrics().track('gemini', model, prompt, feature=f"analyze_{content_type}") as call:
+            response = get_http_session().post(
+                api_url,
+                headers=headers,
+                data=body,
+                timeout=timeout
+            )
+            
+            if raise_retryable and response.status_code in RETRYABLE_STATUS_CODES:
+                response.raise_for_status()
+            
+            if response.status_code == 200:
+                result = response.json()
+                call.set_usage_from(result)
+                if 'candidates' in result and len(result['candidates']) > 0:
+                    if 'content' in result['candidates'][0] and 'parts' in result['candidates'][0]['content']:
+                        for part in result['candidates'][0]['content']['parts']:
+                            if 'text' in part:
+                                call.set_response(part['text'])
+                                if show_status:
+                                    st.success(f"Successfully used model: {model}")
+                                return part['text']
+            
+            call.fail(f"http_{response.status_code}")
         return f"Model {model} failed: {response.text}"
         
+    except requests.Timeout:
+        return f"Model {model} timed out after {timeout} seconds"
     except Exception as e:
+        if raise_retryable and is_retryable_error(e):
+            raise
         return f"Error analyzing with {model}: {str(e)}"
 
+def evaluate_with_models(prompt, models, timeout=MODEL_EVALUATION_TIMEOUT, file_path=None, mime_type=None):
+    """Send the same prompt (and optionally a file) to several Gemini models in parallel
+    
+    Yields (model, result) pairs in the order the models finish, so the total
+    wait is the slowest model rather than the sum of all of them. Models that
+    have not answered within the timeout are reported as timed out. A file is
+    encoded (or uploaded) once and shared by all models.
+    """
+    models = list(models)
+    if not models:
+        return
+    
+    content_type = 'text'
+    temp_dir = None
+    if file_path:
+        # Downscale once, then encode or upload once up front instead of racing in every worker
+        temp_dir = tempfile.mkdtemp(prefix="model-eval-")
+        if mime_type == 'application/pdf':
+            content_type = 'pdf'
+            file_path = render_pdf_for_model(file_path, os.path.join(temp_dir, "prepared.pdf"))
+        else:
+            content_type = 'image'
+            prepared_path = preprocess_image_file(file_path, os.path.join(temp_dir, "prepared.jpg"))
+            if prepared_path != file_path:
+                file_path, mime_type = prepared_path, 'image/jpeg'
+        get_payload_cache().build_request_body(prompt, file_path, mime_type, api_key=GEMINI_API_KEY)
+    
+    executor = ThreadPoolExecutor(max_workers=len(models), thread_name_prefix="model-eval")
+    # Each worker runs in a copy of the caller's context so LLM calls keep its feature tag
+    with llm_feature('multi_model_evaluation'):
+        futures = {
+            executor.submit(contextvars.copy_context().run, analyze_with_gemini, content_type, file_path, prompt,
+                            mime_type or 'text/plain', model=model, timeout=timeout, show_status=False): model
+            for model in models
+        }
+    
+    pending = set(futures)
+    try:
+        # The HTTP timeout bounds each request; the extra margin covers connection setup
+        for future in as_completed(futures, timeout=timeout + 5):
+            pending.discard(future)
+            yield futures[future], future.result()
+    except FuturesTimeoutError:
+        for future in pending:
+            yield futures[future], f"Model {futures[future]} timed out after {timeout} seconds"
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        if temp_dir:
+            # Requests still running keep their open file handles
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
 def analyze_image_with_gemini(image_path, prompt):
     """
     Analyze an image using Google Gemini API
+    The image is downscaled, cropped and stripped of metadata before it is sent
     """
-    return analyze_with_gemini('image', image_path, prompt, 'image/jpeg')
+    with tempfile.TemporaryDirectory() as temp_dir:
+        prepared_path = preprocess_image_file(image_path, os.path.join(temp_dir, "prepared.jpg"))
+        mime_type = 'image/jpeg' if prepared_path != image_path else (mimetypes.guess_type(image_path)[0] or 'image/jpeg')
+        return analyze_with_gemini('image', prepared_path, prompt, mime_type)
 
-def analyze_pdf_with_gemini(pdf_path, prompt):
+def analyze_pdf_with_gemini(pdf_path, prompt, raise_retryable=False, show_status=True):
     """
     Analyze a PDF file directly using Google Gemini API
     This function sends the PDF file directly to Gemini without extracting images
     """
-    return analyze_with_gemini('pdf', pdf_path, prompt, 'application/pdf')
+    return analyze_with_gemini('pdf', pdf_path, prompt, 'application/pdf',
+                               show_status=show_status, raise_retryable=raise_retryable)
 
 def extract_images_from_pdf(pdf_path, output_dir):
     """Extract images from a PDF file using PyMuPDF"""
@@ -760,14 +891,34 @@ def extract_images_from_pdf(pdf_path, output_dir):
 
 def auto_grade_submission(submission_id):
     """Automatically grade a submission using AI"""
-    submissions = load_data('submissions')
-    submission = next((sub for sub in submissions if sub['id'] == submission_id), None)
+    submission = get_submission_by_id(submission_id)
     
     if not submission:
         return False, "Submission not found"
     
     assignment = get_assignment_by_id(submission['assignment_id'])
+    updates = compute_auto_grade(submission, assignment)
+    
+    # Update only this record under the lock so changes made while grading are kept
+    def apply(submissions):
+        for sub in submissions:
+            if sub['id'] == submission_id:
+                sub.update(updates)
+                return True
+        return False
+    
+    if update_data('submissions', apply):
+        return True, f"Submission auto-graded with score {updates['score']}/{assignment['points']}"
+    
+    return False, "Failed to update submission"
+
+@llm_feature('auto_grading')
+def compute_auto_grade(submission, assignment, raise_retryable=False):
+    """Grade a submission and return the fields to update, without saving
     
+    With raise_retryable=True, Gemini rate-limit and server errors are raised
+    so a batch run can back off and retry the submission.
+    """
     # Analyze text content
     content = submission['content']
     
@@ -784,14 +935,30 @@ def auto_grade_submission(submission_id):
             try:
                 # Extract text based on file type
                 if file_info['file_type'].endswith('pdf'):
-                    # First try to extract text
-                    file_content = extract_text_from_pdf(file_path)
+                    # Extract the text layer page by page
+                    pages = extract_pdf_pages(file_path)
+                    file_content = "\n".join(page['text'] for page in pages if page['has_text_layer'])
                     
-                    # If it's likely a handwritten PDF (little text extracted), process with Gemini
-                    if len(file_content.split()) < 20 or "[PDF content extracted" in file_content:
-                        # Send the PDF directly to Gemini for analysis
+                    # Only pages without a text layer (scanned/handwritten) go to Gemini
+                    scanned_pages = pages_without_text(pages)
+                    if scanned_pages:
                         prompt = f"This is a PDF submission for the assignment: '{assignment['title']}'. Please analyze the content, including any handwritten text. Extract all text if possible, and evaluate the answer in terms of correctness, completeness, and clarity. If there are handwritten portions, please transcribe them and include them in your analysis."
-                        gemini_analysis = analyze_pdf_with_gemini(file_path, prompt)
+                        
+                        # Scanned pages are sent as downscaled renders rather than full-resolution scans
+                        with tempfile.TemporaryDirectory() as temp_dir:
+                            rendered_path = os.path.join(temp_dir, "scanned_pages.pdf")
+                            if len(scanned_pages) == len(pages):
+                                gemini_analysis = analyze_pdf_with_gemini(
+                                    render_pdf_for_model(file_path, rendered_path), prompt,
+                                    raise_retryable=raise_retryable, show_status=False
+                                )
+                            else:
+                                page_list = ", ".join(str(n) for n in scanned_pages)
+                                gemini_analysis = analyze_pdf_with_gemini(
+                                    render_pdf_for_model(file_path, rendered_path, page_numbers=scanned_pages),
+                                    f"{prompt} These are pages {page_list} of the original PDF; the other pages contained typed text.",
+                                    raise_retryable=raise_retryable, show_status=False
+                                )
                         
                         # Format the analysis for display
                         if gemini_analysis and not gemini_analysis.startswith("Error"):
@@ -807,6 +974,8 @@ def auto_grade_submission(submission_id):
                 # Analyze the file content
                 file_analysis = analyze_file_content(file_content, file_info['filename'])
             except Exception as e:
+                if raise_retryable and is_retryable_error(e):
+                    raise
                 file_analysis = f"Error analyzing file: {str(e)}"
     
     # Simple auto-grading logic (in a real app, this would use more sophisticated AI)
@@ -844,29 +1013,69 @@ def auto_grade_submission(submission_id):
     # Generate AI feedback
     ai_feedback = generate_ai_feedback(submission, file_content, file_analysis, gemini_analysis)
     
-    # Update the submission
-    for i, sub in enumerate(submissions):
-        if sub['id'] == submission_id:
-            submissions[i]['score'] = score
-            submissions[i]['ai_feedback'] = ai_feedback
-            submissions[i]['status'] = 'auto-graded'
-            submissions[i]['graded_at'] = datetime.now().isoformat()
-            save_data(submissions, 'submissions')
-            return True, f"Submission auto-graded with score {score}/{max_points}"
+    return {
+        'score': score,
+        'ai_feedback': ai_feedback,
+        'status': 'auto-graded',
+        'graded_at': datetime.now().isoformat()
+    }
+
+def batch_auto_grade_assignment(assignment_id, on_progress=None):
+    """Auto-grade every ungraded submission of an assignment
     
-    return False, "Failed to update submission"
+    Submissions are graded concurrently within the Gemini quotas (GEMINI_RPM /
+    GEMINI_TPM), progress is checkpointed so an interrupted run resumes, and
+    all results are written back in a single save.
+    """
+    assignment = get_assignment_by_id(assignment_id)
+    if not assignment:
+        raise ValueError(f"Assignment {assignment_id} not found")
+    
+    ungraded = [sub for sub in get_assignment_submissions(assignment_id)
+                if sub.get('status') not in ('graded', 'auto-graded')]
+    
+    def estimate_cost(submission):
+        # Only PDFs can need a Gemini call (for pages without a text layer)
+        file_info = submission.get('file_info')
+        if file_info and file_info['file_type'].endswith('pdf'):
+            return 1, estimate_tokens(submission.get('content', '')) + file_info.get('file_size', 0) // 100
+        return 0, 0
+    
+    grader = BatchGrader(lambda submission: compute_auto_grade(submission, assignment, raise_retryable=True))
+    batch_id = f"auto-grade-assignment-{assignment_id}"
+    results = grader.run(
+        batch_id,
+        ungraded,
+        item_id=lambda submission: submission['id'],
+        estimate_cost=estimate_cost,
+        on_progress=on_progress,
+        # A resubmission changes these, so its checkpointed grade is not reused
+        item_content=lambda submission: [submission.get('content'), submission.get('file_info'),
+                                         submission.get('submitted_at')]
+    )
+    
+    # One locked save for the whole batch
+    def apply(submissions):
+        for sub in submissions:
+            updates = results['completed'].get(str(sub['id']))
+            if updates and sub.get('status') not in ('graded', 'auto-graded'):
+                sub.update(updates)
+    
+    update_data('submissions', apply)
+    
+    if not results['failed']:
+        grader.clear_checkpoint(batch_id)
+    
+    return {'graded': len(results['completed']), 'failed': results['failed']}
 
 def extract_text_from_pdf(file_path):
     """Extract text from a PDF file"""
-    # In a real app, you would use a library like PyPDF2 or pdfplumber
-    # For this simplified version, we'll return a placeholder
-    return f"[PDF content extracted from {os.path.basename(file_path)}]"
+    pages = extract_pdf_pages(file_path)
+    return "\n".join(page['text'] for page in pages)
 
 def extract_text_from_docx(file_path):
     """Extract text from a DOCX file"""
-    # In a real app, you would use a library like python-docx
-    # For this simplified version, we'll return a placeholder
-    return f"[DOCX content extracted from {os.path.basename(file_path)}]"
+    return extract_docx_text(file_path)
 
 def analyze_file_content(content, filename):
     """Analyze the content of a file"""
@@ -989,6 +1198,58 @@ def generate_ai_feedback(submission, file_content="", file_analysis="", gemini_a
     
     return feedback
 
+def run_plagiarism_check(submission_id):
+    """Check a stored submission for plagiarism and record the outcome"""
+    submission = get_submission_by_id(submission_id)
+    if not submission:
+        raise ValueError(f"Submission {submission_id} not found")
+    
+    text = submission.get('content') or ""
+    if submission.get('file_info'):
+        text += "\n" + extract_text_from_file(submission['file_info']['file_path'])
+    
+    if not text.strip():
+        return {'plagiarism_detected': False, 'similarity_score': 0.0}
+    
+    # Keyed by submission id, so a retried job replaces its own entry instead of matching it
+    results = PlagiarismDetector().check_plagiarism(
+        text,
+        submission['student_id'],
+        submission['assignment_id'],
+        submission_id=submission_id
+    )
+    summary = {
+        'plagiarism_detected': results['plagiarism_detected'],
+        'similarity_score': float(results['similarity_score']),
+        'report_path': results.get('report_path'),
+        'checked_at': datetime.now().isoformat()
+    }
+    
+    # Update only this record under the lock so concurrent changes to other submissions are kept
+    def apply(submissions):
+        for sub in submissions:
+            if sub['id'] == submission_id:
+                sub['plagiarism'] = summary
+                break
+    
+    update_data('submissions', apply)
+    
+    return summary
+
+def run_auto_grade_job(payload):
+    """Job handler wrapping auto_grade_submission"""
+    success, message = auto_grade_submission(payload['submission_id'])
+    if not success:
+        raise RuntimeError(message)
+    return {'message': message}
+
+# Background job queue for plagiarism checks and auto-grading
+job_queue = get_job_queue()
+job_queue.register('plagiarism_check', lambda payload: run_plagiarism_check(payload['submission_id']))
+job_queue.register('auto_grade', run_auto_grade_job)
+job_queue.register('batch_auto_grade', lambda payload: batch_auto_grade_assignment(payload['assignment_id']))
+job_queue.start()
+
 def get_file_download_link(file_path, filename):
     """Generate a download link for a file"""
     if not os.path.exists(file_path):
@@ -1429,6 +1690,19 @@ def show_teacher_tools():
             if generate_button:
                 if not ai_subject or not ai_topic:
                     st.error("Please fill in all required fields (marked with red asterisk).")
+                elif AIService.is_available():
+                    # Stream the generated plan so it renders as it is written
+                    st.write(f"## {ai_topic} - {ai_grade} Lesson Plan")
+                    st.write(f"**Subject:** {ai_subject}")
+                    st.write(f"**Duration:** {ai_duration} minutes")
+                    
+                    prompt = f"""Create a detailed lesson plan in Markdown for a {ai_duration}-minute {ai_grade} {ai_subject} lesson on "{ai_topic}".
+Include learning objectives, materials needed, an introduction, main activities with timings, a conclusion, assessment ideas, suggested next topics and learning resources.
+{f"Special requirements: {ai_requirements}" if ai_requirements else ""}"""
+                    plan_text = st.write_stream(AIService.generate_text_stream(prompt, max_tokens=2048))
+                    
+                    # Store the lesson plan data in session state for download
+                    st.session_state.lesson_plan_data = f"# {ai_topic} - {ai_grade} Lesson Plan\n\nSubject: {ai_subject}\nDuration: {ai_duration} minutes\n\n{plan_text}"
                 else:
                     with st.spinner("Generating lesson plan..."):
                         # Simulate AI processing
@@ -2674,6 +2948,28 @@ def show_assignment_submissions():
         if not selected_models:
             st.warning("Please select at least one model for evaluation")
     
+    # Batch auto-grading of every ungraded submission (runs in the background job queue)
+    batch_key = f"batch_auto_grade:{assignment['id']}"
+    batch_status = job_queue.get_status(batch_key)
+    col1, col2 = st.columns([1, 3])
+    with col1:
+        if st.button("Auto-Grade All Ungraded", key=f"batch_auto_grade_{assignment['id']}"):
+            job_queue.enqueue(
+                'batch_auto_grade',
+                {'assignment_id': assignment['id']},
+                key=batch_key,
+                rerun=True
+            )
+            st.rerun()
+    with col2:
+        if batch_status['status'] in (STATUS_QUEUED, STATUS_RUNNING):
+            st.info(f"Batch auto-grading {batch_status['status']}... refresh to see the results.")
+        elif batch_status['status'] == STATUS_FAILED:
+            st.error(f"Batch auto-grading failed: {batch_status.get('error')}")
+        elif batch_status.get('result'):
+            result = batch_status['result']
+            st.caption(f"Last batch: {result['graded']} graded, {len(result['failed'])} failed")
+    
     # Display submissions
     if not submissions:
         st.info("No submissions yet.")
@@ -2697,16 +2993,33 @@ def show_assignment_submissions():
                     st.write("**AI-Generated Feedback:**")
                     st.markdown(submission['ai_feedback'])
                 
-                # AI Auto-grading button
+                # AI Auto-grading button (runs in the background job queue)
+                auto_grade_key = f"auto_grade:{submission['id']}"
                 col1, col2 = st.columns([1, 3])
                 with col1:
                     if st.button("Auto-Grade", key=f"auto_grade_{submission['id']}"):
-                        success, message = auto_grade_submission(submission['id'])
-                        if success:
-                            st.success(message)
-                            st.rerun()
-                        else:
-                            st.error(message)
+                        job_queue.enqueue(
+                            'auto_grade',
+                            {'submission_id': submission['id']},
+                            key=auto_grade_key,
+                            priority=PRIORITY_HIGH,
+                            rerun=True
+                        )
+                        st.rerun()
+                with col2:
+                    job_status = job_queue.get_status(auto_grade_key)
+                    if job_status['status'] in (STATUS_QUEUED, STATUS_RUNNING):
+                        st.info(f"Auto-grading {job_status['status']}... refresh to see the result.")
+                    elif job_status['status'] == STATUS_FAILED:
+                        st.error(f"Auto-grading failed: {job_status.get('error')}")
+                
+                # Plagiarism check result from the background job
+                if submission.get('plagiarism'):
+                    plagiarism = submission['plagiarism']
+                    if plagiarism['plagiarism_detected']:
+                        st.warning(f"Possible plagiarism detected (similarity {plagiarism['similarity_score']:.2f})")
+                    else:
+                        st.caption("Plagiarism check: no matches found")
                 
                 # Manual Grading form
                 with st.form(f"grade_submission_{submission['id']}"):
@@ -2734,19 +3047,37 @@ def show_assignment_submissions():
                     if st.button("Evaluate with Selected Models", key=f"model_grade_{submission['id']}"):
                         model_results = {}
                         progress_bar = st.progress(0)
-                        for i, (model, _) in enumerate(selected_models.items()):
-                            result = analyze_with_gemini(
-                                'text',
-                                None,
-                                submission['content'],
-                                'text/plain',
-                                model=model
-                            )
+                        
+                        # One placeholder per model, filled in as each model answers
+                        placeholders = {model: st.empty() for model in selected_models}
+                        for model, placeholder in placeholders.items():
+                            placeholder.info(f"Waiting for {model}...")
+                        
+                        # Scanned PDFs and images are evaluated from the file itself
+                        file_info = submission.get('file_info') or {}
+                        eval_file, eval_mime = None, None
+                        if (file_info.get('file_type', '').startswith('image/') or file_info.get('file_type') == 'application/pdf') \
+                                and os.path.exists(file_info.get('file_path', '')):
+                            eval_file, eval_mime = file_info['file_path'], file_info['file_type']
+                        
+                        for model, result in evaluate_with_models(submission['content'], selected_models,
+                                                                  file_path=eval_file, mime_type=eval_mime):
                             model_results[model] = result
-                            progress_bar.progress((i + 1) / len(selected_models))
+                            with placeholders[model].container():
+                                with st.expander(f"Results from {model}", expanded=True):
+                                    st.write(result)
+                            progress_bar.progress(len(model_results) / len(selected_models))
                         
-                        # Store results and update submission
+                        # Store results with the submission, under the lock background jobs update it with
                         submission['model_evaluations'] = model_results
+                        
+                        def apply(submissions_data):
+                            for sub in submissions_data:
+                                if sub['id'] == submission['id']:
+                                    sub['model_evaluations'] = model_results
+                                    break
+                        
+                        update_data('submissions', apply)
                         st.success("Evaluation complete!")
                         st.rerun()
                 
@@ -3372,7 +3703,25 @@ def show_test_creator():
             )
             
             if st.button("Generate Questions with AI"):
-                if ai_topic:
+                if ai_topic and AIService.is_available():
+                    # Stream the generated questions so they render as they are written
+                    st.write(f"## {ai_topic} Questions")
+                    st.write(f"**Difficulty:** {ai_difficulty}")
+                    
+                    prompt = f"""Write {ai_num_questions} {ai_difficulty.lower()} test questions about "{ai_topic}" in Markdown.
+Use these question types: {", ".join(ai_question_types) or "Multiple Choice"}.
+Number the questions, give the options for multiple choice questions, and list the answer key at the end."""
+                    questions_text = st.write_stream(AIService.generate_text_stream(prompt, max_tokens=2048))
+                    
+                    # Download option
+                    st.session_state.quiz_created = True
+                    st.session_state.quiz_data = {
+                        "topic": ai_topic,
+                        "difficulty": ai_difficulty,
+                        "num_questions": ai_num_questions,
+                        "content": questions_text
+                    }
+                elif ai_topic:
                     with st.spinner("Generating questions with AI..."):
                         # Simulate AI processing
                         import time
@@ -3422,7 +3771,7 @@ def show_test_creator():
                 quiz_data = st.session_state.quiz_data
                 st.download_button(
                     label="Download Quiz",
-                    data=f"# {quiz_data['topic']} Quiz\n\nDifficulty: {quiz_data['difficulty']}\nTotal Questions: {quiz_data['num_questions']}\n\n...",
+                    data=f"# {quiz_data['topic']} Quiz\n\nDifficulty: {quiz_data['difficulty']}\nTotal Questions: {quiz_data['num_questions']}\n\n{quiz_data.get('content', '...')}",
                     file_name=f"{quiz_data['topic'].replace(' ', '_')}_quiz.txt",
                     mime="text/plain"
                 )
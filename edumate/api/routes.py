@@ -12,13 +12,74 @@ from edumate.models.rubric import Rubric, RubricCriterion
 from edumate.services.grading_service import GradingService
 from edumate.services.feedback_service import FeedbackService
 from edumate.services.plagiarism_service import PlagiarismService
+from edumate.services.job_queue import get_job_queue, PRIORITY_HIGH, PRIORITY_LOW, STATUS_SUCCEEDED
+from edumate.services.provider_router import get_provider_router
 from edumate.utils.file_utils import allowed_file, save_file
+from edumate.utils.llm_metrics import get_llm_metrics
 
 
 # Initialize services
 grading_service = GradingService()
 feedback_service = FeedbackService()
 plagiarism_service = PlagiarismService()
+job_queue = get_job_queue()
+
+
+# Background jobs
+def _plagiarism_job(payload):
+    """Run a plagiarism check for a submission."""
+    submission = Submission.get_by_id(payload['submission_id'])
+    if not submission:
+        raise ValueError(f"Submission {payload['submission_id']} not found")
+    
+    result = plagiarism_service.check_plagiarism(submission)
+    submission.save()
+    return result
+
+
+def _grading_job(payload):
+    """Run automated grading for a submission."""
+    submission = Submission.get_by_id(payload['submission_id'])
+    if not submission:
+        raise ValueError(f"Submission {payload['submission_id']} not found")
+    
+    graded_submission = grading_service.grade_submission(submission)
+    if not graded_submission:
+        raise ValueError(f"Submission {submission.id} could not be graded")
+    
+    graded_submission.save()
+    return {'submission_id': graded_submission.id, 'score': graded_submission.score}
+
+
+def _batch_grading_job(payload):
+    """Grade all ungraded submissions of an assignment."""
+    assignment = Assignment.get_by_id(payload['assignment_id'])
+    if not assignment:
+        raise ValueError(f"Assignment {payload['assignment_id']} not found")
+    
+    results = grading_service.grade_assignment(assignment)
+    return {
+        'assignment_id': assignment.id,
+        'graded': len(results['completed']),
+        'failed': results['failed']
+    }
+
+
+@api_bp.record_once
+def _start_job_queue(state):
+    """Register job handlers with the app context and start the workers."""
+    app = state.app
+    
+    def in_app_context(handler):
+        def run(payload):
+            with app.app_context():
+                return handler(payload)
+        return run
+    
+    job_queue.register('plagiarism', in_app_context(_plagiarism_job))
+    job_queue.register('grading', in_app_context(_grading_job))
+    job_queue.register('batch_grading', in_app_context(_batch_grading_job))
+    job_queue.start()
 
 
 # User routes
@@ -53,6 +114,27 @@ def get_user(user_id):
     return jsonify({'user': user.to_dict()})
 
 
+# AI usage routes
+@api_bp.route('/ai/metrics', methods=['GET'])
+@jwt_required()
+def get_ai_metrics():
+    """Get LLM latency, token and cost aggregates per feature."""
+    current_user_id = get_jwt_identity()
+    current_user = User.get_by_id(current_user_id)
+    
+    if not current_user or not current_user.is_admin():
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    hours = request.args.get('hours', 24, type=float)
+    metrics = get_llm_metrics()
+    return jsonify({
+        'features': metrics.summary(hours),
+        'tokens_per_hour': metrics.tokens_per_hour(hours),
+        'slowest_prompts': metrics.slowest_prompts(hours=hours),
+        'providers': get_provider_router().health()
+    })
+
+
 # Course routes
 @api_bp.route('/courses', methods=['GET'])
 @jwt_required()
@@ -353,11 +435,52 @@ def create_submission(assignment_id):
     
     try:
         submission.save()
-        return jsonify({'submission': submission.to_dict()}), 201
+        
+        # Check plagiarism in the background so the student does not wait on it
+        plagiarism_job = job_queue.enqueue(
+            'plagiarism',
+            {'submission_id': submission.id},
+            key=f"plagiarism:{submission.id}"
+        )
+        
+        return jsonify({
+            'submission': submission.to_dict(),
+            'jobs': {'plagiarism': job_queue.get_status(plagiarism_job['key'])}
+        }), 201
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+@api_bp.route('/submissions/<int:submission_id>/jobs', methods=['GET'])
+@jwt_required()
+def get_submission_jobs(submission_id):
+    """Get the status of background jobs for a submission."""
+    current_user_id = get_jwt_identity()
+    current_user = User.get_by_id(current_user_id)
+    
+    if not current_user:
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    submission = Submission.get_by_id(submission_id)
+    if not submission:
+        return jsonify({'error': 'Submission not found'}), 404
+    
+    course = submission.assignment.course
+    
+    # Check if user has access to this submission
+    if not current_user.is_admin() and not (
+        current_user.is_teacher() and course.teacher_id == current_user.id
+    ) and current_user.id != submission.student_id:
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    return jsonify({
+        'jobs': {
+            'plagiarism': job_queue.get_status(f"plagiarism:{submission_id}"),
+            'grading': job_queue.get_status(f"grading:{submission_id}")
+        }
+    })
+
+
 @api_bp.route('/submissions/<int:submission_id>/grade', methods=['POST'])
 @jwt_required()
 def grade_submission(submission_id):
@@ -412,14 +535,52 @@ def grade_submission(submission_id):
             submission.save()
             return jsonify({'submission': submission.to_dict()})
     
-    # Use grading service for automated grading
+    # Queue automated grading; clients poll /submissions/<id>/jobs for the result
     try:
-        graded_submission = grading_service.grade_submission(submission)
-        if graded_submission:
-            graded_submission.save()
-            return jsonify({'submission': graded_submission.to_dict()})
-        else:
-            return jsonify({'error': 'Failed to grade submission'}), 500
+        job = job_queue.enqueue(
+            'grading',
+            {'submission_id': submission.id},
+            key=f"grading:{submission.id}",
+            priority=PRIORITY_LOW,
+            rerun=True
+        )
+        return jsonify({'job': job_queue.get_status(job['key'])}), 202
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@api_bp.route('/assignments/<int:assignment_id>/grade', methods=['GET', 'POST'])
+@jwt_required()
+def grade_assignment(assignment_id):
+    """Queue automated grading of all ungraded submissions, or get its status."""
+    current_user_id = get_jwt_identity()
+    current_user = User.get_by_id(current_user_id)
+    
+    if not current_user or not (current_user.is_admin() or current_user.is_teacher()):
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    assignment = Assignment.get_by_id(assignment_id)
+    if not assignment:
+        return jsonify({'error': 'Assignment not found'}), 404
+    
+    # Check if user is the teacher of this course
+    if not current_user.is_admin() and assignment.course.teacher_id != current_user.id:
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    job_key = f"batch_grading:{assignment_id}"
+    if request.method == 'GET':
+        return jsonify({'job': job_queue.get_status(job_key)})
+    
+    try:
+        # A rerun resumes from the checkpoint of an interrupted batch
+        job = job_queue.enqueue(
+            'batch_grading',
+            {'assignment_id': assignment_id},
+            key=job_key,
+            priority=PRIORITY_LOW,
+            rerun=True
+        )
+        return jsonify({'job': job_queue.get_status(job['key'])}), 202
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -486,10 +647,19 @@ def check_plagiarism(submission_id):
     
     if check_internet:
         result = plagiarism_service.check_internet_plagiarism(submission)
-    else:
-        result = plagiarism_service.check_plagiarism(submission)
+        return jsonify(result)
+    
+    # Return the background check result, queueing one if none exists yet
+    key = f"plagiarism:{submission_id}"
+    rerun = request.args.get('refresh', 'false').lower() == 'true'
+    job = job_queue.enqueue('plagiarism', {'submission_id': submission_id}, key=key,
+                            priority=PRIORITY_HIGH, rerun=rerun)
+    
+    status = job_queue.get_status(key)
+    if job['status'] == STATUS_SUCCEEDED:
+        return jsonify(status['result'])
     
-    return jsonify(result)
+    return jsonify({'job': status}), 202
 
 
 # Rubric routes
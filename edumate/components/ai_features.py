@@ -425,17 +425,19 @@ def show_ai_tutor(ai_tutor):
     )
     
     if st.button("Ask") and question:
-        # Get answer from AI tutor
-        response = ai_tutor.answer_question(
+        # Stream the answer as it is generated
+        st.write(f"**You:** {question}")
+        st.write("**AI Tutor:**")
+        answer = st.write_stream(ai_tutor.answer_question_stream(
             question,
             user_id,
             selected_course,
             preferred_style=tutoring_style
-        )
+        ))
         
         # Add to chat history
         st.session_state.ai_tutor_history.append({"role": "user", "content": question})
-        st.session_state.ai_tutor_history.append({"role": "assistant", "content": response["answer"]})
+        st.session_state.ai_tutor_history.append({"role": "assistant", "content": answer})
         
         # Rerun to update the display
         st.experimental_rerun()
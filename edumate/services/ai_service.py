@@ -3,9 +3,15 @@
 import os
 import json
 import logging
-from typing import Dict, Any, List, Optional, Union
+from typing import Dict, Any, Iterator, List, Optional, Tuple, Union
 import time
 
+from edumate.services.llm_cache import get_llm_cache
+from edumate.services.model_registry import get_model_registry
+from edumate.services.provider_router import get_provider_router
+from edumate.utils.llm_metrics import get_llm_metrics, iter_with_feature, llm_feature
+from edumate.utils.token_budget import DEFAULT_CHUNK_TOKENS, estimate_tokens, map_chunks, split_into_chunks, weighted_mean
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -20,8 +26,8 @@ openai_available = False
 
 if GEMINI_API_KEY:
     try:
-        import google.generativeai as genai
-        genai.configure(api_key=GEMINI_API_KEY)
+        # Raises ImportError if google-generativeai is not installed
+        get_model_registry().configure(GEMINI_API_KEY)
         gemini_available = True
         logger.info("Gemini AI service initialized successfully")
     except ImportError:
@@ -44,6 +50,16 @@ if not gemini_available and not openai_available:
     logger.warning("No AI services available. AI features will not work.")
 
 
+def _gemini_generation_config(max_tokens: int, temperature: float) -> Dict[str, Any]:
+    """Build the Gemini generation config used for text generation."""
+    return {
+        "temperature": temperature,
+        "max_output_tokens": max_tokens,
+        "top_p": 0.95,
+        "top_k": 40,
+    }
+
+
 def parse_json_response(response_text: str) -> Dict[str, Any]:
     """Parse JSON from AI response text."""
     try:
@@ -97,59 +113,175 @@ class AIService:
                      prompt: str, 
                      model: Optional[str] = None,
                      max_tokens: int = 1024,
-                     temperature: float = 0.7) -> str:
-        """Generate text using available AI service."""
-        # Try to use specified model or fall back to available service
+                     temperature: float = 0.7,
+                     use_cache: bool = True) -> str:
+        """Generate text using available AI service.
+        
+        Without a specific model, each call goes to the healthiest available
+        provider and falls back to the other one if it fails.
+        Responses are cached; pass use_cache=False to always get a fresh answer.
+        """
+        backends = cls._candidate_backends(model)
+        if not backends:
+            raise ValueError("No AI service available")
+        
+        if use_cache:
+            # Cache hits are answered before routing, so they don't count as provider calls
+            llm_cache = get_llm_cache()
+            for provider, model_name in backends:
+                cached = llm_cache.get(provider, model_name, prompt, temperature, max_tokens)
+                if cached is not None:
+                    return cached
+        
+        def call_backend(provider, model_name):
+            if provider == "gemini":
+                return cls._generate_with_gemini(prompt, model_name, max_tokens, temperature, use_cache)
+            return cls._generate_with_openai(prompt, model_name, max_tokens, temperature, use_cache)
+        
+        return get_provider_router().call(backends, call_backend)
+    
+    @classmethod
+    def generate_text_stream(cls,
+                             prompt: str,
+                             model: Optional[str] = None,
+                             max_tokens: int = 1024,
+                             temperature: float = 0.7,
+                             use_cache: bool = True) -> Iterator[str]:
+        """Generate text, yielding chunks as the provider streams them.
+        
+        Cached responses are yielded in one piece. If streaming fails before
+        any output arrives, this falls back to buffered generate_text.
+        """
+        backends = cls._candidate_backends(model)
+        if not backends:
+            raise ValueError("No AI service available")
+        
+        llm_cache = get_llm_cache()
+        if use_cache:
+            for provider, model_name in backends:
+                cached = llm_cache.get(provider, model_name, prompt, temperature, max_tokens)
+                if cached is not None:
+                    yield cached
+                    return
+        
+        router = get_provider_router()
+        backend = router.select(backends)
+        if backend is None:
+            # Every circuit is open; let generate_text report it
+            yield cls.generate_text(prompt, model, max_tokens, temperature, use_cache)
+            return
+        provider, model_name = backend
+        
+        chunks = []
+        recorded = False
+        start = time.monotonic()
+        try:
+            with get_llm_metrics().track(provider, model_name, prompt, feature="ai_service") as call:
+                try:
+                    if provider == "gemini":
+                        stream = cls._stream_with_gemini(prompt, model_name, max_tokens, temperature)
+                    else:
+                        stream = cls._stream_with_openai(prompt, model_name, max_tokens, temperature)
+                    
+                    for chunk in stream:
+                        if chunk:
+                            chunks.append(chunk)
+                            yield chunk
+                finally:
+                    call.set_response("".join(chunks))
+            router.record(provider, model_name, time.monotonic() - start)
+            recorded = True
+        except Exception as e:
+            router.record(provider, model_name, time.monotonic() - start, e)
+            recorded = True
+            if chunks:
+                # Part of the answer is already on screen; don't cache an incomplete response
+                logger.error(f"Streaming from {provider} interrupted: {str(e)}")
+                return
+            logger.warning(f"Streaming from {provider} failed, using buffered generation: {str(e)}")
+            yield cls.generate_text(prompt, model, max_tokens, temperature, use_cache)
+            return
+        finally:
+            if not recorded:
+                # The caller stopped reading early; not a health signal
+                router.breaker(provider, model_name).release_probe()
+        
+        if use_cache and chunks:
+            llm_cache.set(provider, model_name, prompt, temperature, max_tokens, "".join(chunks))
+    
+    @staticmethod
+    def _candidate_backends(model: Optional[str] = None) -> List[Tuple[str, str]]:
+        """Get the (provider, model) pairs that may serve a request, in order of preference."""
         if model:
             if "gemini" in model and gemini_available:
-                return cls._generate_with_gemini(prompt, model, max_tokens, temperature)
+                return [("gemini", model)]
             elif ("gpt" in model or "text-davinci" in model) and openai_available:
-                return cls._generate_with_openai(prompt, model, max_tokens, temperature)
+                return [("openai", model)]
         
-        # No specific model requested, try available services in order
+        backends = []
         if gemini_available:
-            try:
-                return cls._generate_with_gemini(prompt, "gemini-pro", max_tokens, temperature)
-            except Exception as e:
-                logger.error(f"Gemini generation failed: {str(e)}")
-                if openai_available:
-                    logger.info("Falling back to OpenAI")
-                    return cls._generate_with_openai(prompt, "gpt-3.5-turbo", max_tokens, temperature)
-                raise
-        
+            backends.append(("gemini", "gemini-pro"))
         if openai_available:
-            return cls._generate_with_openai(prompt, "gpt-3.5-turbo", max_tokens, temperature)
-        
-        raise ValueError("No AI service available")
+            backends.append(("openai", "gpt-3.5-turbo"))
+        return backends
+    
+    @staticmethod
+    def _stream_with_gemini(prompt: str, model: str, max_tokens: int, temperature: float) -> Iterator[str]:
+        """Stream text chunks from Gemini."""
+        gemini_model = get_model_registry().get_gemini_model(
+            model, _gemini_generation_config(max_tokens, temperature)
+        )
+        for chunk in gemini_model.generate_content(prompt, stream=True):
+            try:
+                yield chunk.text
+            except ValueError:
+                # Chunks without text (e.g. safety metadata only)
+                continue
+    
+    @staticmethod
+    def _stream_with_openai(prompt: str, model: str, max_tokens: int, temperature: float) -> Iterator[str]:
+        """Stream text chunks from OpenAI."""
+        response = openai.ChatCompletion.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": "You are an AI assistant for an educational platform."},
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=max_tokens,
+            temperature=temperature,
+            stream=True
+        )
+        for chunk in response:
+            yield chunk["choices"][0].get("delta", {}).get("content") or ""
     
     @staticmethod
     def _generate_with_gemini(prompt: str, 
                              model: str = "gemini-pro", 
                              max_tokens: int = 1024,
-                             temperature: float = 0.7) -> str:
-        """Generate text using Gemini."""
+                             temperature: float = 0.7,
+                             use_cache: bool = True) -> str:
+        """Generate text using Gemini (generate_text has already looked the cache up)."""
         if not gemini_available:
             raise ValueError("Gemini AI service not available")
         
         try:
             # Configure the model
-            generation_config = {
-                "temperature": temperature,
-                "max_output_tokens": max_tokens,
-                "top_p": 0.95,
-                "top_k": 40,
-            }
+            generation_config = _gemini_generation_config(max_tokens, temperature)
             
-            # Get the model
-            model = genai.GenerativeModel(model_name=model)
+            def generate():
+                # Get the shared model handle
+                gemini_model = get_model_registry().get_gemini_model(model, generation_config)
+                
+                # Generate content
+                with get_llm_metrics().track("gemini", model, prompt, feature="ai_service") as call:
+                    response = gemini_model.generate_content(prompt)
+                    call.set_response(response.text)
+                    call.set_usage_from(response)
+                
+                return response.text
             
-            # Generate content
-            response = model.generate_content(
-                prompt,
-                generation_config=generation_config
-            )
-            
-            return response.text
+            return get_llm_cache().get_or_generate("gemini", model, prompt, temperature, max_tokens,
+                                                   generate, bypass=not use_cache, lookup=False)
         except Exception as e:
             logger.error(f"Error generating text with Gemini: {str(e)}")
             raise
@@ -158,44 +290,97 @@ class AIService:
     def _generate_with_openai(prompt: str, 
                              model: str = "gpt-3.5-turbo", 
                              max_tokens: int = 1024,
-                             temperature: float = 0.7) -> str:
-        """Generate text using OpenAI."""
+                             temperature: float = 0.7,
+                             use_cache: bool = True) -> str:
+        """Generate text using OpenAI (generate_text has already looked the cache up)."""
         if not openai_available:
             raise ValueError("OpenAI service not available")
         
         try:
-            # Create the completion
-            response = openai.ChatCompletion.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": "You are an AI assistant for an educational platform."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=max_tokens,
-                temperature=temperature
-            )
+            def generate():
+                # Create the completion
+                with get_llm_metrics().track("openai", model, prompt, feature="ai_service") as call:
+                    response = openai.ChatCompletion.create(
+                        model=model,
+                        messages=[
+                            {"role": "system", "content": "You are an AI assistant for an educational platform."},
+                            {"role": "user", "content": prompt}
+                        ],
+                        max_tokens=max_tokens,
+                        temperature=temperature
+                    )
+                    call.set_response(response.choices[0].message.content)
+                    call.set_usage_from(response)
+                
+                return response.choices[0].message.content
             
-            return response.choices[0].message.content
+            return get_llm_cache().get_or_generate("openai", model, prompt, temperature, max_tokens,
+                                                   generate, bypass=not use_cache, lookup=False)
         except Exception as e:
             logger.error(f"Error generating text with OpenAI: {str(e)}")
             raise
     
     @classmethod
+    @llm_feature('assignment_grading')
     def grade_assignment(cls, 
                         content: str, 
                         assignment_type: str,
                         rubric: Dict[str, Any],
                         max_points: int = 100) -> Dict[str, Any]:
-        """Grade an assignment using AI."""
-        prompt = f"""
+        """Grade an assignment using AI.
+        
+        Submissions longer than one grading prompt are split into sections
+        that are graded in parallel and combined into one result.
+        """
+        try:
+            sections = split_into_chunks(content, DEFAULT_CHUNK_TOKENS)
+            if len(sections) > 1:
+                return cls._grade_in_sections(sections, assignment_type, rubric, max_points)
+            
+            response_text = cls.generate_text(cls._grading_prompt(content, assignment_type, rubric, max_points))
+            result = parse_json_response(response_text)
+            
+            # Validate the result
+            if "grade" not in result:
+                logger.warning(f"Invalid grading result: {result}")
+                result["grade"] = 0
+            
+            return result
+        except Exception as e:
+            logger.error(f"Error grading assignment: {str(e)}")
+            return {
+                "grade": 0,
+                "rubric_scores": {},
+                "strengths": ["Unable to evaluate due to an error"],
+                "improvements": ["Please try again or contact your instructor"],
+                "feedback": f"The AI grading system encountered an error: {str(e)}"
+            }
+    
+    @staticmethod
+    def _grading_prompt(content: str,
+                        assignment_type: str,
+                        rubric: Dict[str, Any],
+                        max_points: int,
+                        part: Optional[Tuple[int, int]] = None) -> str:
+        """Build the grading prompt for a submission, or for one part of it."""
+        if part:
+            scope = (f"This is part {part[0]} of {part[1]} of a long submission. Grade only this part, "
+                     f"judging how well it does its share of the whole assignment.")
+            submission_heading = f"STUDENT SUBMISSION (PART {part[0]} OF {part[1]})"
+        else:
+            scope = ""
+            submission_heading = "STUDENT SUBMISSION"
+        
+        return f"""
         You are an AI grading assistant for an educational platform. Please grade the following {assignment_type} assignment.
+        {scope}
         
         RUBRIC:
         {json.dumps(rubric, indent=2)}
         
         MAXIMUM POINTS: {max_points}
         
-        STUDENT SUBMISSION:
+        {submission_heading}:
         {content}
         
         Please provide a comprehensive evaluation including:
@@ -228,28 +413,68 @@ class AIService:
         }}
         ```
         """
+    
+    @classmethod
+    def _grade_in_sections(cls,
+                           sections: List[str],
+                           assignment_type: str,
+                           rubric: Dict[str, Any],
+                           max_points: int) -> Dict[str, Any]:
+        """Grade sections in parallel (map) and combine them into one result (reduce)."""
+        def grade_section(numbered_section):
+            number, section = numbered_section
+            prompt = cls._grading_prompt(section, assignment_type, rubric, max_points, part=(number, len(sections)))
+            return parse_json_response(cls.generate_text(prompt))
         
-        try:
-            response_text = cls.generate_text(prompt)
-            result = parse_json_response(response_text)
-            
-            # Validate the result
-            if "grade" not in result:
-                logger.warning(f"Invalid grading result: {result}")
-                result["grade"] = 0
-            
-            return result
-        except Exception as e:
-            logger.error(f"Error grading assignment: {str(e)}")
-            return {
-                "grade": 0,
-                "rubric_scores": {},
-                "strengths": ["Unable to evaluate due to an error"],
-                "improvements": ["Please try again or contact your instructor"],
-                "feedback": f"The AI grading system encountered an error: {str(e)}"
-            }
+        results = map_chunks(grade_section, list(enumerate(sections, 1)))
+        weights = [estimate_tokens(section) for section in sections]
+        
+        def number_or_none(value):
+            try:
+                return float(value)
+            except (TypeError, ValueError):
+                return None
+        
+        # Scores are weighted by section length
+        grade = weighted_mean([number_or_none(r.get("grade")) for r in results], weights)
+        
+        criteria = []
+        for result in results:
+            for criterion in (result.get("rubric_scores") or {}):
+                if criterion not in criteria:
+                    criteria.append(criterion)
+        rubric_scores = {}
+        for criterion in criteria:
+            score = weighted_mean(
+                [number_or_none((r.get("rubric_scores") or {}).get(criterion)) for r in results], weights
+            )
+            if score is not None:
+                rubric_scores[criterion] = round(score, 1)
+        
+        def merged(key, limit=8):
+            items = []
+            for result in results:
+                for item in result.get(key) or []:
+                    if item not in items:
+                        items.append(item)
+            return items[:limit]
+        
+        feedback = "\n\n".join(
+            f"Part {number}: {result['feedback']}"
+            for number, result in enumerate(results, 1) if result.get("feedback")
+        )
+        
+        return {
+            "grade": round(grade, 1) if grade is not None else 0,
+            "rubric_scores": rubric_scores,
+            "strengths": merged("strengths"),
+            "improvements": merged("improvements"),
+            "feedback": feedback,
+            "sections_graded": len(sections)
+        }
     
     @classmethod
+    @llm_feature('personalized_feedback')
     def generate_personalized_feedback(cls,
                                       student_name: str,
                                       assignment_title: str,
@@ -257,8 +482,12 @@ class AIService:
                                       grade: float,
                                       max_points: int,
                                       strengths: List[str],
-                                      improvements: List[str]) -> str:
-        """Generate detailed personalized feedback for a student."""
+                                      improvements: List[str],
+                                      stream: bool = False) -> Union[str, Iterator[str]]:
+        """Generate detailed personalized feedback for a student.
+        
+        With stream=True an iterator of text chunks is returned instead.
+        """
         # Determine performance level
         if grade >= 90:
             performance_level = "excellent"
@@ -312,32 +541,67 @@ class AIService:
         Keep the feedback concise but detailed (about 200-250 words).
         """
         
+        if stream:
+            return cls._stream_personalized_feedback(
+                prompt, student_name, assignment_title, grade, max_points, strengths, improvements
+            )
+        
         try:
             return cls.generate_text(prompt, max_tokens=400, temperature=0.7)
         except Exception as e:
             logger.error(f"Error generating personalized feedback: {str(e)}")
-            # Fallback feedback template
-            strengths_text = "\n".join([f"- {s}" for s in strengths]) if strengths else "- Your submission was received successfully."
-            improvements_text = "\n".join([f"- {i}" for i in improvements]) if improvements else "- Continue practicing to improve your skills."
-            
-            return f"""
-            Dear {student_name},
-            
-            Thank you for submitting your {assignment_title} assignment. You received a grade of {grade} out of {max_points}.
-            
-            Strengths:
-            {strengths_text}
-            
-            Areas for improvement:
-            {improvements_text}
-            
-            I encourage you to review these points and continue working on improving your skills. Remember that learning is a journey, and each assignment is an opportunity to grow.
-            
-            Best regards,
-            EduMate AI Assistant
-            """
+            return cls._fallback_feedback(student_name, assignment_title, grade, max_points, strengths, improvements)
+    
+    @classmethod
+    def _stream_personalized_feedback(cls,
+                                      prompt: str,
+                                      student_name: str,
+                                      assignment_title: str,
+                                      grade: float,
+                                      max_points: int,
+                                      strengths: List[str],
+                                      improvements: List[str]) -> Iterator[str]:
+        """Stream personalized feedback, falling back to the template on failure."""
+        try:
+            # Generators run after the caller's decorator has returned, so tag each step here
+            yield from iter_with_feature(
+                'personalized_feedback', cls.generate_text_stream(prompt, max_tokens=400, temperature=0.7)
+            )
+        except Exception as e:
+            logger.error(f"Error generating personalized feedback: {str(e)}")
+            yield cls._fallback_feedback(student_name, assignment_title, grade, max_points, strengths, improvements)
     
+    @staticmethod
+    def _fallback_feedback(student_name: str,
+                           assignment_title: str,
+                           grade: float,
+                           max_points: int,
+                           strengths: List[str],
+                           improvements: List[str]) -> str:
+        """Feedback template used when no AI service can generate feedback."""
+        # Fallback feedback template
+        strengths_text = "\n".join([f"- {s}" for s in strengths]) if strengths else "- Your submission was received successfully."
+        improvements_text = "\n".join([f"- {i}" for i in improvements]) if improvements else "- Continue practicing to improve your skills."
+        
+        return f"""
+        Dear {student_name},
+        
+        Thank you for submitting your {assignment_title} assignment. You received a grade of {grade} out of {max_points}.
+        
+        Strengths:
+        {strengths_text}
+        
+        Areas for improvement:
+        {improvements_text}
+        
+        I encourage you to review these points and continue working on improving your skills. Remember that learning is a journey, and each assignment is an opportunity to grow.
+        
+        Best regards,
+        EduMate AI Assistant
+        """
+
     @classmethod
+    @llm_feature('plagiarism_check')
     def check_plagiarism(cls, content: str) -> Dict[str, Any]:
         """Check for plagiarism in student submission."""
         prompt = f"""
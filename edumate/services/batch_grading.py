@@ -0,0 +1,290 @@
+"""Batch grading engine for whole assignments.
+
+Grades many submissions with bounded concurrency while staying inside the
+AI provider's requests-per-minute and tokens-per-minute quotas. Rate-limit
+(429) and server (5xx) errors are retried with jittered exponential backoff,
+and progress is checkpointed to disk so an interrupted run resumes where it
+stopped instead of grading everything again. Checkpointed results are keyed
+on a hash of the item's content, so a resubmitted item is graded again.
+
+All graders share one rate limiter per provider (get_rate_limiter), so the
+quota holds across concurrent batches in the process.
+"""
+
+import os
+import json
+import time
+import hashlib
+import random
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+from edumate.utils.llm_metrics import llm_retries
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHECKPOINT_DIR = os.path.join('data', 'batch_grading')
+
+RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# google.api_core exception names for quota and transient server errors
+RETRYABLE_ERROR_NAMES = (
+    'ResourceExhausted', 'TooManyRequests', 'ServiceUnavailable',
+    'InternalServerError', 'DeadlineExceeded', 'RateLimitError'
+)
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """Check whether an error is a rate limit or transient server error."""
+    if type(error).__name__ in RETRYABLE_ERROR_NAMES:
+        return True
+
+    for status in (getattr(error, 'code', None),
+                   getattr(error, 'status_code', None),
+                   getattr(getattr(error, 'response', None), 'status_code', None)):
+        if isinstance(status, int) and status in RETRYABLE_STATUS_CODES:
+            return True
+    return False
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at a per-minute rate."""
+
+    def __init__(self, per_minute: float, capacity: Optional[float] = None):
+        """Initialize a full bucket."""
+        self.rate = per_minute / 60.0
+        self.capacity = capacity if capacity is not None else per_minute
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, amount: float) -> float:
+        """Take tokens if available.
+
+        Returns:
+            float: 0 if the tokens were taken, otherwise seconds to wait
+        """
+        # A request larger than the bucket can never fit; let it through once full
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self._refill()
+            if self._tokens >= amount:
+                self._tokens -= amount
+                return 0.0
+            return (amount - self._tokens) / self.rate
+
+    def refund(self, amount: float):
+        """Return tokens that were taken but not used."""
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + amount)
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute limits for one provider."""
+
+    def __init__(self, requests_per_minute: float = 60, tokens_per_minute: float = 1000000):
+        """Initialize the limiter with the provider's quotas."""
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+
+    @classmethod
+    def from_env(cls, provider: str = 'gemini') -> 'RateLimiter':
+        """Build a limiter from <PROVIDER>_RPM and <PROVIDER>_TPM environment variables."""
+        prefix = provider.upper()
+        return cls(
+            requests_per_minute=float(os.getenv(f'{prefix}_RPM', '60')),
+            tokens_per_minute=float(os.getenv(f'{prefix}_TPM', '1000000'))
+        )
+
+    def acquire(self, requests: int = 1, tokens: int = 0):
+        """Block until both quotas allow the call."""
+        while True:
+            wait = self.requests.try_acquire(requests) if requests else 0.0
+            if wait == 0.0:
+                token_wait = self.tokens.try_acquire(tokens) if tokens else 0.0
+                if token_wait == 0.0:
+                    return
+                # Give the request slot back while waiting for token budget
+                if requests:
+                    self.requests.refund(requests)
+                wait = token_wait
+            time.sleep(min(wait, 5.0))
+
+
+_rate_limiters: Dict[str, RateLimiter] = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(provider: str = 'gemini') -> RateLimiter:
+    """Get the process-wide rate limiter of a provider, shared by every caller."""
+    provider = provider.lower()
+    with _rate_limiters_lock:
+        limiter = _rate_limiters.get(provider)
+        if limiter is None:
+            limiter = RateLimiter.from_env(provider)
+            _rate_limiters[provider] = limiter
+        return limiter
+
+
+def content_version(value: Any) -> str:
+    """Hash of a JSON-serializable value identifying an item's gradable content."""
+    data = json.dumps(value, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+class BatchGrader:
+    """Grade a batch of items concurrently with rate limiting, retries and checkpoints."""
+
+    def __init__(self,
+                 grade_fn: Callable[[Any], Dict[str, Any]],
+                 rate_limiter: Optional[RateLimiter] = None,
+                 max_workers: int = 8,
+                 max_attempts: int = 5,
+                 base_backoff: float = 2.0,
+                 max_backoff: float = 60.0,
+                 checkpoint_dir: str = DEFAULT_CHECKPOINT_DIR):
+        """Initialize the batch grader.
+
+        Args:
+            grade_fn: Grades one item and returns a JSON-serializable result
+            rate_limiter: Provider quota limiter (default the shared Gemini limiter)
+            max_workers: Maximum number of items graded at the same time
+            max_attempts: Attempts per item for retryable errors
+            base_backoff: First retry delay in seconds
+            max_backoff: Longest retry delay in seconds
+            checkpoint_dir: Directory holding checkpoint files
+        """
+        self.grade_fn = grade_fn
+        self.rate_limiter = rate_limiter or get_rate_limiter()
+        self.max_workers = max_workers
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.checkpoint_dir = checkpoint_dir
+        self._lock = threading.Lock()
+
+    def _checkpoint_path(self, batch_id: str) -> str:
+        return os.path.join(self.checkpoint_dir, f"{batch_id}.json")
+
+    def load_checkpoint(self, batch_id: str) -> Dict[str, Any]:
+        """Load the saved progress of a batch."""
+        path = self._checkpoint_path(batch_id)
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    return json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                logger.warning(f"Ignoring unreadable checkpoint {path}: {str(e)}")
+        return {'batch_id': batch_id, 'completed': {}, 'versions': {}, 'failed': {}}
+
+    def _save_checkpoint(self, checkpoint: Dict[str, Any]):
+        """Atomically write a checkpoint."""
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        path = self._checkpoint_path(checkpoint['batch_id'])
+        checkpoint['updated_at'] = datetime.now().isoformat()
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(checkpoint, f, default=str)
+        os.replace(temp_path, path)
+
+    def clear_checkpoint(self, batch_id: str):
+        """Delete a checkpoint once its results have been saved."""
+        path = self._checkpoint_path(batch_id)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def _grade_with_retry(self, item: Any, cost: Tuple[int, int]) -> Dict[str, Any]:
+        """Grade one item, retrying rate-limit and server errors with jittered backoff."""
+        requests, tokens = cost
+        for attempt in range(1, self.max_attempts + 1):
+            self.rate_limiter.acquire(requests, tokens)
+            try:
+                with llm_retries(attempt - 1):
+                    return self.grade_fn(item)
+            except Exception as e:
+                if attempt >= self.max_attempts or not is_retryable_error(e):
+                    raise
+                delay = min(self.base_backoff * (2 ** (attempt - 1)), self.max_backoff)
+                delay *= random.uniform(0.5, 1.5)
+                logger.warning(f"Retryable grading error (attempt {attempt}), retrying in {delay:.1f}s: {str(e)}")
+                time.sleep(delay)
+
+    def run(self,
+            batch_id: str,
+            items: Iterable[Any],
+            item_id: Callable[[Any], Any],
+            estimate_cost: Optional[Callable[[Any], Tuple[int, int]]] = None,
+            on_progress: Optional[Callable[[int, int], None]] = None,
+            item_content: Optional[Callable[[Any], Any]] = None) -> Dict[str, Any]:
+        """Grade all items that are not already completed in the batch checkpoint.
+
+        Args:
+            batch_id: Name of the batch; reusing it resumes an interrupted run
+            items: Items to grade
+            item_id: Returns a stable ID for an item
+            estimate_cost: Returns (API requests, tokens) an item will use;
+                defaults to one request of unknown size
+            on_progress: Called with (finished, total) after each item
+            item_content: Returns the JSON-serializable content a result
+                depends on (e.g. text, file and submission time); a
+                checkpointed result is only reused while its hash is unchanged.
+                Defaults to the item itself
+
+        Returns:
+            dict: 'completed' maps item IDs to results, 'failed' maps IDs to errors
+        """
+        checkpoint = self.load_checkpoint(batch_id)
+        checkpoint['failed'] = {}
+        completed = checkpoint['completed']
+        # Checkpoints written before versions were recorded have none; their results are regraded
+        versions = checkpoint.setdefault('versions', {})
+
+        item_content = item_content or (lambda item: item)
+        items = list(items)
+        item_versions = {str(item_id(item)): content_version(item_content(item)) for item in items}
+        pending = [item for item in items
+                   if versions.get(str(item_id(item))) != item_versions[str(item_id(item))]]
+        for item in pending:
+            completed.pop(str(item_id(item)), None)
+        total = len(items)
+        finished = total - len(pending)
+        if pending:
+            logger.info(f"Batch {batch_id}: grading {len(pending)} items ({finished} already done)")
+
+        estimate_cost = estimate_cost or (lambda item: (1, 0))
+
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(pending) or 1)),
+                                thread_name_prefix="batch-grader") as executor:
+            # Copy the caller's context so LLM calls keep its feature tag
+            futures = {
+                executor.submit(contextvars.copy_context().run,
+                                self._grade_with_retry, item, estimate_cost(item)): str(item_id(item))
+                for item in pending
+            }
+
+            for future in as_completed(futures):
+                key = futures[future]
+                with self._lock:
+                    try:
+                        completed[key] = future.result()
+                        versions[key] = item_versions[key]
+                    except Exception as e:
+                        logger.error(f"Batch {batch_id}: grading {key} failed: {str(e)}")
+                        checkpoint['failed'][key] = f"{type(e).__name__}: {str(e)}"
+                    finished += 1
+                    self._save_checkpoint(checkpoint)
+
+                if on_progress:
+                    on_progress(finished, total)
+
+        return {'completed': completed, 'failed': checkpoint['failed']}
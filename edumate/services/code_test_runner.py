@@ -0,0 +1,239 @@
+"""Test harness for code assignments.
+
+Code submissions used to be run once without input, with the assignment's
+test cases left for the LLM to reason about. The harness runs them instead:
+
+- each submission is compiled once and the result is cached on disk by
+  source hash, so regrading or identical submissions skip the compiler. The
+  cache lives outside the application tree (CODE_ARTIFACT_DIR, by default in
+  the system temp directory) and is read-only to the programs run from it;
+- the test cases run in parallel on the code sandbox's worker processes,
+  each with its own timeout and working directory;
+- every test reports pass/fail, run time and peak memory, and the share of
+  passed tests gives a deterministic correctness score.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from edumate.services.single_flight import get_single_flight
+from edumate.utils.code_sandbox import LANGUAGES, Program, get_code_sandbox
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_ARTIFACT_DIR = os.path.join(tempfile.gettempdir(), 'edumate-code-artifacts')
+
+# Bump when compile commands change to invalidate cached artifacts
+ARTIFACT_CACHE_VERSION = "v1"
+
+DEFAULT_MAX_ARTIFACTS = int(os.getenv('CODE_ARTIFACT_CACHE_ENTRIES', '2000'))
+DEFAULT_TEST_TIMEOUT = float(os.getenv('CODE_TEST_TIMEOUT', '2'))
+
+# Characters of actual output kept per test in the report
+OUTPUT_PREVIEW_CHARS = 500
+
+_PROGRAM_FILE = 'program.json'
+
+
+def outputs_match(actual: str, expected: str) -> bool:
+    """Compare program output ignoring trailing whitespace on lines and at the end."""
+    def normalize(text):
+        return "\n".join(line.rstrip() for line in (text or "").replace("\r\n", "\n").strip("\n").split("\n"))
+    return normalize(actual) == normalize(expected)
+
+
+class CodeTestRunner:
+    """Compiles submissions once and runs their test cases in parallel in the code sandbox."""
+
+    def __init__(self,
+                 sandbox=None,
+                 artifact_dir: str = DEFAULT_ARTIFACT_DIR,
+                 max_artifacts: int = DEFAULT_MAX_ARTIFACTS,
+                 max_parallel: Optional[int] = None):
+        """Initialize the test runner.
+
+        Args:
+            sandbox: CodeSandbox to run in (default the shared one)
+            artifact_dir: Directory for compiled submissions
+            max_artifacts: Compiled submissions kept before the least recently used are removed
+            max_parallel: Tests of one submission run at the same time (default one per sandbox worker)
+        """
+        self.sandbox = sandbox or get_code_sandbox()
+        self.artifact_dir = os.path.abspath(artifact_dir)
+        self.max_artifacts = max_artifacts
+        self.max_parallel = max_parallel or self.sandbox.num_workers
+        self._evict_lock = threading.Lock()
+        os.makedirs(self.artifact_dir, mode=0o755, exist_ok=True)
+        # A shared temp directory could hold a directory someone else planted
+        if os.path.islink(self.artifact_dir) or os.stat(self.artifact_dir).st_uid != os.geteuid():
+            raise RuntimeError(f"Code artifact directory {self.artifact_dir} is not owned by this user")
+        os.chmod(self.artifact_dir, 0o755)
+
+    def _artifact_key(self, code: str, language: str) -> str:
+        data = json.dumps([ARTIFACT_CACHE_VERSION, language, LANGUAGES[language].get('compile'), code])
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    def prepare(self, code: str, language: str) -> Program:
+        """Get the compiled program for a submission, compiling it on first use.
+
+        Raises:
+            ValueError: If the language is not supported
+        """
+        language = (language or '').lower()
+        if language not in LANGUAGES:
+            raise ValueError(f'Unsupported language: {language}')
+
+        key = self._artifact_key(code, language)
+        workdir = os.path.join(self.artifact_dir, key)
+        program_file = os.path.join(workdir, _PROGRAM_FILE)
+
+        def load_or_compile():
+            if os.path.exists(program_file):
+                try:
+                    with open(program_file, 'r') as f:
+                        program = Program.from_dict(json.load(f))
+                    # Compiled paths are absolute; a moved cache directory needs a recompile
+                    if program.workdir == workdir:
+                        # Mark as recently used for eviction
+                        os.utime(workdir)
+                        return program
+                except (OSError, ValueError, TypeError) as e:
+                    logger.warning(f"Discarding unreadable compiled program {key}: {e}")
+
+            # No program file: missing or left half-written by an interrupted compile
+            shutil.rmtree(workdir, ignore_errors=True)
+            program = self.sandbox.prepare(code, language, workdir=workdir)
+            with open(program_file, 'w') as f:
+                json.dump(program.to_dict(), f)
+            self._evict(keep=workdir)
+            return program
+
+        # Identical submissions graded at the same time compile once
+        return get_single_flight().do(f"compile:{key}", load_or_compile)
+
+    def _evict(self, keep: Optional[str] = None):
+        """Remove the least recently used compiled programs above the entry limit, except keep."""
+        with self._evict_lock:
+            try:
+                entries = [(os.stat(path).st_mtime, path)
+                           for path in (os.path.join(self.artifact_dir, name) for name in os.listdir(self.artifact_dir))
+                           if os.path.isdir(path)]
+            except OSError as e:
+                logger.warning(f"Error reading code artifact cache: {e}")
+                return
+
+            excess = len(entries) - self.max_artifacts
+            for _, path in sorted(entries):
+                if excess <= 0:
+                    break
+                if path != keep:
+                    shutil.rmtree(path, ignore_errors=True)
+                    excess -= 1
+
+    def _run_test(self, program: Program, index: int, test_case: Dict[str, Any]) -> Dict[str, Any]:
+        """Run one test case in a fresh working directory."""
+        timeout = test_case.get('timeout') or DEFAULT_TEST_TIMEOUT
+        cwd = tempfile.mkdtemp(prefix='edumate-test-')
+        try:
+            result = self.sandbox.run(program, stdin=test_case.get('input', ''), timeout=timeout, cwd=cwd)
+        finally:
+            shutil.rmtree(cwd, ignore_errors=True)
+
+        expected = test_case.get('expected_output')
+        passed = result['success'] and (expected is None or outputs_match(result['output'], expected))
+        return {
+            'name': test_case.get('name') or f"Test {index + 1}",
+            'passed': passed,
+            'weight': test_case.get('weight', 1),
+            'duration': result.get('duration'),
+            'max_memory_kb': result.get('max_memory_kb'),
+            'timed_out': result.get('timed_out', False),
+            'exit_code': result.get('exit_code'),
+            'expected_output': expected,
+            'output': result['output'][:OUTPUT_PREVIEW_CHARS],
+            'error': result['error'][:OUTPUT_PREVIEW_CHARS]
+        }
+
+    def run_tests(self, code: str, language: str, test_cases: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Compile a submission and run its test cases in parallel.
+
+        Args:
+            code: Submission source code
+            language: Language name (python, c, cpp, java, javascript, php)
+            test_cases: Dicts with 'input' (stdin), 'expected_output' (None
+                only checks for a clean exit) and optional 'name', 'timeout'
+                (seconds) and 'weight'
+
+        Returns:
+            dict: 'compiled', 'compile_error', 'passed', 'total', 'score'
+                (weighted share of passed tests, 0-1) and 'tests' with one
+                result per test case
+        """
+        try:
+            program = self.prepare(code, language)
+        except ValueError as e:
+            return {'compiled': False, 'compile_error': str(e), 'passed': 0,
+                    'total': len(test_cases), 'score': 0.0, 'tests': []}
+
+        if not program.compiled:
+            return {'compiled': False, 'compile_error': program.compile_result['error'], 'passed': 0,
+                    'total': len(test_cases), 'score': 0.0, 'tests': []}
+
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_parallel, len(test_cases)))) as executor:
+            tests = list(executor.map(lambda item: self._run_test(program, *item), enumerate(test_cases)))
+
+        total_weight = sum(test['weight'] for test in tests)
+        passed_weight = sum(test['weight'] for test in tests if test['passed'])
+        return {
+            'compiled': True,
+            'compile_error': None,
+            'passed': sum(1 for test in tests if test['passed']),
+            'total': len(tests),
+            'score': passed_weight / total_weight if total_weight else 0.0,
+            'tests': tests
+        }
+
+
+def format_test_report(report: Dict[str, Any], max_failures: int = 5) -> str:
+    """Summarize a test report as text for feedback and prompts."""
+    if not report['compiled']:
+        return f"The code did not compile:\n{report['compile_error']}"
+
+    lines = [f"Passed {report['passed']} of {report['total']} test cases."]
+    if report['tests']:
+        slowest = max(test['duration'] or 0 for test in report['tests'])
+        peak_memory = max(test['max_memory_kb'] or 0 for test in report['tests'])
+        lines.append(f"Slowest test: {slowest:.3f}s, peak memory: {peak_memory / 1024:.1f} MB.")
+    failures = [test for test in report['tests'] if not test['passed']]
+    for test in failures[:max_failures]:
+        if test['timed_out']:
+            reason = "timed out"
+        elif test['exit_code'] != 0:
+            reason = f"exited with code {test['exit_code']}: {test['error'].strip()[:200]}"
+        else:
+            reason = f"expected {test['expected_output']!r}, got {test['output'].strip()[:200]!r}"
+        lines.append(f"- {test['name']} failed ({reason})")
+    if len(failures) > max_failures:
+        lines.append(f"- ... and {len(failures) - max_failures} more failures")
+    return "\n".join(lines)
+
+
+_test_runner = None
+_test_runner_lock = threading.Lock()
+
+
+def get_code_test_runner() -> CodeTestRunner:
+    """Get the process-wide code test runner."""
+    global _test_runner
+    with _test_runner_lock:
+        if _test_runner is None:
+            _test_runner = CodeTestRunner(artifact_dir=os.getenv('CODE_ARTIFACT_DIR', DEFAULT_ARTIFACT_DIR))
+        return _test_runner
@@ -1,5 +1,10 @@
 """Feedback service for personalized student feedback."""
 from edumate.services.gemini_service import GeminiService
+from edumate.utils.token_budget import truncate_to_budget
+
+
+# Tokens of past feedback analyzed for strength/weakness patterns
+FEEDBACK_ANALYSIS_TOKENS = 1000
 
 
 class FeedbackService:
@@ -138,7 +143,7 @@ class FeedbackService:
         Analyze the following feedback from multiple student submissions to identify patterns of strengths and weaknesses.
         
         Feedback:
-        {all_feedback[:2000]}  # Limit length
+        {truncate_to_budget(all_feedback, FEEDBACK_ANALYSIS_TOKENS)}
         
         Identify:
         1. 3-5 consistent strengths demonstrated across submissions
@@ -1,64 +1,109 @@
 """Gemini service for AI-powered grading and feedback."""
 import os
-import google.generativeai as genai
+import re
 from flask import current_app
 import openai
 
+from edumate.services.batch_grading import is_retryable_error
+from edumate.services.llm_cache import get_llm_cache
+from edumate.services.model_registry import get_model_registry
+from edumate.services.provider_router import get_provider_router
+from edumate.utils.llm_metrics import get_llm_metrics, llm_feature
+from edumate.utils.token_budget import (
+    DEFAULT_CHUNK_TOKENS, estimate_tokens, map_chunks, split_into_chunks, truncate_to_budget, weighted_mean
+)
+
+# Tokens of submission text included when generating feedback
+FEEDBACK_CONTENT_TOKENS = 1500
+
+
+def _extract_section(text, heading):
+    """Get the text under a HEADING: line of a formatted response."""
+    match = re.search(rf'{heading}:\s*(.*?)(?=\n\s*[A-Z][A-Z ]+:|\Z)', text or "", re.DOTALL)
+    return match.group(1).strip() if match else ""
+
 
 class GeminiService:
     """Service for interacting with the Gemini API."""
     
-    def __init__(self, api_key=None):
-        """Initialize the Gemini service."""
+    def __init__(self, api_key=None, raise_retryable_errors=False):
+        """Initialize the Gemini service.
+        
+        With raise_retryable_errors=True, rate-limit and server errors are raised
+        instead of returned as error text, so batch callers can back off and retry.
+        """
         self.api_key = api_key or os.getenv('GEMINI_API_KEY') or current_app.config.get('GEMINI_API_KEY')
         self.openai_api_key = os.getenv('OPENAI_API_KEY') or current_app.config.get('OPENAI_API_KEY')
-        self.use_fallback = False
+        self.raise_retryable_errors = raise_retryable_errors
         
-        # Configure Gemini
+        # Configure Gemini (once per process, shared by every service instance)
         if self.api_key:
-            genai.configure(api_key=self.api_key)
+            get_model_registry().configure(self.api_key)
         else:
-            self.use_fallback = True
             print("Warning: Gemini API key not found. Using OpenAI fallback if available.")
     
-    def generate_text(self, prompt, temperature=0.7, max_tokens=1024):
-        """Generate text using Gemini or fallback to OpenAI."""
-        if not self.use_fallback and self.api_key:
-            try:
-                # Use Gemini
-                model = genai.GenerativeModel('gemini-pro')
-                response = model.generate_content(
-                    prompt,
-                    generation_config=genai.types.GenerationConfig(
-                        temperature=temperature,
-                        max_output_tokens=max_tokens
-                    )
-                )
-                return response.text
-            except Exception as e:
-                print(f"Error using Gemini API: {e}")
-                if self.openai_api_key:
-                    self.use_fallback = True
-                    print("Falling back to OpenAI.")
-                else:
-                    return f"Error: {str(e)}"
-        
-        if self.use_fallback and self.openai_api_key:
-            try:
-                # Use OpenAI as fallback
-                openai.api_key = self.openai_api_key
-                response = openai.Completion.create(
-                    model="gpt-3.5-turbo-instruct",
-                    prompt=prompt,
-                    temperature=temperature,
-                    max_tokens=max_tokens
-                )
-                return response.choices[0].text.strip()
-            except Exception as e:
-                return f"Error: {str(e)}"
-        
-        return "Error: No API keys available for text generation."
+    def generate_text(self, prompt, temperature=0.7, max_tokens=1024, use_cache=True):
+        """Generate text using Gemini or fallback to OpenAI.
+        
+        Each call goes to the healthiest configured provider; a provider whose
+        circuit breaker is open is skipped until it recovers.
+        Responses are cached; pass use_cache=False to always get a fresh answer.
+        """
+        llm_cache = get_llm_cache()
+        
+        backends = []
+        if self.api_key:
+            backends.append(('gemini', 'gemini-pro'))
+        if self.openai_api_key:
+            backends.append(('openai', 'gpt-3.5-turbo-instruct'))
+        if not backends:
+            return "Error: No API keys available for text generation."
+        
+        if use_cache:
+            # Cache hits are answered before routing, so they don't count as provider calls
+            for provider, model_name in backends:
+                cached = llm_cache.get(provider, model_name, prompt, temperature, max_tokens)
+                if cached is not None:
+                    return cached
+        
+        def call_backend(provider, model_name):
+            if provider == 'gemini':
+                def generate():
+                    model = get_model_registry().get_gemini_model(model_name, {
+                        'temperature': temperature,
+                        'max_output_tokens': max_tokens
+                    })
+                    with get_llm_metrics().track(provider, model_name, prompt, feature='gemini_service') as call:
+                        response = model.generate_content(prompt)
+                        call.set_response(response.text)
+                        call.set_usage_from(response)
+                    return response.text
+            else:
+                def generate():
+                    openai.api_key = self.openai_api_key
+                    with get_llm_metrics().track(provider, model_name, prompt, feature='gemini_service') as call:
+                        response = openai.Completion.create(
+                            model=model_name,
+                            prompt=prompt,
+                            temperature=temperature,
+                            max_tokens=max_tokens
+                        )
+                        call.set_response(response.choices[0].text)
+                        call.set_usage_from(response)
+                    return response.choices[0].text.strip()
+            
+            return llm_cache.get_or_generate(provider, model_name, prompt, temperature, max_tokens,
+                                             generate, bypass=not use_cache, lookup=False)
+        
+        try:
+            return get_provider_router().call(backends, call_backend)
+        except Exception as e:
+            print(f"Error generating text: {e}")
+            if self.raise_retryable_errors and is_retryable_error(e):
+                raise
+            return f"Error: {str(e)}"
     
+    @llm_feature('text_analysis')
     def analyze_text(self, text, prompt=None):
         """Analyze text using Gemini or fallback to OpenAI."""
         if not prompt:
@@ -68,8 +113,12 @@ class GeminiService:
         
         return self.generate_text(prompt)
     
+    @llm_feature('essay_grading')
     def grade_essay(self, essay_text, rubric, max_score=100):
         """Grade an essay based on a rubric."""
+        if estimate_tokens(essay_text) > DEFAULT_CHUNK_TOKENS:
+            return self.grade_long_document(essay_text, rubric, max_score, document_type="essay")
+        
         prompt = f"""
         Grade the following essay based on this rubric:
         
@@ -95,6 +144,77 @@ class GeminiService:
         
         return self.generate_text(prompt)
     
+    @llm_feature('long_document_grading')
+    def grade_long_document(self, text, rubric, max_score=100, document_type="essay",
+                            chunk_tokens=DEFAULT_CHUNK_TOKENS):
+        """Grade a document too long for one prompt by grading its sections in parallel.
+        
+        Each section is scored against the rubric separately; the overall score
+        is the section scores weighted by section length. The combined result
+        uses the same SCORE/FEEDBACK/STRENGTHS/AREAS FOR IMPROVEMENT layout as
+        grade_essay.
+        """
+        sections = split_into_chunks(text, chunk_tokens)
+        
+        def grade_section(numbered_section):
+            number, section = numbered_section
+            prompt = f"""
+        You are grading part {number} of {len(sections)} of a long {document_type}. Grade only this part
+        against the rubric, judging how well it does its share of the whole work.
+        
+        Rubric:
+        {rubric}
+        
+        Part {number}:
+        {section}
+        
+        Format your response as:
+        
+        SCORE: [numerical score out of {max_score}]
+        
+        SUMMARY:
+        [two or three sentences on what this part covers and how well]
+        
+        STRENGTHS:
+        [bullet points of strengths]
+        
+        AREAS FOR IMPROVEMENT:
+        [bullet points of areas to improve]
+        """
+            return self.generate_text(prompt)
+        
+        results = map_chunks(grade_section, list(enumerate(sections, 1)))
+        
+        # Reduce: length-weighted score, per-part summaries and merged bullet lists
+        scores = []
+        for result in results:
+            match = re.search(r'SCORE:\s*(\d+(?:\.\d+)?)', result or "", re.IGNORECASE)
+            scores.append(min(float(match.group(1)), max_score) if match else None)
+        score = weighted_mean(scores, [estimate_tokens(section) for section in sections])
+        
+        summaries = []
+        strengths = []
+        improvements = []
+        for number, result in enumerate(results, 1):
+            summary = _extract_section(result, "SUMMARY")
+            if summary:
+                summaries.append(f"Part {number}: {summary}")
+            for bullet in _extract_section(result, "STRENGTHS").splitlines():
+                if bullet.strip() and bullet.strip() not in strengths:
+                    strengths.append(bullet.strip())
+            for bullet in _extract_section(result, "AREAS FOR IMPROVEMENT").splitlines():
+                if bullet.strip() and bullet.strip() not in improvements:
+                    improvements.append(bullet.strip())
+        
+        score_text = f"{score:.1f}" if score is not None else "not available"
+        return (
+            f"SCORE: {score_text}\n\n"
+            f"FEEDBACK:\nThis {document_type} was graded in {len(sections)} parts.\n" + "\n".join(summaries) + "\n\n"
+            "STRENGTHS:\n" + "\n".join(strengths) + "\n\n"
+            "AREAS FOR IMPROVEMENT:\n" + "\n".join(improvements)
+        )
+    
+    @llm_feature('code_grading')
     def grade_code(self, code, language, requirements, test_cases=None, max_score=100):
         """Grade code based on requirements and test cases."""
         test_cases_text = ""
@@ -134,6 +254,44 @@ class GeminiService:
         
         return self.generate_text(prompt)
     
+    @llm_feature('code_grading')
+    def review_code_quality(self, code, language, requirements, test_results, max_score=30):
+        """Review code quality only; correctness has already been scored by running tests."""
+        prompt = f"""
+        Review the quality of the following {language} code written for these requirements:
+        
+        {requirements}
+        
+        The code has already been run against the assignment's test cases, which decide its
+        correctness score. Test results:
+        {test_results}
+        
+        Code:
+        ```{language}
+        {code}
+        ```
+        
+        Do not grade correctness again. Score only code quality: readability, structure,
+        naming, efficiency and best practices. Give a score out of {max_score}.
+        Format your response as:
+        
+        SCORE: [numerical score]
+        
+        CODE QUALITY: [evaluation of code style, efficiency, and best practices]
+        
+        FEEDBACK:
+        [detailed feedback, including hints for any failed tests]
+        
+        STRENGTHS:
+        [bullet points of strengths]
+        
+        AREAS FOR IMPROVEMENT:
+        [bullet points of areas to improve]
+        """
+        
+        return self.generate_text(prompt)
+    
+    @llm_feature('feedback')
     def generate_feedback(self, submission, tone="constructive"):
         """Generate personalized feedback for a submission."""
         # Get the submission details
@@ -160,7 +318,7 @@ class GeminiService:
         Student Score: {score} out of {max_score}
         
         Submission:
-        {content[:1000]}  # Limit content length
+        {truncate_to_budget(content, FEEDBACK_CONTENT_TOKENS)}
         
         Provide detailed, actionable feedback that helps the student understand their strengths and areas for improvement.
         Include specific examples from their work when possible.
@@ -183,15 +341,19 @@ class GeminiService:
         
         return self.generate_text(prompt)
     
-    def check_plagiarism(self, text, reference_texts):
+    @llm_feature('plagiarism_check')
+    def check_plagiarism(self, text, reference_texts, max_text_tokens=1000, max_reference_tokens=2500):
         """Check for potential plagiarism using AI analysis."""
-        references = "\n\n".join([f"Reference {i+1}:\n{ref[:500]}" for i, ref in enumerate(reference_texts)])
+        # Share the reference budget between the (pre-filtered) references
+        per_reference = max(125, max_reference_tokens // max(len(reference_texts), 1))
+        references = "\n\n".join([f"Reference {i+1}:\n{truncate_to_budget(ref, per_reference)}"
+                                   for i, ref in enumerate(reference_texts)])
         
         prompt = f"""
         Analyze the following text for potential plagiarism by comparing it with the reference texts.
         
         Text to check:
-        {text[:1000]}
+        {truncate_to_budget(text, max_text_tokens)}
         
         Reference texts:
         {references}
@@ -214,6 +376,7 @@ class GeminiService:
         
         return self.generate_text(prompt)
     
+    @llm_feature('quiz_generation')
     def generate_quiz_questions(self, topic, num_questions=5, difficulty="medium"):
         """Generate quiz questions on a specific topic."""
         prompt = f"""
@@ -238,6 +401,7 @@ class GeminiService:
         
         return self.generate_text(prompt)
     
+    @llm_feature('resource_suggestions')
     def suggest_resources(self, topic, student_level="intermediate", resource_types=None):
         """Suggest learning resources for a specific topic."""
         if not resource_types:
@@ -1,16 +1,82 @@
 """Grading service for automated assignment grading."""
 import re
+from flask import current_app
 from edumate.services.gemini_service import GeminiService
-from edumate.utils.text_utils import extract_text_from_file, similarity_score
+from edumate.services.batch_grading import BatchGrader, get_rate_limiter
+from edumate.utils.token_budget import DEFAULT_CHUNK_TOKENS, estimate_tokens, split_into_chunks
+from edumate.utils.text_utils import extract_text_from_file, similarity_score, rank_similar_texts
 from edumate.utils.code_utils import run_code, check_code_style
+from edumate.utils.code_sandbox import LANGUAGES as RUNNABLE_LANGUAGES
+from edumate.services.code_test_runner import get_code_test_runner, format_test_report
+
+# Share of a code assignment's points decided by its test cases; the AI scores the rest (code quality)
+CODE_TEST_WEIGHT = 0.7
+
+# Rubric criteria scored from test results rather than by the AI
+CORRECTNESS_CRITERION_PATTERN = re.compile(r'correct|functional|test|output', re.IGNORECASE)
+
+# Test case lines such as "input: 2 3 -> output: 5"
+IO_TEST_CASE_PATTERN = re.compile(
+    r'input\s*:\s*(.*?)\s*(?:->|=>|,|;)?\s*(?:expected\s*)?output\s*:\s*(.*)', re.IGNORECASE
+)
 
 
 class GradingService:
     """Service for automated grading of assignments."""
     
-    def __init__(self):
+    def __init__(self, gemini_service=None):
         """Initialize the grading service."""
-        self.gemini_service = GeminiService()
+        self.gemini_service = gemini_service or GeminiService()
+    
+    def grade_assignment(self, assignment, max_workers=8, on_progress=None):
+        """Grade all ungraded submissions of an assignment concurrently.
+        
+        Calls are paced to the provider's quotas (GEMINI_RPM / GEMINI_TPM) and
+        rate-limit errors are retried. Progress is checkpointed, so running the
+        same assignment again after an interruption only grades what is left.
+        
+        Returns:
+            dict: 'completed' maps submission IDs to scores, 'failed' maps IDs to errors
+        """
+        from edumate.models.submission import Submission
+        
+        app = current_app._get_current_object()
+        # Raise quota errors instead of returning them as feedback text, so they are retried
+        batch_service = GradingService(GeminiService(raise_retryable_errors=True))
+        
+        def grade_one(submission_id):
+            # Each worker uses its own app context and database session
+            with app.app_context():
+                submission = Submission.get_by_id(submission_id)
+                graded_submission = batch_service.grade_submission(submission)
+                if not graded_submission:
+                    raise ValueError(f"Submission {submission_id} could not be graded")
+                graded_submission.save()
+                return {'score': graded_submission.score}
+        
+        ungraded = [s for s in assignment.submissions if not s.is_graded]
+        contents = {s.id: s.content or "" for s in ungraded}
+        # A resubmission changes these, so its checkpointed result is not reused
+        versions = {s.id: [s.content, s.file_path, s.submitted_at] for s in ungraded}
+        
+        grader = BatchGrader(grade_one, rate_limiter=get_rate_limiter('gemini'), max_workers=max_workers)
+        batch_id = f"assignment-{assignment.id}"
+        results = grader.run(
+            batch_id,
+            [s.id for s in ungraded],
+            item_id=lambda submission_id: submission_id,
+            # One grading prompt per section plus a possible plagiarism check
+            estimate_cost=lambda submission_id: (
+                len(split_into_chunks(contents[submission_id])) + 1,
+                2 * estimate_tokens(contents[submission_id]) + 1500
+            ),
+            on_progress=on_progress,
+            item_content=lambda submission_id: versions[submission_id]
+        )
+        
+        if not results['failed']:
+            grader.clear_checkpoint(batch_id)
+        return results
     
     def grade_submission(self, submission):
         """Grade a submission based on its assignment type."""
@@ -50,8 +116,12 @@ class GradingService:
         plagiarism_score = 0
         other_submissions = [s.content for s in assignment.submissions 
                             if s.id != submission.id and s.content]
-        if other_submissions:
-            plagiarism_result = self.gemini_service.check_plagiarism(content, other_submissions)
+        # Only submissions that are locally similar are sent to Gemini
+        candidates = rank_similar_texts(content, other_submissions)
+        if candidates:
+            plagiarism_result = self.gemini_service.check_plagiarism(
+                content, [other_submissions[i] for i, _ in candidates]
+            )
             plagiarism_score = self._extract_plagiarism_score(plagiarism_result)
         
         # Grade the essay
@@ -85,9 +155,15 @@ class GradingService:
         # Determine language from file extension or assignment instructions
         language = self._determine_code_language(submission)
         
-        # Run the code if possible
+        # Run the assignment's test cases when it has input/output tests
+        test_report = None
+        io_test_cases = self._get_io_test_cases(assignment)
+        if language in RUNNABLE_LANGUAGES and io_test_cases:
+            test_report = get_code_test_runner().run_tests(content, language, io_test_cases)
+        
+        # Otherwise run the code once if possible
         run_result = None
-        if language:
+        if language and test_report is None:
             run_result = run_code(content, language)
         
         # Check code style
@@ -99,16 +175,28 @@ class GradingService:
         requirements = assignment.instructions or "No specific requirements provided."
         test_cases = self._extract_test_cases(assignment.instructions)
         
-        # Grade the code
-        grading_result = self.gemini_service.grade_code(
-            content, language, requirements, test_cases, assignment.points
-        )
-        
-        # Extract score and feedback
-        score = self._extract_score(grading_result, assignment.points)
+        if test_report is not None:
+            # Correctness comes from the tests; the AI only reviews code quality
+            correctness_points = assignment.points * CODE_TEST_WEIGHT
+            quality_points = assignment.points - correctness_points
+            grading_result = self.gemini_service.review_code_quality(
+                content, language, requirements, format_test_report(test_report), quality_points
+            )
+            score = (test_report['score'] * correctness_points
+                     + self._extract_score(grading_result, quality_points))
+        else:
+            # Grade the code
+            grading_result = self.gemini_service.grade_code(
+                content, language, requirements, test_cases, assignment.points
+            )
+            
+            # Extract score and feedback
+            score = self._extract_score(grading_result, assignment.points)
         
         # Add execution results to feedback
         feedback = grading_result
+        if test_report is not None:
+            feedback += f"\n\nTEST RESULTS:\n{format_test_report(test_report)}\n"
         if run_result:
             feedback += f"\n\nCODE EXECUTION RESULTS:\n"
             feedback += f"Success: {run_result.get('success', False)}\n"
@@ -126,7 +214,8 @@ class GradingService:
         
         # Add criterion scores if rubric exists
         if assignment.rubric and assignment.rubric.criteria:
-            self._add_criterion_scores(submission, grading_result)
+            self._add_criterion_scores(submission, grading_result,
+                                       test_score=test_report['score'] if test_report else None)
         
         return submission
     
@@ -214,12 +303,17 @@ class GradingService:
         assignment = submission.assignment
         rubric_text = self._get_rubric_text(assignment)
         
-        # Use AI to grade project
-        grading_result = self.gemini_service.analyze_text(
-            content,
-            f"Grade this project submission based on the following rubric:\n{rubric_text}\n\n"
-            f"Provide a score out of {assignment.points} and detailed feedback for each criterion."
-        )
+        # Use AI to grade project; long reports are graded section by section
+        if estimate_tokens(content) > DEFAULT_CHUNK_TOKENS:
+            grading_result = self.gemini_service.grade_long_document(
+                content, rubric_text, assignment.points, document_type="project report"
+            )
+        else:
+            grading_result = self.gemini_service.analyze_text(
+                content,
+                f"Grade this project submission based on the following rubric:\n{rubric_text}\n\n"
+                f"Provide a score out of {assignment.points} and detailed feedback for each criterion."
+            )
         
         # Extract score and feedback
         score = self._extract_score(grading_result, assignment.points)
@@ -311,8 +405,12 @@ class GradingService:
         except ValueError:
             return 0
     
-    def _add_criterion_scores(self, submission, grading_result):
-        """Add criterion scores based on grading result."""
+    def _add_criterion_scores(self, submission, grading_result, test_score=None):
+        """Add criterion scores based on grading result.
+        
+        When test_score (share of passed tests, 0-1) is given, correctness
+        criteria are scored from it instead of from the AI's response.
+        """
         from edumate.models.submission import CriterionScore
         
         assignment = submission.assignment
@@ -325,6 +423,15 @@ class GradingService:
         
         # For each criterion, try to extract a score from the grading result
         for criterion in assignment.rubric.criteria:
+            if test_score is not None and CORRECTNESS_CRITERION_PATTERN.search(criterion.name):
+                criterion_score = CriterionScore(
+                    submission_id=submission.id,
+                    criterion_id=criterion.id,
+                    score=test_score * criterion.max_score
+                )
+                criterion_score.save()
+                continue
+            
             # Look for the criterion name in the grading result
             pattern = rf'{re.escape(criterion.name)}.*?(\d+(?:\.\d+)?)\s*/\s*{criterion.max_score}'
             score_match = re.search(pattern, grading_result, re.IGNORECASE | re.DOTALL)
@@ -384,11 +491,39 @@ class GradingService:
         if test_section_match:
             test_section = test_section_match.group(1)
             # Extract individual test cases (lines starting with - or * or number)
-            case_matches = re.findall(r'(?:^|\n)\s*(?:-|\*|\d+\.)\s*(.*?)(?:\n|$)', test_section)
+            case_matches = re.findall(r'^[ \t]*(?:-|\*|\d+\.)\s*(.*?)[ \t]*$', test_section, re.MULTILINE)
             test_cases.extend(case_matches)
         
         return test_cases
     
+    def _get_io_test_cases(self, assignment):
+        """Get input/output test cases of a code assignment.
+        
+        Uses the assignment's test_cases when it defines them (dicts with
+        'input' and 'expected_output'), otherwise test case lines in the
+        instructions written as "input: ... -> output: ...".
+        """
+        test_cases = getattr(assignment, 'test_cases', None)
+        if test_cases:
+            return [case for case in test_cases if isinstance(case, dict) and 'input' in case]
+        
+        io_cases = []
+        for case in self._extract_test_cases(assignment.instructions):
+            match = IO_TEST_CASE_PATTERN.search(case)
+            if match:
+                io_cases.append({
+                    'input': self._unquote_test_value(match.group(1)),
+                    'expected_output': self._unquote_test_value(match.group(2))
+                })
+        return io_cases
+    
+    def _unquote_test_value(self, value):
+        """Strip quotes or backticks around a test value and expand \\n escapes."""
+        value = value.strip()
+        if len(value) >= 2 and value[0] == value[-1] and value[0] in '"\'`':
+            value = value[1:-1]
+        return value.replace('\\n', '\n')
+    
     def _parse_quiz_answers(self, content):
         """Parse quiz answers from content."""
         if not content:
@@ -0,0 +1,403 @@
+"""Persistent background job queue for EduMate.
+
+Plagiarism checks and auto-grading are slow (TF-IDF refits, LLM calls), so
+they run here instead of inside the request that created the submission.
+Jobs are stored in SQLite, survive restarts, are picked up by worker threads
+in priority order and are retried with exponential backoff when they fail.
+
+Several processes can share the queue. A running job holds a lease that its
+worker renews while the job runs; only jobs whose lease has expired (their
+process died) are picked up again by another worker.
+"""
+
+import os
+import json
+import time
+import uuid
+import random
+import socket
+import sqlite3
+import logging
+import threading
+import traceback
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_DB_PATH = os.path.join('data', 'jobs.db')
+
+# Lower numbers run first
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 5
+PRIORITY_LOW = 10
+
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_SUCCEEDED = 'succeeded'
+STATUS_FAILED = 'failed'
+
+FINISHED_STATUSES = (STATUS_SUCCEEDED, STATUS_FAILED)
+
+# Seconds a running job stays claimed without a heartbeat from its worker
+DEFAULT_LEASE_SECONDS = float(os.getenv('JOB_QUEUE_LEASE_SECONDS', '60'))
+
+
+class JobQueue:
+    """SQLite-backed job queue with worker threads, priorities and retries."""
+
+    def __init__(self,
+                 db_path: str = DEFAULT_DB_PATH,
+                 num_workers: int = 2,
+                 poll_interval: float = 0.5,
+                 base_backoff: float = 2.0,
+                 max_backoff: float = 300.0,
+                 lease_seconds: float = DEFAULT_LEASE_SECONDS):
+        """Initialize the job queue."""
+        self.db_path = db_path
+        self.num_workers = num_workers
+        self.poll_interval = poll_interval
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.lease_seconds = lease_seconds
+        # Owner of the jobs this process claims
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+        self._handlers: Dict[str, Callable[[Dict[str, Any]], Any]] = {}
+        self._workers = []
+        self._heartbeat = None
+        self._stop_event = threading.Event()
+        self._wake_event = threading.Event()
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self._init_database()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open a connection; each thread uses its own."""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init_database(self):
+        """Create the jobs table if needed."""
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    key TEXT UNIQUE,
+                    payload TEXT NOT NULL,
+                    priority INTEGER NOT NULL DEFAULT 5,
+                    status TEXT NOT NULL DEFAULT 'queued',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    max_attempts INTEGER NOT NULL DEFAULT 3,
+                    run_after REAL NOT NULL DEFAULT 0,
+                    result TEXT,
+                    error TEXT,
+                    worker_id TEXT,
+                    lease_expires REAL,
+                    created_at TEXT NOT NULL,
+                    updated_at TEXT NOT NULL
+                );
+
+                CREATE INDEX IF NOT EXISTS idx_jobs_pending
+                    ON jobs (status, priority, run_after, id);
+            """)
+
+            # Databases created before leases were added
+            columns = {row['name'] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if 'worker_id' not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN worker_id TEXT")
+            if 'lease_expires' not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN lease_expires REAL")
+            conn.commit()
+        finally:
+            conn.close()
+
+    def register(self, kind: str, handler: Callable[[Dict[str, Any]], Any]):
+        """Register the function that runs jobs of a given kind.
+
+        The handler receives the job payload and returns a JSON-serializable
+        result. Raising an exception marks the attempt as failed.
+        """
+        self._handlers[kind] = handler
+
+    def enqueue(self,
+                kind: str,
+                payload: Dict[str, Any],
+                key: Optional[str] = None,
+                priority: int = PRIORITY_NORMAL,
+                max_attempts: int = 3,
+                rerun: bool = False) -> Dict[str, Any]:
+        """Add a job to the queue.
+
+        Jobs with the same idempotency key are only queued once; enqueueing an
+        existing key returns the existing job. With rerun=True a finished job
+        with that key is queued again.
+        """
+        now = datetime.now().isoformat()
+        conn = self._connect()
+        try:
+            with conn:
+                cursor = conn.execute(
+                    """INSERT OR IGNORE INTO jobs
+                       (kind, key, payload, priority, max_attempts, created_at, updated_at)
+                       VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                    (kind, key, json.dumps(payload), priority, max_attempts, now, now)
+                )
+
+                if cursor.rowcount:
+                    job_id = cursor.lastrowid
+                else:
+                    row = conn.execute("SELECT * FROM jobs WHERE key = ?", (key,)).fetchone()
+                    job_id = row['id']
+                    if rerun and row['status'] in FINISHED_STATUSES:
+                        conn.execute(
+                            """UPDATE jobs SET status = ?, payload = ?, priority = ?, attempts = 0,
+                               max_attempts = ?, run_after = 0, result = NULL, error = NULL,
+                               updated_at = ? WHERE id = ?""",
+                            (STATUS_QUEUED, json.dumps(payload), priority, max_attempts, now, job_id)
+                        )
+        finally:
+            conn.close()
+
+        self._wake_event.set()
+        return self.get_job(job_id)
+
+    def get_job(self, job_id: int) -> Optional[Dict[str, Any]]:
+        """Get a job by ID."""
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        finally:
+            conn.close()
+        return self._row_to_job(row)
+
+    def get_job_by_key(self, key: str) -> Optional[Dict[str, Any]]:
+        """Get a job by its idempotency key."""
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT * FROM jobs WHERE key = ?", (key,)).fetchone()
+        finally:
+            conn.close()
+        return self._row_to_job(row)
+
+    def get_status(self, key: str) -> Dict[str, Any]:
+        """Get a small status summary for polling clients."""
+        job = self.get_job_by_key(key)
+        if not job:
+            return {'key': key, 'status': 'not_found'}
+
+        status = {
+            'key': key,
+            'job_id': job['id'],
+            'kind': job['kind'],
+            'status': job['status'],
+            'attempts': job['attempts'],
+            'updated_at': job['updated_at']
+        }
+        if job['status'] == STATUS_SUCCEEDED:
+            status['result'] = job['result']
+        elif job['error']:
+            status['error'] = job['error']
+        return status
+
+    def start(self):
+        """Start the worker threads (safe to call more than once)."""
+        with self._lock:
+            if self._workers:
+                return
+
+            self._recover_interrupted_jobs()
+            self._stop_event.clear()
+            self._heartbeat = threading.Thread(
+                target=self._heartbeat_loop,
+                name="edumate-job-heartbeat",
+                daemon=True
+            )
+            self._heartbeat.start()
+            for i in range(self.num_workers):
+                worker = threading.Thread(
+                    target=self._worker_loop,
+                    name=f"edumate-job-worker-{i}",
+                    daemon=True
+                )
+                worker.start()
+                self._workers.append(worker)
+            logger.info(f"Job queue started with {self.num_workers} workers")
+
+    def stop(self, timeout: float = 5.0):
+        """Stop the worker threads after their current job."""
+        with self._lock:
+            self._stop_event.set()
+            self._wake_event.set()
+            for worker in self._workers:
+                worker.join(timeout)
+            self._workers = []
+            if self._heartbeat is not None:
+                self._heartbeat.join(timeout)
+                self._heartbeat = None
+
+    def _recover_interrupted_jobs(self, conn: Optional[sqlite3.Connection] = None):
+        """Requeue running jobs whose lease expired because their process exited.
+
+        Jobs still held by a live worker (in this or another process) keep
+        their lease and are left alone. A job that was lost on its last
+        attempt is marked as failed instead of being run again.
+        """
+        own_conn = conn is None
+        if own_conn:
+            conn = self._connect()
+        try:
+            now = datetime.now().isoformat()
+            expired = "status = ? AND (lease_expires IS NULL OR lease_expires < ?)"
+            with conn:
+                conn.execute(
+                    f"""UPDATE jobs SET status = ?, error = ?, worker_id = NULL, lease_expires = NULL,
+                        updated_at = ? WHERE {expired} AND attempts >= max_attempts""",
+                    (STATUS_FAILED, 'Worker exited while running the job', now, STATUS_RUNNING, time.time())
+                )
+                conn.execute(
+                    f"""UPDATE jobs SET status = ?, worker_id = NULL, lease_expires = NULL, updated_at = ?
+                        WHERE {expired}""",
+                    (STATUS_QUEUED, now, STATUS_RUNNING, time.time())
+                )
+        finally:
+            if own_conn:
+                conn.close()
+
+    def _heartbeat_loop(self):
+        """Renew the leases of this process's running jobs and recover expired ones."""
+        interval = max(self.lease_seconds / 3, 0.1)
+        while not self._stop_event.wait(interval):
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.execute(
+                        "UPDATE jobs SET lease_expires = ? WHERE status = ? AND worker_id = ?",
+                        (time.time() + self.lease_seconds, STATUS_RUNNING, self.worker_id)
+                    )
+                self._recover_interrupted_jobs(conn)
+            except sqlite3.Error as e:
+                logger.error(f"Error renewing job leases: {str(e)}")
+            finally:
+                conn.close()
+
+    def _worker_loop(self):
+        """Claim and run jobs until stopped."""
+        while not self._stop_event.is_set():
+            try:
+                job = self._claim_next()
+            except sqlite3.Error as e:
+                logger.error(f"Error claiming job: {str(e)}")
+                job = None
+
+            if job is None:
+                self._wake_event.wait(self.poll_interval)
+                self._wake_event.clear()
+                continue
+
+            self._run_job(job)
+
+    def _claim_next(self) -> Optional[Dict[str, Any]]:
+        """Atomically mark the next runnable job as running and return it."""
+        kinds = list(self._handlers)
+        if not kinds:
+            return None
+
+        placeholders = ','.join('?' * len(kinds))
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                f"""SELECT * FROM jobs
+                    WHERE status = ? AND run_after <= ? AND kind IN ({placeholders})
+                    ORDER BY priority, run_after, id LIMIT 1""",
+                [STATUS_QUEUED, time.time()] + kinds
+            ).fetchone()
+
+            if row is None:
+                conn.rollback()
+                return None
+
+            conn.execute(
+                """UPDATE jobs SET status = ?, attempts = attempts + 1, worker_id = ?, lease_expires = ?,
+                   updated_at = ? WHERE id = ?""",
+                (STATUS_RUNNING, self.worker_id, time.time() + self.lease_seconds,
+                 datetime.now().isoformat(), row['id'])
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+        job = self._row_to_job(row)
+        job['attempts'] += 1
+        return job
+
+    def _run_job(self, job: Dict[str, Any]):
+        """Run a claimed job and record its outcome."""
+        handler = self._handlers.get(job['kind'])
+
+        try:
+            result = handler(job['payload'])
+            self._finish(job['id'], STATUS_SUCCEEDED, result=result)
+        except Exception as e:
+            logger.error(f"Job {job['id']} ({job['kind']}) failed on attempt {job['attempts']}: {str(e)}")
+            error = f"{type(e).__name__}: {str(e)}"
+
+            if job['attempts'] < job['max_attempts']:
+                # Exponential backoff with jitter
+                delay = min(self.base_backoff * (2 ** (job['attempts'] - 1)), self.max_backoff)
+                delay *= random.uniform(0.5, 1.5)
+                self._finish(job['id'], STATUS_QUEUED, error=error, run_after=time.time() + delay)
+            else:
+                logger.debug(traceback.format_exc())
+                self._finish(job['id'], STATUS_FAILED, error=error)
+
+    def _finish(self, job_id: int, status: str, result: Any = None, error: Optional[str] = None,
+                run_after: float = 0):
+        """Store the outcome of a job attempt, unless the job's lease was lost to another worker."""
+        conn = self._connect()
+        try:
+            with conn:
+                cursor = conn.execute(
+                    """UPDATE jobs SET status = ?, result = ?, error = ?, run_after = ?, worker_id = NULL,
+                       lease_expires = NULL, updated_at = ? WHERE id = ? AND worker_id = ?""",
+                    (status, json.dumps(result, default=str) if result is not None else None,
+                     error, run_after, datetime.now().isoformat(), job_id, self.worker_id)
+                )
+            if not cursor.rowcount:
+                logger.warning(f"Job {job_id} lease expired before it finished; outcome discarded")
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _row_to_job(row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+        """Convert a database row to a job dictionary."""
+        if row is None:
+            return None
+
+        job = dict(row)
+        job['payload'] = json.loads(job['payload'])
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """Get the process-wide job queue."""
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            _job_queue = JobQueue(
+                db_path=os.getenv('JOB_QUEUE_DB', DEFAULT_DB_PATH),
+                num_workers=int(os.getenv('JOB_QUEUE_WORKERS', '2'))
+            )
+        return _job_queue
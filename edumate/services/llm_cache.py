@@ -0,0 +1,181 @@
+"""Persistent cache for LLM responses.
+
+Teachers regenerate feedback, reopen rubric generation and Streamlit reruns
+whole pages, so the same prompt is often sent again minutes after it was
+answered. Responses are cached in SQLite keyed by provider, model, prompt
+and generation settings, expire after a TTL and are evicted least recently
+used first once the cache reaches its size limit.
+"""
+
+import os
+import json
+import hashlib
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional
+
+from edumate.services.single_flight import get_single_flight
+from edumate.utils.disk_cache import DiskCache
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_DB_PATH = os.path.join('data', 'cache', 'llm_responses.db')
+DEFAULT_TTL_SECONDS = 7 * 24 * 3600
+DEFAULT_MAX_SIZE_BYTES = 128 * 1024 * 1024
+
+# Bump to invalidate every cached response (e.g. after prompt format changes)
+CACHE_KEY_VERSION = "v1"
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Normalize a prompt for use in a cache key.
+
+    Only whitespace that cannot change the meaning of a prompt is removed:
+    line endings, trailing whitespace on each line and surrounding blank
+    lines. Indentation is kept because prompts embed student code.
+    """
+    lines = prompt.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+    return '\n'.join(line.rstrip() for line in lines).strip()
+
+
+class LLMResponseCache:
+    """SQLite-backed LLM response cache with TTL, LRU eviction and hit/miss counters."""
+
+    def __init__(self,
+                 db_path: str = DEFAULT_DB_PATH,
+                 ttl_seconds: float = DEFAULT_TTL_SECONDS,
+                 max_size_bytes: int = DEFAULT_MAX_SIZE_BYTES,
+                 enabled: bool = True):
+        """Initialize the response cache."""
+        self.enabled = enabled
+        self._store = DiskCache(db_path, max_size_bytes=max_size_bytes, ttl_seconds=ttl_seconds)
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    @staticmethod
+    def make_key(provider: str,
+                 model: str,
+                 prompt: str,
+                 temperature: float,
+                 max_tokens: int) -> str:
+        """Build the cache key for a request."""
+        key_data = json.dumps([
+            CACHE_KEY_VERSION,
+            provider,
+            model,
+            normalize_prompt(prompt),
+            round(float(temperature), 4),
+            int(max_tokens)
+        ])
+        return hashlib.sha256(key_data.encode('utf-8')).hexdigest()
+
+    def get(self,
+            provider: str,
+            model: str,
+            prompt: str,
+            temperature: float,
+            max_tokens: int) -> Optional[str]:
+        """Get a cached response, or None on a miss."""
+        if not self.enabled:
+            return None
+
+        value = self._store.get(self.make_key(provider, model, prompt, temperature, max_tokens))
+        with self._lock:
+            if value is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+        return value
+
+    def set(self,
+            provider: str,
+            model: str,
+            prompt: str,
+            temperature: float,
+            max_tokens: int,
+            response: str):
+        """Store a response."""
+        if not self.enabled or not response:
+            return
+        self._store.set(self.make_key(provider, model, prompt, temperature, max_tokens), response)
+
+    def get_or_generate(self,
+                        provider: str,
+                        model: str,
+                        prompt: str,
+                        temperature: float,
+                        max_tokens: int,
+                        generate: Callable[[], str],
+                        bypass: bool = False,
+                        lookup: bool = True) -> str:
+        """Return the cached response or call generate() and cache its result.
+
+        Concurrent misses for the same request share a single generate()
+        call (see single_flight). With bypass=True the cache is neither read
+        nor written, for callers that want a fresh (non-deterministic) answer
+        every time. lookup=False skips the first read for callers that have
+        already looked the request up, e.g. before routing it to a provider.
+        """
+        if bypass or not self.enabled:
+            return generate()
+
+        if lookup:
+            cached = self.get(provider, model, prompt, temperature, max_tokens)
+            if cached is not None:
+                logger.debug(f"LLM cache hit for {provider}/{model}")
+                return cached
+
+        key = self.make_key(provider, model, prompt, temperature, max_tokens)
+
+        def generate_once():
+            # Another process may have answered while this one waited for the lock
+            cached = self._store.get(key)
+            if cached is not None:
+                return cached
+
+            response = generate()
+            if isinstance(response, str) and response:
+                self._store.set(key, response)
+            return response
+
+        return get_single_flight().do(key, generate_once)
+
+    def clear(self):
+        """Remove every cached response."""
+        self._store.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Get hit/miss counters for this process and the size of the cache."""
+        with self._lock:
+            hits, misses = self._hits, self._misses
+
+        stats = self._store.stats()
+        stats.update(get_single_flight().stats())
+        stats.update({
+            'enabled': self.enabled,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / (hits + misses) if hits + misses else 0.0,
+            'ttl_seconds': self._store.ttl_seconds
+        })
+        return stats
+
+
+_llm_cache = None
+_llm_cache_lock = threading.Lock()
+
+
+def get_llm_cache() -> LLMResponseCache:
+    """Get the process-wide LLM response cache."""
+    global _llm_cache
+    with _llm_cache_lock:
+        if _llm_cache is None:
+            _llm_cache = LLMResponseCache(
+                db_path=os.getenv('LLM_CACHE_PATH', DEFAULT_DB_PATH),
+                ttl_seconds=float(os.getenv('LLM_CACHE_TTL', DEFAULT_TTL_SECONDS)),
+                max_size_bytes=int(os.getenv('LLM_CACHE_MAX_BYTES', DEFAULT_MAX_SIZE_BYTES)),
+                enabled=os.getenv('LLM_CACHE_ENABLED', 'true').lower() not in ('0', 'false', 'no')
+            )
+        return _llm_cache
@@ -0,0 +1,92 @@
+"""Process-wide registry of configured AI model clients.
+
+genai.configure rebuilds the client (and its HTTP connections) every time it
+is called, and constructing a GenerativeModel per request adds setup cost to
+every call. The registry configures the Gemini SDK once per API key and
+keeps one model handle per (model name, generation config) that all services
+and threads share.
+"""
+
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+def _freeze_config(generation_config: Optional[Dict[str, Any]]) -> tuple:
+    """Turn a generation config dict into a hashable key."""
+    if not generation_config:
+        return ()
+    return tuple(sorted((key, value) for key, value in generation_config.items() if value is not None))
+
+
+class ModelClientRegistry:
+    """Thread-safe cache of configured Gemini model handles."""
+
+    def __init__(self):
+        """Initialize an empty registry."""
+        self._lock = threading.Lock()
+        self._api_key = None
+        self._models = {}
+
+    def configure(self, api_key: str) -> bool:
+        """Configure the Gemini SDK, skipping the call if this key is already active.
+
+        Returns:
+            bool: True if the SDK is configured with the key
+        """
+        if not api_key:
+            return False
+
+        with self._lock:
+            if self._api_key == api_key:
+                return True
+
+            import google.generativeai as genai
+            genai.configure(api_key=api_key)
+
+            # Handles created under the previous key would keep using it
+            self._api_key = api_key
+            self._models.clear()
+            logger.info("Gemini client configured")
+            return True
+
+    @property
+    def is_configured(self) -> bool:
+        """Whether an API key has been configured."""
+        return self._api_key is not None
+
+    def get_gemini_model(self, model_name: str, generation_config: Optional[Dict[str, Any]] = None):
+        """Get the shared GenerativeModel for a model name and generation config."""
+        key = (model_name, _freeze_config(generation_config))
+
+        with self._lock:
+            model = self._models.get(key)
+            if model is None:
+                import google.generativeai as genai
+                model = genai.GenerativeModel(
+                    model_name=model_name,
+                    generation_config=dict(key[1]) or None
+                )
+                self._models[key] = model
+            return model
+
+    def clear(self):
+        """Drop all cached model handles."""
+        with self._lock:
+            self._models.clear()
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_model_registry() -> ModelClientRegistry:
+    """Get the process-wide model client registry."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ModelClientRegistry()
+        return _registry
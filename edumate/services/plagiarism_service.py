@@ -1,6 +1,42 @@
 """Plagiarism service for detecting plagiarism in student submissions."""
+import os
+import threading
 from edumate.services.gemini_service import GeminiService
-from edumate.utils.text_utils import extract_text_from_file, similarity_score
+from edumate.utils.text_utils import extract_text_from_file, similarity_score, rank_similar_texts
+from edumate.utils.code_fingerprint import CodeFingerprintIndex
+from edumate.utils.code_utils import get_language_from_filename
+from edumate.utils.token_budget import truncate_to_budget
+
+
+CODE_INDEX_DIR = os.path.join('data', 'plagiarism', 'code_index')
+
+# Tokens of submission text sent for the internet-source check
+WEB_CHECK_CONTENT_TOKENS = 1000
+
+_code_indexes = {}
+# Per-course locks, so indexing one course's submissions doesn't block checks in other courses
+_code_index_locks = {}
+_code_indexes_lock = threading.Lock()
+
+
+def get_code_index(course_id):
+    """Get the process-wide fingerprint index of a course."""
+    with _code_indexes_lock:
+        index = _code_indexes.get(course_id)
+        if index is None:
+            index = CodeFingerprintIndex(os.path.join(CODE_INDEX_DIR, f"course_{course_id}.db"))
+            legacy_path = os.path.join(CODE_INDEX_DIR, f"course_{course_id}.json")
+            if not len(index) and os.path.exists(legacy_path):
+                index.import_json(legacy_path)
+            _code_indexes[course_id] = index
+            _code_index_locks[course_id] = threading.Lock()
+        return index
+
+
+def _code_index_lock(course_id):
+    """Get the lock guarding the first indexing of a course (after get_code_index)."""
+    with _code_indexes_lock:
+        return _code_index_locks[course_id]
 
 
 class PlagiarismService:
@@ -33,6 +69,10 @@ class PlagiarismService:
                 'suspicious_passages': []
             }
         
+        # Code is compared structurally, so renamed variables do not hide copying
+        if self._is_code_submission(submission):
+            return self.check_code_plagiarism(submission, content)
+        
         # Get reference submissions if not provided
         if reference_submissions is None:
             reference_submissions = self._get_reference_submissions(submission)
@@ -63,8 +103,20 @@ class PlagiarismService:
                 'suspicious_passages': []
             }
         
+        # Rank references locally and only send the close ones to Gemini
+        candidates = rank_similar_texts(content, reference_texts)
+        if not candidates:
+            submission.plagiarism_score = 0
+            return {
+                'plagiarism_score': 0,
+                'analysis': 'No reference submission is similar enough to warrant a detailed analysis.',
+                'suspicious_passages': []
+            }
+        
         # Use Gemini to check for plagiarism
-        plagiarism_result = self.gemini_service.check_plagiarism(content, reference_texts)
+        plagiarism_result = self.gemini_service.check_plagiarism(
+            content, [reference_texts[i] for i, _ in candidates]
+        )
         
         # Parse the result
         result = self._parse_plagiarism_result(plagiarism_result)
@@ -105,7 +157,7 @@ class PlagiarismService:
         Analyze the following text and determine if it appears to be plagiarized from common internet sources.
         
         Text to check:
-        {content[:2000]}  # Limit length
+        {truncate_to_budget(content, WEB_CHECK_CONTENT_TOKENS)}
         
         Provide an analysis that includes:
         1. An estimated plagiarism percentage
@@ -134,6 +186,56 @@ class PlagiarismService:
         
         return result
     
+    def check_code_plagiarism(self, submission, content=None, threshold=0.5):
+        """Check a code submission against the course's code corpus."""
+        if content is None:
+            content = self._get_submission_content(submission)
+        
+        if not content.strip():
+            return {
+                'plagiarism_score': 0,
+                'analysis': 'No content to check for plagiarism.',
+                'suspicious_passages': []
+            }
+        
+        course = submission.assignment.course
+        language = get_language_from_filename(submission.file_path) or 'python'
+        index = self._get_code_index(course)
+        
+        matches = index.query(
+            content,
+            language,
+            threshold=threshold,
+            exclude=lambda doc_id, metadata: metadata.get('student_id') == submission.student_id
+        )
+        
+        # Add the submission so later submissions are checked against it
+        index.add(submission.id, content, language, {
+            'student_id': submission.student_id,
+            'assignment_id': submission.assignment_id
+        })
+        
+        plagiarism_score = matches[0]['similarity'] if matches else 0
+        suspicious_passages = [
+            f"Submission {match['doc_id']} (assignment {match['metadata'].get('assignment_id')}) "
+            f"is {match['similarity']:.0%} structurally similar"
+            for match in matches
+        ]
+        
+        if matches:
+            analysis = (f"Found {len(matches)} code submission(s) in this course with matching "
+                        f"normalized structure, ignoring identifier names, comments and formatting.")
+        else:
+            analysis = "No structurally similar code submissions found in this course."
+        
+        submission.plagiarism_score = plagiarism_score
+        
+        return {
+            'plagiarism_score': plagiarism_score,
+            'analysis': analysis,
+            'suspicious_passages': suspicious_passages
+        }
+    
     def calculate_similarity(self, submission1, submission2):
         """Calculate similarity score between two submissions."""
         if not submission1 or not submission2:
@@ -158,6 +260,42 @@ class PlagiarismService:
         # Calculate similarity score
         return similarity_score(content1, content2)
     
+    def _is_code_submission(self, submission):
+        """Check whether a submission belongs to a code assignment."""
+        assignment = submission.assignment
+        if assignment and assignment.assignment_type == 'code':
+            return True
+        return get_language_from_filename(submission.file_path) not in (None, 'html', 'css')
+    
+    def _get_submission_content(self, submission):
+        """Get the text of a submission, preferring the attached file."""
+        content = submission.content or ""
+        if submission.file_path:
+            file_content = extract_text_from_file(submission.file_path)
+            if file_content:
+                content = file_content
+        return content
+    
+    def _get_code_index(self, course):
+        """Get the fingerprint index for a course, building it on first use."""
+        index = get_code_index(course.id)
+        with _code_index_lock(course.id):
+            # Marked once done, so a course without code submissions isn't rescanned on every check
+            if index.get_setting('existing_submissions_indexed') is None:
+                # First use for this course: index the existing code submissions once
+                for assignment in course.assignments:
+                    if assignment.assignment_type != 'code':
+                        continue
+                    for existing in assignment.submissions:
+                        code = self._get_submission_content(existing)
+                        if code.strip():
+                            index.add(existing.id, code,
+                                      get_language_from_filename(existing.file_path) or 'python',
+                                      {'student_id': existing.student_id,
+                                       'assignment_id': existing.assignment_id})
+                index.set_setting('existing_submissions_indexed', '1')
+        return index
+    
     def _get_reference_submissions(self, submission):
         """Get reference submissions for plagiarism checking."""
         if not submission or not submission.assignment:
@@ -0,0 +1,346 @@
+"""Health-aware routing of LLM calls across providers.
+
+Every call made through the router is recorded per (provider, model): a
+rolling window of outcomes gives the error rate and p95 latency of each
+backend. A circuit breaker opens when a backend keeps failing, so calls skip
+it immediately instead of waiting for timeouts, and after a cooldown it lets
+a single probe call through (half-open) to find out whether the backend has
+recovered. Each call goes to the healthiest backend that is available and
+falls through to the next one on failure.
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+DEFAULT_WINDOW_SECONDS = 300
+DEFAULT_MIN_CALLS = 5
+DEFAULT_ERROR_RATE_THRESHOLD = 0.5
+DEFAULT_CONSECUTIVE_FAILURES = 5
+DEFAULT_COOLDOWN_SECONDS = 30
+DEFAULT_MAX_COOLDOWN_SECONDS = 600
+DEFAULT_SLOW_LATENCY_SECONDS = 20
+
+
+class ProviderUnavailableError(RuntimeError):
+    """Raised when every candidate backend has an open circuit."""
+
+    # Reported as 503 so batch callers treat it as retryable
+    code = 503
+
+
+def is_client_error(error: Exception) -> bool:
+    """Check whether an error was caused by the request itself (4xx other than 429).
+
+    Such errors say nothing about the health of the provider and are not
+    counted against its circuit breaker.
+    """
+    if isinstance(error, (ValueError, TypeError)):
+        return True
+
+    for status in (getattr(error, 'code', None),
+                   getattr(error, 'status_code', None),
+                   getattr(getattr(error, 'response', None), 'status_code', None)):
+        if isinstance(status, int) and 400 <= status < 500 and status != 429:
+            return True
+    return False
+
+
+class CircuitBreaker:
+    """Rolling health statistics and circuit state for one backend."""
+
+    def __init__(self,
+                 name: str,
+                 window_seconds: float = DEFAULT_WINDOW_SECONDS,
+                 min_calls: int = DEFAULT_MIN_CALLS,
+                 error_rate_threshold: float = DEFAULT_ERROR_RATE_THRESHOLD,
+                 consecutive_failures: int = DEFAULT_CONSECUTIVE_FAILURES,
+                 cooldown_seconds: float = DEFAULT_COOLDOWN_SECONDS,
+                 max_cooldown_seconds: float = DEFAULT_MAX_COOLDOWN_SECONDS):
+        """Initialize a closed breaker.
+
+        Args:
+            name: Backend name used in log messages
+            window_seconds: Length of the rolling window of recorded calls
+            min_calls: Calls needed in the window before the error rate can open the circuit
+            error_rate_threshold: Error rate in the window that opens the circuit
+            consecutive_failures: Failures in a row that open the circuit regardless of rate
+            cooldown_seconds: Time an open circuit waits before a probe call
+            max_cooldown_seconds: Longest cooldown after repeated failed probes
+        """
+        self.name = name
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.error_rate_threshold = error_rate_threshold
+        self.consecutive_failures = consecutive_failures
+        self.cooldown_seconds = cooldown_seconds
+        self.max_cooldown_seconds = max_cooldown_seconds
+
+        self.state = CLOSED
+        self._calls = deque()
+        self._failures_in_row = 0
+        self._opened_at = 0.0
+        self._current_cooldown = cooldown_seconds
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def _prune(self, now: float):
+        while self._calls and now - self._calls[0][0] > self.window_seconds:
+            self._calls.popleft()
+
+    def _open(self, now: float, reason: str):
+        self.state = OPEN
+        self._opened_at = now
+        self._probe_in_flight = False
+        logger.warning(f"Circuit for {self.name} opened ({reason}); "
+                       f"retrying in {self._current_cooldown:.0f}s")
+
+    def allow_request(self) -> bool:
+        """Check whether a call may go to this backend, claiming the probe slot if half-open."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+
+            now = time.monotonic()
+            if self.state == OPEN and now - self._opened_at >= self._current_cooldown:
+                self.state = HALF_OPEN
+                self._probe_in_flight = False
+                logger.info(f"Circuit for {self.name} half-open, probing")
+
+            if self.state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    @property
+    def probe_due(self) -> bool:
+        """Whether the circuit is waiting for a probe call to test recovery."""
+        with self._lock:
+            if self.state == OPEN:
+                return time.monotonic() - self._opened_at >= self._current_cooldown
+            return self.state == HALF_OPEN and not self._probe_in_flight
+
+    def record_success(self, latency: float):
+        """Record a successful call."""
+        with self._lock:
+            now = time.monotonic()
+            self._calls.append((now, True, latency))
+            self._prune(now)
+            self._failures_in_row = 0
+
+            if self.state != CLOSED:
+                logger.info(f"Circuit for {self.name} closed after successful probe")
+                self.state = CLOSED
+                self._probe_in_flight = False
+                self._current_cooldown = self.cooldown_seconds
+
+    def record_failure(self, latency: float):
+        """Record a failed call, opening the circuit if the backend looks unhealthy."""
+        with self._lock:
+            now = time.monotonic()
+            self._calls.append((now, False, latency))
+            self._prune(now)
+            self._failures_in_row += 1
+
+            if self.state == HALF_OPEN:
+                # Failed probe: back off longer before the next one
+                self._current_cooldown = min(self._current_cooldown * 2, self.max_cooldown_seconds)
+                self._open(now, "probe failed")
+                return
+
+            if self.state != CLOSED:
+                return
+
+            if self._failures_in_row >= self.consecutive_failures:
+                self._open(now, f"{self._failures_in_row} failures in a row")
+                return
+
+            total = len(self._calls)
+            failures = sum(1 for _, ok, _ in self._calls if not ok)
+            if total >= self.min_calls and failures / total >= self.error_rate_threshold:
+                self._open(now, f"error rate {failures / total:.0%} over {total} calls")
+
+    def release_probe(self):
+        """Give back an unused probe slot (the call was not a health signal)."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Get the current state and rolling statistics."""
+        with self._lock:
+            self._prune(time.monotonic())
+            total = len(self._calls)
+            failures = sum(1 for _, ok, _ in self._calls if not ok)
+            latencies = sorted(latency for _, ok, latency in self._calls if ok)
+
+        return {
+            'state': self.state,
+            'calls': total,
+            'failures': failures,
+            'error_rate': failures / total if total else 0.0,
+            'p95_latency': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else 0.0
+        }
+
+
+class ProviderRouter:
+    """Route LLM calls to the healthiest available (provider, model) backend."""
+
+    def __init__(self,
+                 slow_latency_seconds: float = DEFAULT_SLOW_LATENCY_SECONDS,
+                 breaker_factory: Optional[Callable[[str], CircuitBreaker]] = None):
+        """Initialize the router.
+
+        Args:
+            slow_latency_seconds: p95 latency above which a backend is ranked
+                behind faster ones
+            breaker_factory: Builds the breaker for a backend name
+        """
+        self.slow_latency_seconds = slow_latency_seconds
+        self._breaker_factory = breaker_factory or CircuitBreaker
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, provider: str, model: str) -> CircuitBreaker:
+        """Get the circuit breaker of a backend."""
+        key = (provider, model)
+        with self._lock:
+            breaker = self._breakers.get(key)
+            if breaker is None:
+                breaker = self._breaker_factory(f"{provider}/{model}")
+                self._breakers[key] = breaker
+            return breaker
+
+    def rank(self, backends: Sequence[Tuple[str, str]]) -> List[Tuple[str, str]]:
+        """Order backends from healthiest to least healthy.
+
+        Closed circuits come before half-open and open ones, then lower error
+        rates, then backends that are not slow; the caller's order breaks ties,
+        so the preferred provider keeps its place while it is healthy. A
+        backend due for a recovery probe keeps its preferred place, otherwise
+        a healthy fallback would always win and the probe would never be sent.
+        """
+        state_order = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+        def health_key(indexed):
+            index, backend = indexed
+            breaker = self.breaker(*backend)
+            if breaker.probe_due:
+                return (0, 0.0, False, index)
+            stats = breaker.snapshot()
+            # A few failures are not enough to demote the preferred backend
+            error_rate = stats['error_rate'] if stats['calls'] >= breaker.min_calls else 0.0
+            return (
+                state_order[stats['state']],
+                round(error_rate, 1),
+                stats['p95_latency'] > self.slow_latency_seconds,
+                index
+            )
+
+        return [backend for _, backend in sorted(enumerate(backends), key=health_key)]
+
+    def select(self, backends: Sequence[Tuple[str, str]]) -> Optional[Tuple[str, str]]:
+        """Pick the backend for a call made outside call() (e.g. a stream).
+
+        The caller must report the outcome with record(), which also frees
+        the probe slot of a half-open backend.
+
+        Returns:
+            tuple: (provider, model), or None if every circuit is open
+        """
+        for backend in self.rank(backends):
+            if self.breaker(*backend).allow_request():
+                return backend
+        return None
+
+    def record(self, provider: str, model: str, latency: float, error: Optional[Exception] = None):
+        """Record the outcome of a call; client errors are not counted against the backend."""
+        breaker = self.breaker(provider, model)
+        if error is None:
+            breaker.record_success(latency)
+        elif is_client_error(error) or getattr(error, 'single_flight_shared', False):
+            # Shared errors were already recorded for the call that produced them
+            breaker.release_probe()
+        else:
+            breaker.record_failure(latency)
+
+    def call(self,
+             backends: Sequence[Tuple[str, str]],
+             fn: Callable[[str, str], Any]) -> Any:
+        """Call fn(provider, model) on the healthiest backend, falling through on failure.
+
+        Args:
+            backends: Candidate (provider, model) pairs in order of preference
+            fn: Makes the call on one backend
+
+        Returns:
+            The result of the first successful call
+
+        Raises:
+            ProviderUnavailableError: If every backend's circuit is open
+            Exception: The last backend error if every attempted call failed
+        """
+        last_error = None
+        for provider, model in self.rank(backends):
+            breaker = self.breaker(provider, model)
+            if not breaker.allow_request():
+                continue
+
+            start = time.monotonic()
+            try:
+                result = fn(provider, model)
+            except Exception as e:
+                self.record(provider, model, time.monotonic() - start, e)
+                logger.warning(f"{provider}/{model} call failed: {str(e)}")
+                last_error = e
+                continue
+
+            self.record(provider, model, time.monotonic() - start)
+            return result
+
+        if last_error is not None:
+            raise last_error
+        raise ProviderUnavailableError(
+            "All AI providers are temporarily unavailable: " + ", ".join(f"{p}/{m}" for p, m in backends)
+        )
+
+    def health(self) -> Dict[str, Dict[str, Any]]:
+        """Get the state and rolling statistics of every backend seen so far."""
+        with self._lock:
+            breakers = list(self._breakers.items())
+        return {f"{provider}/{model}": breaker.snapshot() for (provider, model), breaker in breakers}
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_provider_router() -> ProviderRouter:
+    """Get the process-wide provider router."""
+    global _router
+    with _router_lock:
+        if _router is None:
+            def breaker_factory(name):
+                return CircuitBreaker(
+                    name,
+                    window_seconds=float(os.getenv('LLM_BREAKER_WINDOW', DEFAULT_WINDOW_SECONDS)),
+                    min_calls=int(os.getenv('LLM_BREAKER_MIN_CALLS', DEFAULT_MIN_CALLS)),
+                    error_rate_threshold=float(os.getenv('LLM_BREAKER_ERROR_RATE', DEFAULT_ERROR_RATE_THRESHOLD)),
+                    consecutive_failures=int(os.getenv('LLM_BREAKER_FAILURES', DEFAULT_CONSECUTIVE_FAILURES)),
+                    cooldown_seconds=float(os.getenv('LLM_BREAKER_COOLDOWN', DEFAULT_COOLDOWN_SECONDS))
+                )
+
+            _router = ProviderRouter(
+                slow_latency_seconds=float(os.getenv('LLM_SLOW_LATENCY', DEFAULT_SLOW_LATENCY_SECONDS)),
+                breaker_factory=breaker_factory
+            )
+        return _router
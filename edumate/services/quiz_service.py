@@ -2,19 +2,39 @@
 Quiz Service - Handles quiz generation, management, and grading
 """
 import os
+import re
 import json
 import uuid
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import Dict, List, Any, Optional, Tuple
 import requests
 from dotenv import load_dotenv
 
+from edumate.services.single_flight import get_single_flight
+from edumate.utils.answer_matching import CORRECT, INCORRECT, FALLBACK_THRESHOLD, score_answer
+from edumate.utils.disk_cache import DiskCache
+from edumate.utils.http_client import get_http_session
+from edumate.utils.llm_metrics import get_llm_metrics, llm_feature
+
 # Load environment variables
 load_dotenv()
 
 # Gemini API configuration
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
 GEMINI_API_BASE_URL = "https://generativelanguage.googleapis.com/v1/models"
+GEMINI_MODEL = os.environ.get("QUIZ_GEMINI_MODEL", "gemini-1.5-flash")
+
+# AI verdicts for short answers, keyed by question and normalized answer
+VERDICT_CACHE_PATH = os.path.join("data", "cache", "quiz_verdicts.db")
+VERDICT_CACHE_VERSION = "v1"
+
+# Short answers evaluated individually at the same time when the batch misses some
+MAX_CONCURRENT_EVALUATIONS = 4
+
+# Verdict at the start of a single-answer evaluation, e.g. "CORRECT - ..." or "**INCORRECT**"
+VERDICT_PATTERN = re.compile(r'^\W*(CORRECT|INCORRECT)\b')
 
 class QuizService:
     """Service for managing quiz operations including AI-generated quizzes"""
@@ -25,6 +45,8 @@ class QuizService:
         # Create data directory if it doesn't exist
         if not os.path.exists(data_path):
             os.makedirs(data_path)
+        self.verdict_cache = DiskCache(os.getenv("QUIZ_VERDICT_CACHE_PATH", VERDICT_CACHE_PATH),
+                                       max_size_bytes=16 * 1024 * 1024)
     
     def get_quizzes_by_course(self, course_id: str) -> List[Dict[str, Any]]:
         """Get all quizzes for a specific course"""
@@ -136,6 +158,7 @@ class QuizService:
         
         return False, "Quiz not found!"
     
+    @llm_feature('quiz_generation')
     def generate_quiz_with_ai(self, subject: str, topic: str, difficulty: str, num_questions: int = 10) -> Dict[str, Any]:
         """Generate a quiz using Gemini AI"""
         # Create the prompt for Gemini
@@ -171,22 +194,7 @@ class QuizService:
         
         # Call Gemini API
         try:
-            headers = {
-                'Authorization': f'Bearer {GEMINI_API_KEY}',
-                'Content-Type': 'application/json'
-            }
-            data = {
-                'prompt': prompt,
-                'maxTokens': 2048,
-                'temperature': 0.7,
-                'topP': 1,
-                'frequencyPenalty': 0,
-                'presencePenalty': 0
-            }
-            response = requests.post(f'{GEMINI_API_BASE_URL}/generate', headers=headers, json=data)
-            
-            # Extract the JSON response
-            response_text = response.json().get('text', '')
+            response_text = self._call_gemini(prompt)
             
             # Clean the response if it contains markdown code blocks
             if "```json" in response_text:
@@ -276,6 +284,16 @@ class QuizService:
         correct_answers = 0
         question_results = []
         
+        # Evaluate all short answers of the attempt together
+        short_answer_ids = [str(i) for i, question in enumerate(quiz.get("questions", []))
+                            if question.get("type") == "short_answer"]
+        short_answer_verdicts = dict(zip(short_answer_ids, self._evaluate_short_answers([
+            (quiz["questions"][int(q_id)].get("question", ""),
+             quiz["questions"][int(q_id)].get("correct_answer", ""),
+             submission.get("answers", {}).get(q_id, ""))
+            for q_id in short_answer_ids
+        ])))
+        
         # Grade each question
         for i, question in enumerate(quiz.get("questions", [])):
             q_id = str(i)
@@ -289,18 +307,7 @@ class QuizService:
             elif question.get("type") == "fill_blank":
                 is_correct = student_answer.lower() == question.get("correct_answer", "").lower()
             elif question.get("type") == "short_answer":
-                # For short answers, use AI to evaluate
-                try:
-                    is_correct = self._evaluate_short_answer(
-                        student_answer, 
-                        question.get("correct_answer", ""),
-                        question.get("question", "")
-                    )
-                except:
-                    # If AI evaluation fails, more lenient scoring
-                    is_correct = any(word.lower() in student_answer.lower() 
-                                     for word in question.get("correct_answer", "").split() 
-                                     if len(word) > 3)
+                is_correct = short_answer_verdicts[q_id]
             
             # Add to results
             if is_correct:
@@ -329,10 +336,123 @@ class QuizService:
             "feedback": feedback
         }
     
+    @staticmethod
+    def _normalize_answer(answer: str) -> str:
+        """Normalize an answer for verdict caching (case, whitespace, surrounding punctuation)"""
+        return " ".join(answer.lower().split()).strip(" .,;:!?\"'")
+    
+    def _verdict_key(self, question: str, correct_answer: str, student_answer: str) -> str:
+        """Cache key of the verdict for an answer to a question"""
+        key_data = json.dumps([VERDICT_CACHE_VERSION, question.strip(), correct_answer.strip(),
+                               self._normalize_answer(student_answer)])
+        return hashlib.sha256(key_data.encode("utf-8")).hexdigest()
+    
+    @staticmethod
+    def _local_match(student_answer: str, correct_answer: str) -> bool:
+        """Local verdict used when AI evaluation is unavailable"""
+        return score_answer(student_answer, correct_answer)["score"] >= FALLBACK_THRESHOLD
+    
+    @llm_feature('quiz_answer_evaluation')
+    def _evaluate_short_answers(self, items: List[Tuple[str, str, str]]) -> List[bool]:
+        """Evaluate several short answers with one AI request
+        
+        Args:
+            items: (question, expected answer, student answer) for each short answer
+        
+        Returns:
+            List of verdicts in the order of items. Clear matches and misses
+            are decided locally; AI verdicts are cached per question and
+            normalized answer; answers the batched response does not cover
+            are evaluated individually, a few at a time.
+        """
+        verdicts = [None] * len(items)
+        pending = []
+        for index, (question, correct_answer, student_answer) in enumerate(items):
+            local_verdict = score_answer(student_answer, correct_answer)["verdict"]
+            if local_verdict in (CORRECT, INCORRECT):
+                verdicts[index] = local_verdict == CORRECT
+                continue
+            
+            cached = self.verdict_cache.get(self._verdict_key(question, correct_answer, student_answer))
+            if cached is not None:
+                verdicts[index] = cached == "1"
+            else:
+                pending.append(index)
+        
+        if not pending:
+            return verdicts
+        
+        answer_blocks = []
+        for number, index in enumerate(pending, start=1):
+            question, correct_answer, student_answer = items[index]
+            answer_blocks.append(f"""Answer {number}:
+        Question: {question}
+        Expected answer key points: {correct_answer}
+        Student answer: {student_answer}""")
+        
+        prompt = f"""Evaluate whether each student answer correctly addresses its question.
+        
+        {chr(10).join(answer_blocks)}
+        
+        For each answer, decide whether it adequately addresses the key points expected in the answer.
+        The student doesn't need to use the exact same words, but should demonstrate understanding of the core concepts.
+        
+        Respond with only a JSON array with one object per answer, in this format:
+        [{{"answer": 1, "correct": true}}, {{"answer": 2, "correct": false}}]
+        """
+        
+        batch_verdicts = {}
+        try:
+            response_text = self._call_gemini(prompt)
+        except Exception as e:
+            # The API itself failed; asking again per answer would fail the same way
+            print(f"Error evaluating short answers in batch: {e}")
+            for index in pending:
+                question, correct_answer, student_answer = items[index]
+                verdicts[index] = self._local_match(student_answer, correct_answer)
+            return verdicts
+        
+        try:
+            if "```" in response_text:
+                response_text = response_text.split("```")[1].split("```")[0]
+                if response_text.startswith("json"):
+                    response_text = response_text[4:]
+            for entry in json.loads(response_text.strip()):
+                number = int(entry.get("answer", 0))
+                if 1 <= number <= len(pending) and isinstance(entry.get("correct"), bool):
+                    batch_verdicts[pending[number - 1]] = entry["correct"]
+        except Exception as e:
+            print(f"Error parsing batched short answer verdicts: {e}")
+        
+        missing = [index for index in pending if index not in batch_verdicts]
+        if missing:
+            def evaluate_one(index):
+                question, correct_answer, student_answer = items[index]
+                return self._evaluate_short_answer(student_answer, correct_answer, question)
+            
+            with ThreadPoolExecutor(max_workers=min(MAX_CONCURRENT_EVALUATIONS, len(missing))) as executor:
+                for index, verdict in zip(missing, executor.map(evaluate_one, missing)):
+                    verdicts[index] = verdict
+        
+        for index, verdict in batch_verdicts.items():
+            verdicts[index] = verdict
+            question, correct_answer, student_answer = items[index]
+            self.verdict_cache.set(self._verdict_key(question, correct_answer, student_answer),
+                                   "1" if verdict else "0")
+        
+        return verdicts
+    
+    @llm_feature('quiz_answer_evaluation')
     def _evaluate_short_answer(self, student_answer: str, correct_answer: str, question: str) -> bool:
         """Use Gemini AI to evaluate a short answer response"""
-        if not student_answer:
-            return False
+        local_verdict = score_answer(student_answer, correct_answer)["verdict"]
+        if local_verdict in (CORRECT, INCORRECT):
+            return local_verdict == CORRECT
+        
+        cache_key = self._verdict_key(question, correct_answer, student_answer)
+        cached = self.verdict_cache.get(cache_key)
+        if cached is not None:
+            return cached == "1"
             
         prompt = f"""Evaluate if the student's answer correctly addresses the question.
         
@@ -347,29 +467,78 @@ class QuizService:
         """
         
         try:
-            headers = {
-                'Authorization': f'Bearer {GEMINI_API_KEY}',
-                'Content-Type': 'application/json'
-            }
-            data = {
-                'prompt': prompt,
-                'maxTokens': 2048,
+            match = VERDICT_PATTERN.match(self._call_gemini(prompt).strip().upper())
+        except Exception as e:
+            print(f"Error evaluating short answer: {e}")
+            match = None
+        
+        if match is None:
+            # AI evaluation failed or gave no verdict; fall back to the local score (not cached)
+            return self._local_match(student_answer, correct_answer)
+        
+        is_correct = match.group(1) == "CORRECT"
+        self.verdict_cache.set(cache_key, "1" if is_correct else "0")
+        return is_correct
+    
+    def _call_gemini(self, prompt: str) -> str:
+        """Send a prompt to the Gemini API and return the response text
+        
+        Identical prompts sent at the same time (e.g. a whole class opening the
+        same quiz) share one API call.
+        """
+        key = "quiz:" + hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+        return get_single_flight().do(key, lambda: self._request_gemini(prompt))
+    
+    def _request_gemini(self, prompt: str) -> str:
+        """Make one Gemini API request
+        
+        Raises:
+            requests.HTTPError: If the API returned an error status
+            ValueError: If no API key is configured or the response contained no text
+        """
+        if not GEMINI_API_KEY:
+            raise ValueError("Gemini API key not configured")
+        
+        headers = {
+            'Content-Type': 'application/json',
+            'x-goog-api-key': GEMINI_API_KEY
+        }
+        data = {
+            'contents': [{'parts': [{'text': prompt}]}],
+            'generationConfig': {
                 'temperature': 0.7,
-                'topP': 1,
-                'frequencyPenalty': 0,
-                'presencePenalty': 0
+                'maxOutputTokens': 2048,
+                'topP': 1
             }
-            response = requests.post(f'{GEMINI_API_BASE_URL}/generate', headers=headers, json=data)
-            
-            # Check if the response indicates the answer is correct
-            response_text = response.json().get('text', '').strip().upper()
-            return response_text.startswith("CORRECT")
-        except:
-            # If AI evaluation fails, fall back to keyword matching
-            return any(word.lower() in student_answer.lower() 
-                      for word in correct_answer.split() 
-                      if len(word) > 3)
+        }
+        api_url = f'{GEMINI_API_BASE_URL}/{GEMINI_MODEL}:generateContent'
+        with get_llm_metrics().track('gemini', GEMINI_MODEL, prompt) as call:
+            response = get_http_session().post(api_url, headers=headers, json=data)
+            try:
+                result = response.json()
+            except ValueError:
+                result = {}
+            if not isinstance(result, dict):
+                result = {}
+            text = ''
+            candidates = result.get('candidates') or []
+            if candidates:
+                parts = (candidates[0].get('content') or {}).get('parts') or []
+                text = ''.join(part.get('text', '') for part in parts)
+            if response.status_code != 200:
+                call.fail(f"http_{response.status_code}")
+            elif not text.strip():
+                call.fail("empty_response")
+            call.set_response(text)
+            call.set_usage_from(result)
+        
+        if response.status_code != 200:
+            raise requests.HTTPError(f"Gemini API returned HTTP {response.status_code}", response=response)
+        if not text.strip():
+            raise ValueError("Gemini API returned an empty response")
+        return text
     
+    @llm_feature('quiz_feedback')
     def _generate_feedback(self, quiz: Dict[str, Any], results: List[Dict[str, Any]], score: float) -> str:
         """Generate personalized feedback for a quiz attempt using Gemini AI"""
         # Prepare data for the AI prompt
@@ -408,20 +577,7 @@ class QuizService:
         """
         
         try:
-            headers = {
-                'Authorization': f'Bearer {GEMINI_API_KEY}',
-                'Content-Type': 'application/json'
-            }
-            data = {
-                'prompt': prompt,
-                'maxTokens': 2048,
-                'temperature': 0.7,
-                'topP': 1,
-                'frequencyPenalty': 0,
-                'presencePenalty': 0
-            }
-            response = requests.post(f'{GEMINI_API_BASE_URL}/generate', headers=headers, json=data)
-            return response.json().get('text', '')
+            return self._call_gemini(prompt)
         except Exception as e:
             # Fallback feedback if AI fails
             if score >= 80:
@@ -0,0 +1,149 @@
+"""Single-flight execution of identical concurrent requests.
+
+When a whole class opens the same AI feature at once, every request used to
+make its own identical LLM call. With single-flight, the first caller for a
+key runs the call and every concurrent caller with the same key waits for
+and shares its result, so a burst of identical requests costs one call.
+
+Within a process this is done with threads; across processes (several
+Streamlit or Flask workers) an optional lock file serializes callers, so the
+second process finds the result in the shared cache instead of calling the
+API again.
+"""
+
+import os
+import copy
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: only in-process deduplication
+    fcntl = None
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Number of lock files keys are spread over; bounds the files kept on disk
+LOCK_STRIPES = 1024
+
+
+class _Call:
+    """An in-flight call and the result its waiters receive."""
+
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+def _shared_error(error: Exception) -> Exception:
+    """Copy of the leader's exception for a waiter, marked as a shared result.
+
+    The failure already counted against the provider once (for the leader);
+    the mark lets health tracking ignore the copies.
+    """
+    try:
+        shared = copy.copy(error)
+    except Exception:
+        return error
+    shared.single_flight_shared = True
+    return shared
+
+
+class SingleFlight:
+    """Run at most one call per key at a time and share its result with concurrent callers."""
+
+    def __init__(self, lock_dir: Optional[str] = None):
+        """Initialize the single-flight group.
+
+        Args:
+            lock_dir: Directory for cross-process lock files; None for in-process only
+        """
+        self.lock_dir = lock_dir if fcntl is not None else None
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._executed = 0
+        self._shared = 0
+
+        if self.lock_dir:
+            os.makedirs(self.lock_dir, exist_ok=True)
+
+    @contextmanager
+    def _process_lock(self, key: str):
+        """Hold the lock file of the key's stripe, if cross-process locking is enabled."""
+        if not self.lock_dir:
+            yield
+            return
+
+        stripe = int(hashlib.sha1(key.encode('utf-8')).hexdigest(), 16) % LOCK_STRIPES
+        path = os.path.join(self.lock_dir, f"{stripe:04d}.lock")
+        with open(path, 'a') as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        """Call fn() unless a call for the same key is already running, then share its result.
+
+        Exceptions raised by the call are raised in every waiting caller too.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self._executed += 1
+            else:
+                call.waiters += 1
+                self._shared += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise _shared_error(call.error)
+            return call.result
+
+        try:
+            with self._process_lock(key):
+                call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            if call.waiters:
+                logger.debug(f"Shared one call with {call.waiters} identical requests")
+            call.done.set()
+
+    def stats(self) -> Dict[str, int]:
+        """Get the number of calls executed and the number answered by sharing."""
+        with self._lock:
+            return {'in_flight': len(self._calls), 'executed': self._executed, 'shared': self._shared}
+
+
+_single_flight = None
+_single_flight_lock = threading.Lock()
+
+
+def get_single_flight() -> SingleFlight:
+    """Get the process-wide single-flight group.
+
+    Cross-process locking is enabled by setting LLM_SINGLE_FLIGHT_LOCK_DIR.
+    """
+    global _single_flight
+    with _single_flight_lock:
+        if _single_flight is None:
+            _single_flight = SingleFlight(lock_dir=os.getenv('LLM_SINGLE_FLIGHT_LOCK_DIR') or None)
+        return _single_flight
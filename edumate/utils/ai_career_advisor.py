@@ -1,16 +1,23 @@
 import os
 import json
-import requests
 from typing import List, Dict, Any
 import logging
 from .logger import log_system_event, log_error
+from .http_client import get_http_session
+from .llm_metrics import get_llm_metrics, llm_feature
+from .result_cache import get_result_cache, normalize_query, profile_fingerprint
 import base64
 
+# Profile fields the prompts use; other changes to the profile keep cached advice
+PROFILE_FIELDS = ('interests', 'skills', 'education', 'goals')
+
 class AICareerAdvisor:
     def __init__(self):
         self.api_key = os.environ.get('GEMINI_API_KEY')
-        self.api_url = "https://generativelanguage.googleapis.com/v1/models/gemini-1.5-pro:generateContent"
+        self.model = "gemini-1.5-pro"
+        self.api_url = f"https://generativelanguage.googleapis.com/v1/models/{self.model}:generateContent"
     
+    @llm_feature('career_skill_analysis')
     def analyze_skills(self, student_data: Dict[str, Any]) -> Dict[str, Any]:
         """
         Analyze student skills using Gemini API
@@ -29,46 +36,19 @@ class AICareerAdvisor:
             # Construct the prompt for Gemini
             prompt = self._construct_skill_analysis_prompt(student_data)
             
-            # Make the API request
-            headers = {
-                "Content-Type": "application/json"
-            }
-            
-            data = {
-                "contents": [
-                    {
-                        "parts": [
-                            {"text": prompt}
-                        ]
-                    }
-                ],
-                "generationConfig": {
-                    "temperature": 0.2,
-                    "topK": 40,
-                    "topP": 0.95,
-                    "maxOutputTokens": 1024,
-                }
-            }
-            
-            response = requests.post(
-                f"{self.api_url}?key={self.api_key}",
-                headers=headers,
-                json=data
+            # Unchanged profiles reuse the cached analysis
+            return get_result_cache().get_or_compute(
+                'career_skill_analysis',
+                [self.model, profile_fingerprint(student_data, PROFILE_FIELDS)],
+                lambda: self._analyze_prompt(prompt),
+                should_cache=lambda result: "error" not in result
             )
-            response.raise_for_status()
-            
-            # Process the response
-            result = response.json()
-            if 'candidates' in result and len(result['candidates']) > 0:
-                response_text = result['candidates'][0]['content']['parts'][0]['text']
-                return self._parse_response(response_text)
-            else:
-                return {"error": "No response from API"}
                 
         except Exception as e:
             log_error(f"Error analyzing skills with Gemini: {str(e)}")
             return {"error": str(e)}
     
+    @llm_feature('career_advice')
     def get_career_advice(self, query: str, student_data: Dict[str, Any]) -> str:
         """
         Get career advice for a specific query
@@ -104,28 +84,52 @@ class AICareerAdvisor:
             Please provide a helpful, informative, and actionable response that addresses their question.
             """
             
-            # Make the API request
-            headers = {
-                "Content-Type": "application/json"
-            }
-            
-            data = {
-                "contents": [
-                    {
-                        "parts": [
-                            {"text": prompt}
-                        ]
-                    }
-                ],
-                "generationConfig": {
-                    "temperature": 0.2,
-                    "topK": 40,
-                    "topP": 0.95,
-                    "maxOutputTokens": 1024,
+            # Make the API request; the same question from an unchanged profile reuses the cached advice
+            response_text = get_result_cache().get_or_compute(
+                'career_advice',
+                [self.model, normalize_query(query), profile_fingerprint(student_data, PROFILE_FIELDS)],
+                lambda: self._generate_content(prompt)
+            )
+            if response_text is not None:
+                return response_text
+            else:
+                return "I'm unable to provide specific advice at this moment. Please try again later."
+                
+        except Exception as e:
+            log_error(f"Error getting career advice from Gemini: {str(e)}")
+            return "I encountered an error while processing your question. Please try again later."
+    
+    def _analyze_prompt(self, prompt: str) -> Dict[str, Any]:
+        """Run a skill analysis prompt and parse the result"""
+        response_text = self._generate_content(prompt)
+        if response_text is not None:
+            return self._parse_response(response_text)
+        return {"error": "No response from API"}
+    
+    def _generate_content(self, prompt: str):
+        """Send a prompt to Gemini and return the response text, or None if there is no candidate"""
+        headers = {
+            "Content-Type": "application/json"
+        }
+        
+        data = {
+            "contents": [
+                {
+                    "parts": [
+                        {"text": prompt}
+                    ]
                 }
+            ],
+            "generationConfig": {
+                "temperature": 0.2,
+                "topK": 40,
+                "topP": 0.95,
+                "maxOutputTokens": 1024,
             }
-            
-            response = requests.post(
+        }
+        
+        with get_llm_metrics().track("gemini", self.model, prompt) as call:
+            response = get_http_session().post(
                 f"{self.api_url}?key={self.api_key}",
                 headers=headers,
                 json=data
@@ -134,15 +138,13 @@ class AICareerAdvisor:
             
             # Process the response
             result = response.json()
+            call.set_usage_from(result)
             if 'candidates' in result and len(result['candidates']) > 0:
                 response_text = result['candidates'][0]['content']['parts'][0]['text']
+                call.set_response(response_text)
                 return response_text
-            else:
-                return "I'm unable to provide specific advice at this moment. Please try again later."
-                
-        except Exception as e:
-            log_error(f"Error getting career advice from Gemini: {str(e)}")
-            return "I encountered an error while processing your question. Please try again later."
+            call.fail("no_candidates")
+            return None
     
     def _construct_skill_analysis_prompt(self, student_data: Dict[str, Any]) -> str:
         """Construct a prompt for skill analysis"""
@@ -11,11 +11,15 @@ import numpy as np
 from datetime import datetime
 import re
 import nltk
-from nltk.tokenize import sent_tokenize, word_tokenize
+from nltk.tokenize import word_tokenize
 from nltk.corpus import stopwords
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
 
+from edumate.services.ai_service import AIService
+from edumate.utils.llm_metrics import iter_with_feature
+from edumate.utils.nlp_annotations import annotate
+
 class AITutor:
     """Class to provide AI tutoring capabilities."""
     
@@ -126,6 +130,57 @@ class AITutor:
         
         return response
     
+    def answer_question_stream(self, question, student_id, course_id, context=None, preferred_style=None):
+        """Answer a question, yielding the answer in chunks as the AI model writes it.
+        
+        Relevant knowledge base entries are given to the model as context.
+        When no AI service is available, or the model fails before producing
+        any text, the extractive answer from answer_question is yielded whole.
+        
+        Args:
+            question (str): The student's question
+            student_id (str): ID of the student asking the question
+            course_id (str): ID of the course the question is about
+            context (dict, optional): Additional context about the student and course
+            preferred_style (str, optional): Preferred tutoring style
+            
+        Yields:
+            str: Chunks of the answer
+        """
+        if not AIService.is_available():
+            yield self.answer_question(question, student_id, course_id, context, preferred_style)["answer"]
+            return
+        
+        preferred_style = preferred_style or "direct"
+        learning_style = context.get("learning_style") if context else None
+        relevant_entries = self._find_relevant_knowledge(self._preprocess_text(question), course_id)
+        
+        # Build the prompt from the course material and tutoring preferences
+        prompt = "You are a patient tutor helping a student with their course.\n"
+        prompt += f"Tutoring approach: {self.tutoring_strategies.get(preferred_style, self.tutoring_strategies['direct'])}.\n"
+        if learning_style in self.learning_styles:
+            prompt += f"The student {self.learning_styles[learning_style].lower()}.\n"
+        if relevant_entries:
+            prompt += "\nBase your answer on this course material:\n"
+            for entry in relevant_entries:
+                prompt += f"---\n{entry.get('content', '')}\n"
+        prompt += f"\nStudent question: {question}\n"
+        
+        chunks = []
+        try:
+            stream = AIService.generate_text_stream(prompt, max_tokens=600, temperature=0.4)
+            for chunk in iter_with_feature('ai_tutor', stream):
+                chunks.append(chunk)
+                yield chunk
+        except Exception as e:
+            print(f"Error streaming tutor answer: {e}")
+            if not chunks:
+                yield self.answer_question(question, student_id, course_id, context, preferred_style)["answer"]
+                return
+        
+        confidence = 0.8 if relevant_entries else 0.5
+        self._save_interaction(student_id, course_id, question, "".join(chunks), confidence)
+    
     def add_to_knowledge_base(self, content, metadata):
         """Add new content to the knowledge base.
         
@@ -259,17 +314,8 @@ class AITutor:
         Returns:
             str: Preprocessed text
         """
-        # Convert to lowercase
-        text = text.lower()
-        
-        # Tokenize
-        words = word_tokenize(text)
-        
-        # Remove stop words and punctuation
-        words = [word for word in words if word.isalnum() and word not in self.stop_words]
-        
-        # Join back into a string
-        return " ".join(words)
+        # Lowercased tokens without stop words and punctuation
+        return " ".join(annotate(text).terms)
     
     def _find_relevant_knowledge(self, question, course_id, top_n=3, threshold=0.3):
         """Find knowledge base entries relevant to the question.
@@ -344,15 +390,16 @@ class AITutor:
         combined_content = " ".join(contents)
         
         # Extract sentences from the combined content
-        sentences = sent_tokenize(combined_content)
+        annotation = annotate(combined_content)
+        sentences = annotation.sentences
         
         # Find sentences most relevant to the question
-        question_words = set(self._preprocess_text(question).split())
+        question_words = set(annotate(question).terms)
         
         # Score sentences based on word overlap with the question
         scored_sentences = []
-        for sentence in sentences:
-            sentence_words = set(self._preprocess_text(sentence).split())
+        for index, sentence in enumerate(sentences):
+            sentence_words = set(annotation.sentence_terms(index))
             overlap = len(question_words.intersection(sentence_words))
             score = overlap / max(len(question_words), 1)
             scored_sentences.append((sentence, score))
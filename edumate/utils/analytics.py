@@ -4,7 +4,6 @@ import matplotlib.pyplot as plt
 from datetime import datetime, timedelta
 import os
 import nltk
-from nltk.tokenize import word_tokenize, sent_tokenize
 from nltk.sentiment import SentimentIntensityAnalyzer
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.cluster import KMeans
@@ -12,6 +11,7 @@ from sklearn.preprocessing import StandardScaler
 import seaborn as sns
 from typing import List, Dict
 from .logger import log_system_event
+from .nlp_annotations import annotate
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.model_selection import train_test_split
 import json
@@ -153,9 +153,10 @@ class Analytics:
     def generate_feedback_suggestions(self, submission_content, model_scores):
         """Generate AI feedback suggestions based on submission content and model scores"""
         try:
-            # Tokenize content
-            sentences = sent_tokenize(submission_content)
-            words = word_tokenize(submission_content)
+            # Tokenize content (shared with plagiarism checks and text utilities)
+            annotation = annotate(submission_content)
+            sentences = annotation.sentences
+            words = annotation.tokens
             
             # Analyze sentiment
             sia = SentimentIntensityAnalyzer()
@@ -0,0 +1,229 @@
+"""Local scoring of short answers against an expected answer.
+
+Most short quiz answers are either near-copies of the expected answer or
+clearly unrelated to it, and neither needs an LLM to judge. An answer is
+scored locally by combining:
+
+- normalized string matching (case, whitespace, punctuation, articles);
+- recall of the expected answer's key terms, with light stemming;
+- character n-gram similarity, which tolerates typos and word forms.
+
+Answers scoring at or above the accept threshold are correct, unless they
+add content words the expected answer does not have: "oxygen or carbon
+dioxide" covers "carbon dioxide" but hedges, so it goes to the LLM. Answers
+at or below the reject threshold are incorrect, but only when they say enough
+(at least MIN_REJECT_TERMS content words) for zero overlap to mean they are
+unrelated: a short answer such as "ten" or "H2O" can be right without
+sharing a character with the expected one. Everything else is escalated to
+the LLM. The default thresholds were calibrated with calibrate_thresholds on
+the labelled answers in tests/data/short_answers.json and can be
+recalibrated from graded answers the same way.
+"""
+
+import os
+import re
+import math
+
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from edumate.utils.nlp_annotations import get_stop_words
+
+CORRECT = 'correct'
+INCORRECT = 'incorrect'
+UNCERTAIN = 'uncertain'
+
+# From calibrate_thresholds on tests/data/short_answers.json (target precision 0.98):
+# the reject threshold is the calibrated 0.02; the calibrated accept threshold
+# (0.61) is too close to partial answers for a sample that small, so accepting
+# stays at 0.85
+DEFAULT_ACCEPT_THRESHOLD = float(os.getenv('SHORT_ANSWER_ACCEPT_THRESHOLD', '0.85'))
+DEFAULT_REJECT_THRESHOLD = float(os.getenv('SHORT_ANSWER_REJECT_THRESHOLD', '0.02'))
+
+# Score at which an answer counts as correct when the LLM is unavailable
+FALLBACK_THRESHOLD = 0.5
+
+# Weight of key-term recall in the score; the rest is character similarity
+TERM_WEIGHT = 0.6
+
+# Content words an answer needs before a low score is trusted as a rejection
+MIN_REJECT_TERMS = int(os.getenv('SHORT_ANSWER_MIN_REJECT_TERMS', '3'))
+
+_NEGATIONS = frozenset(['not', 'no', 'never', 'none', 'cannot', "n't", 'neither', 'nor', 'without'])
+# A number with its sign, decimals and thousands separators: -2, 0.5, 1,000, .25
+# (a minus directly after a word or number is an operator, as in 5-3)
+_NUMBER_PATTERN = re.compile(r'(?:(?<![\w).\]])[-\u2212])?(?<![\w.])(?:\d{1,3}(?:,\d{3})+(?![\d,])|\d+)?(?:\.\d+|(?<=\d))')
+_TOKEN_PATTERN = re.compile(_NUMBER_PATTERN.pattern + r"|n't|\w+")
+_ARTICLES = frozenset(['a', 'an', 'the'])
+
+
+def _number_value(token):
+    return float(token.replace(',', '').replace('\u2212', '-'))
+
+
+def extract_numbers(text):
+    """Values of the numbers in a text, keeping signs and decimals (1,000 is 1000)."""
+    return [_number_value(token) for token in _NUMBER_PATTERN.findall(text or "")]
+
+
+def _is_number(token):
+    return _NUMBER_PATTERN.fullmatch(token) is not None
+
+
+def normalize_answer(text):
+    """Lowercase, drop punctuation and articles and collapse whitespace.
+
+    Numbers stay single tokens with their sign and decimals, written
+    without thousands separators.
+    """
+    if not text:
+        return ""
+    tokens = _TOKEN_PATTERN.findall(text.lower().replace("n't", " n't"))
+    return " ".join(token.replace(',', '').replace('\u2212', '-') if _is_number(token) else token
+                    for token in tokens if token not in _ARTICLES)
+
+
+def _stem(token):
+    """Strip common English suffixes so word forms compare equal."""
+    for suffix in ('ing', 'ies', 'es', 'ed', 's'):
+        if len(token) > len(suffix) + 2 and token.endswith(suffix):
+            return token[:-len(suffix)] + ('y' if suffix == 'ies' else '')
+    return token
+
+
+def key_terms(text):
+    """Stemmed content words of a text (stopwords and single characters removed)."""
+    stop_words = get_stop_words()
+    return {_stem(token) for token in normalize_answer(text).split()
+            if len(token) > 1 and token not in stop_words and not _is_number(token)}
+
+
+def char_similarity(text1, text2):
+    """Cosine similarity of the character 2-4-gram profiles of two texts."""
+    if not text1 or not text2:
+        return 0.0
+    try:
+        # IDF over just two documents would only penalize shared n-grams
+        vectors = TfidfVectorizer(analyzer='char_wb', ngram_range=(2, 4), use_idf=False).fit_transform([text1, text2])
+        return float((vectors[0] @ vectors[1].T).toarray()[0][0])
+    except ValueError:
+        # No n-grams (e.g. only punctuation)
+        return 0.0
+
+
+def _negations(normalized):
+    return {token for token in normalized.split() if token in _NEGATIONS}
+
+
+def _can_reject(student_terms):
+    """Whether an answer says enough for a low score to mean it is unrelated."""
+    return len(student_terms) >= MIN_REJECT_TERMS
+
+
+def score_answer(student_answer, expected_answer,
+                 accept_threshold=DEFAULT_ACCEPT_THRESHOLD,
+                 reject_threshold=DEFAULT_REJECT_THRESHOLD):
+    """Score a short answer against the expected answer.
+
+    Returns:
+        dict: 'verdict' (CORRECT, INCORRECT or UNCERTAIN), 'score' (0-1),
+            'term_recall' and 'char_similarity'
+    """
+    student = normalize_answer(student_answer)
+    expected = normalize_answer(expected_answer)
+
+    if not student:
+        return {'verdict': INCORRECT, 'score': 0.0, 'term_recall': 0.0, 'char_similarity': 0.0}
+    if student == expected:
+        return {'verdict': CORRECT, 'score': 1.0, 'term_recall': 1.0, 'char_similarity': 1.0}
+    # Numbers are compared on the raw answers, where signs, decimals and separators are intact
+    expected_numbers = extract_numbers(expected_answer)
+    if len(expected_numbers) == 1 and not _NUMBER_PATTERN.sub('', expected_answer).strip(" .;:!?\"'"):
+        # A numeric answer is right or wrong; similar digits mean nothing
+        matches = {math.isclose(number, expected_numbers[0]) for number in extract_numbers(student_answer)}
+        if len(matches) == 1:
+            # Every number given agrees with the expected one, or none does
+            is_correct = matches.pop()
+            score = 1.0 if is_correct else 0.0
+            return {'verdict': CORRECT if is_correct else INCORRECT, 'score': score,
+                    'term_recall': score, 'char_similarity': score}
+
+    expected_terms = key_terms(expected_answer)
+    student_terms = key_terms(student_answer)
+    if expected_terms:
+        term_recall = len(expected_terms & student_terms) / len(expected_terms)
+    else:
+        # Expected answer is only stopwords or numbers; rely on the characters
+        term_recall = 1.0 if student in expected or expected in student else 0.0
+
+    similarity = char_similarity(student, expected)
+    score = TERM_WEIGHT * term_recall + (1 - TERM_WEIGHT) * similarity
+
+    if score >= accept_threshold:
+        # Same words with a different meaning: "is not a mammal", another number,
+        # or more than was asked: "oxygen or carbon dioxide"
+        if (_negations(student) != _negations(expected)
+                or not set(expected_numbers) <= set(extract_numbers(student_answer))
+                or student_terms - expected_terms):
+            verdict = UNCERTAIN
+        else:
+            verdict = CORRECT
+    elif score <= reject_threshold and _can_reject(student_terms):
+        verdict = INCORRECT
+    else:
+        verdict = UNCERTAIN
+
+    return {'verdict': verdict, 'score': score, 'term_recall': term_recall, 'char_similarity': similarity}
+
+
+def calibrate_thresholds(graded_answers, target_precision=0.98):
+    """Choose accept and reject thresholds from answers with known verdicts.
+
+    The accept threshold is the lowest score above which at least
+    target_precision of the answers that pass the negation, number and extra
+    term checks are correct, and the reject threshold
+    the highest score below which at least target_precision of the answers
+    that can be rejected locally (see MIN_REJECT_TERMS) are incorrect, so the
+    fewest answers are escalated for the required accuracy.
+
+    Args:
+        graded_answers: (student answer, expected answer, is correct) tuples,
+            e.g. past answers with a teacher or LLM verdict
+        target_precision: Required share of correct local verdicts
+
+    Returns:
+        tuple: (accept threshold, reject threshold)
+    """
+    acceptable = []
+    rejectable = []
+    for student, expected, is_correct in graded_answers:
+        # With no accept threshold only the negation, number and extra term checks can keep an answer from being accepted
+        result = score_answer(student, expected, accept_threshold=0.0)
+        entry = (result['score'], bool(is_correct))
+        if result['verdict'] == CORRECT:
+            acceptable.append(entry)
+        if _can_reject(key_terms(student)):
+            rejectable.append(entry)
+    acceptable.sort()
+    rejectable.sort()
+    if not acceptable and not rejectable:
+        return DEFAULT_ACCEPT_THRESHOLD, DEFAULT_REJECT_THRESHOLD
+
+    accept = 1.0
+    correct_above = 0
+    for count, (score, is_correct) in enumerate(reversed(acceptable), start=1):
+        correct_above += is_correct
+        if correct_above / count < target_precision:
+            break
+        accept = score
+
+    reject = 0.0
+    incorrect_below = 0
+    for count, (score, is_correct) in enumerate(rejectable, start=1):
+        incorrect_below += not is_correct
+        if incorrect_below / count < target_precision:
+            break
+        reject = score
+
+    # Keep a non-empty band for the LLM
+    reject = min(reject, accept - 0.05)
+    return accept, max(0.0, reject)
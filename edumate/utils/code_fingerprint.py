@@ -0,0 +1,472 @@
+"""
+Code Fingerprint module for EduMate.
+
+This module detects similar code submissions even when identifiers have been
+renamed, comments added or code reformatted. Submissions are normalized into
+a token stream (Python via ``ast``, C-like languages via a lexer), the token
+k-grams are hashed and winnowed into fingerprints, and the fingerprints are
+stored in an inverted index so a new submission is only compared against the
+submissions that share fingerprints with it. The index is kept in SQLite so
+adding a submission is an incremental write.
+"""
+
+import os
+import re
+import ast
+import json
+import keyword
+import builtins
+import sqlite3
+import hashlib
+import threading
+
+from edumate.utils.code_utils import LANGUAGE_EXTENSIONS
+
+PYTHON_BUILTINS = set(dir(builtins))
+
+C_LIKE_KEYWORDS = {
+    'c': {
+        'auto', 'break', 'case', 'char', 'const', 'continue', 'default', 'do', 'double',
+        'else', 'enum', 'extern', 'float', 'for', 'goto', 'if', 'int', 'long', 'register',
+        'return', 'short', 'signed', 'sizeof', 'static', 'struct', 'switch', 'typedef',
+        'union', 'unsigned', 'void', 'volatile', 'while', 'printf', 'scanf', 'include',
+        'define', 'malloc', 'free'
+    },
+    'cpp': {
+        'auto', 'bool', 'break', 'case', 'catch', 'char', 'class', 'const', 'continue',
+        'default', 'delete', 'do', 'double', 'else', 'enum', 'false', 'float', 'for',
+        'friend', 'if', 'include', 'inline', 'int', 'long', 'namespace', 'new', 'nullptr',
+        'private', 'protected', 'public', 'return', 'short', 'sizeof', 'static', 'std',
+        'struct', 'switch', 'template', 'this', 'throw', 'true', 'try', 'typedef', 'typename',
+        'using', 'virtual', 'void', 'while', 'cout', 'cin', 'endl', 'vector', 'string'
+    },
+    'java': {
+        'abstract', 'boolean', 'break', 'byte', 'case', 'catch', 'char', 'class', 'continue',
+        'default', 'do', 'double', 'else', 'extends', 'false', 'final', 'finally', 'float',
+        'for', 'if', 'implements', 'import', 'instanceof', 'int', 'interface', 'long', 'new',
+        'null', 'package', 'private', 'protected', 'public', 'return', 'short', 'static',
+        'super', 'switch', 'this', 'throw', 'throws', 'true', 'try', 'void', 'while',
+        'String', 'System', 'out', 'println', 'print', 'Scanner', 'Math'
+    },
+    'javascript': {
+        'break', 'case', 'catch', 'class', 'const', 'continue', 'default', 'delete', 'do',
+        'else', 'export', 'extends', 'false', 'finally', 'for', 'function', 'if', 'import',
+        'in', 'instanceof', 'let', 'new', 'null', 'of', 'return', 'switch', 'this', 'throw',
+        'true', 'try', 'typeof', 'undefined', 'var', 'void', 'while', 'console', 'log'
+    },
+    'php': {
+        'array', 'as', 'break', 'case', 'class', 'const', 'continue', 'default', 'do', 'echo',
+        'else', 'elseif', 'false', 'for', 'foreach', 'function', 'if', 'new', 'null', 'print',
+        'private', 'protected', 'public', 'return', 'static', 'switch', 'true', 'while'
+    }
+}
+
+C_LIKE_TOKEN_PATTERN = re.compile(r"""
+    (?P<comment>//[^\n]*|/\*.*?\*/|\#(?!include|define)[^\n]*)
+  | (?P<string>"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*'|`(?:\\.|[^`\\])*`)
+  | (?P<number>\b\d+(?:\.\d+)?(?:[eE][+-]?\d+)?[fFlLuU]*\b|\b0[xX][0-9a-fA-F]+\b)
+  | (?P<identifier>\$?[A-Za-z_]\w*)
+  | (?P<operator>[-+*/%=<>!&|^~?:]+|[{}()\[\];,.])
+""", re.VERBOSE | re.DOTALL)
+
+
+def normalize_code(code, language):
+    """Normalize source code into a list of structural tokens.
+
+    Identifiers are replaced by placeholders and literals by their type, so
+    renaming variables or changing constants does not change the result.
+
+    Args:
+        code (str): Source code
+        language (str): Language name as used by code_utils (python, java, c, ...)
+
+    Returns:
+        list: Normalized tokens
+    """
+    if not code:
+        return []
+
+    language = (language or '').lower()
+    if language == 'python':
+        try:
+            return _python_tokens(code)
+        except (SyntaxError, ValueError, RecursionError):
+            # Fall back to the lexer for code that does not parse
+            pass
+
+    return _lexer_tokens(code, language)
+
+
+def _python_tokens(code):
+    """Normalize Python code by walking its AST in source order."""
+    tree = ast.parse(code)
+    tokens = []
+
+    def visit(node):
+        if isinstance(node, ast.expr_context):
+            return
+
+        # Docstrings and bare string statements carry no logic
+        if isinstance(node, ast.Expr) and isinstance(node.value, ast.Constant) \
+                and isinstance(node.value.value, str):
+            return
+
+        if isinstance(node, ast.Name):
+            tokens.append(node.id if node.id in PYTHON_BUILTINS else 'ID')
+            return
+
+        if isinstance(node, ast.Constant):
+            tokens.append(_literal_token(node.value))
+            return
+
+        tokens.append(type(node).__name__)
+
+        if isinstance(node, ast.Attribute) and not node.attr.startswith('_'):
+            # Keep attribute names of library calls such as list.append
+            if hasattr(list, node.attr) or hasattr(dict, node.attr) or hasattr(str, node.attr):
+                tokens.append(node.attr)
+
+        for child in ast.iter_child_nodes(node):
+            visit(child)
+
+    visit(tree)
+    return tokens
+
+
+def _literal_token(value):
+    """Map a literal value to a type placeholder."""
+    if isinstance(value, bool) or value is None:
+        return repr(value)
+    if isinstance(value, (int, float, complex)):
+        return 'NUM'
+    if isinstance(value, (str, bytes)):
+        return 'STR'
+    return 'LIT'
+
+
+def _lexer_tokens(code, language):
+    """Normalize C-like code (and unparseable Python) with a regex lexer."""
+    if language == 'python':
+        language_keywords = set(keyword.kwlist) | PYTHON_BUILTINS
+    else:
+        language_keywords = C_LIKE_KEYWORDS.get(language, set().union(*C_LIKE_KEYWORDS.values()))
+
+    tokens = []
+    for match in C_LIKE_TOKEN_PATTERN.finditer(code):
+        kind = match.lastgroup
+        value = match.group()
+
+        if kind == 'comment':
+            continue
+        if kind == 'string':
+            tokens.append('STR')
+        elif kind == 'number':
+            tokens.append('NUM')
+        elif kind == 'identifier':
+            tokens.append(value if value in language_keywords else 'ID')
+        else:
+            tokens.append(value)
+
+    return tokens
+
+
+def fingerprint_tokens(tokens, k=10, window=4):
+    """Select winnowed fingerprints from the hashes of token k-grams.
+
+    Every shared run of at least ``k + window - 1`` tokens is guaranteed to
+    produce at least one shared fingerprint.
+
+    Args:
+        tokens (list): Normalized tokens
+        k (int): Number of tokens per k-gram
+        window (int): Winnowing window size
+
+    Returns:
+        set: Fingerprint hashes
+    """
+    if len(tokens) < k:
+        if not tokens:
+            return set()
+        # Short programs get a single fingerprint for the whole stream
+        return {_hash_gram(tokens)}
+
+    hashes = [_hash_gram(tokens[i:i + k]) for i in range(len(tokens) - k + 1)]
+    if len(hashes) <= window:
+        return {min(hashes)}
+
+    fingerprints = set()
+    for i in range(len(hashes) - window + 1):
+        fingerprints.add(min(hashes[i:i + window]))
+
+    return fingerprints
+
+
+def _hash_gram(gram):
+    """Return a stable 64-bit hash for a token k-gram."""
+    digest = hashlib.blake2b('\x1f'.join(gram).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+class CodeFingerprintIndex:
+    """Inverted index from code fingerprints to submissions, stored in SQLite.
+
+    Adding a submission only writes its own postings, and a query only reads
+    the posting lists of its own fingerprints, so neither touches the whole
+    corpus. Processes sharing the database file see each other's submissions.
+    """
+
+    def __init__(self, index_path=None, k=10, window=4, max_fingerprint_frequency=0.3):
+        """Initialize the CodeFingerprintIndex class.
+
+        Args:
+            index_path (str): SQLite database file to store the index in
+                (default an in-memory index)
+            k (int): Number of normalized tokens per k-gram
+            window (int): Winnowing window size
+            max_fingerprint_frequency (float): Fingerprints shared by more than
+                this fraction of indexed submissions (e.g. starter code given to
+                the whole class) are ignored when scoring
+        """
+        self.index_path = index_path
+        self.k = k
+        self.window = window
+        self.max_fingerprint_frequency = max_fingerprint_frequency
+        self._lock = threading.Lock()
+
+        if index_path:
+            os.makedirs(os.path.dirname(index_path) or '.', exist_ok=True)
+        # One connection per index, used under the lock; SQLite serializes writers across processes
+        self._conn = sqlite3.connect(index_path or ':memory:', timeout=30, check_same_thread=False)
+        self._init_database()
+
+    def _init_database(self):
+        """Create the index tables, clearing fingerprints made with other parameters."""
+        with self._lock, self._conn:
+            if self.index_path:
+                self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS settings (
+                    name TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                );
+
+                CREATE TABLE IF NOT EXISTS documents (
+                    doc_id TEXT PRIMARY KEY,
+                    metadata TEXT NOT NULL,
+                    fingerprint_count INTEGER NOT NULL
+                );
+
+                CREATE TABLE IF NOT EXISTS postings (
+                    fingerprint INTEGER NOT NULL,
+                    doc_id TEXT NOT NULL,
+                    PRIMARY KEY (fingerprint, doc_id)
+                ) WITHOUT ROWID;
+
+                CREATE INDEX IF NOT EXISTS idx_postings_doc_id ON postings (doc_id);
+            """)
+
+            parameters = json.dumps([self.k, self.window])
+            row = self._conn.execute("SELECT value FROM settings WHERE name = 'parameters'").fetchone()
+            if row is not None and row[0] != parameters:
+                # Fingerprints from different parameters are not comparable
+                self._conn.execute("DELETE FROM postings")
+                self._conn.execute("DELETE FROM documents")
+                # Markers about the contents no longer hold either
+                self._conn.execute("DELETE FROM settings")
+            self._conn.execute("INSERT OR REPLACE INTO settings (name, value) VALUES ('parameters', ?)",
+                               (parameters,))
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def __contains__(self, doc_id):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM documents WHERE doc_id = ?",
+                                      (str(doc_id),)).fetchone() is not None
+
+    def get_setting(self, name, default=None):
+        """Get a value stored with the index, e.g. a marker set by its owner."""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM settings WHERE name = ?", (name,)).fetchone()
+        return default if row is None else row[0]
+
+    def set_setting(self, name, value):
+        """Store a value with the index."""
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO settings (name, value) VALUES (?, ?)", (name, str(value)))
+
+    def fingerprint(self, code, language):
+        """Fingerprint a piece of code.
+
+        Args:
+            code (str): Source code
+            language (str): Language of the code
+
+        Returns:
+            set: Fingerprint hashes
+        """
+        return fingerprint_tokens(normalize_code(code, language), self.k, self.window)
+
+    def add(self, doc_id, code, language, metadata=None):
+        """Add (or replace) a submission in the index.
+
+        Args:
+            doc_id: Unique submission identifier
+            code (str): Source code
+            language (str): Language of the code
+            metadata (dict): Extra details returned with query matches
+        """
+        self._add_fingerprints(str(doc_id), self.fingerprint(code, language), metadata)
+
+    def _add_fingerprints(self, doc_id, fingerprints, metadata):
+        with self._lock, self._conn:
+            self._remove_locked(doc_id)
+            self._conn.execute(
+                "INSERT INTO documents (doc_id, metadata, fingerprint_count) VALUES (?, ?, ?)",
+                (doc_id, json.dumps(metadata or {}), len(fingerprints))
+            )
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO postings (fingerprint, doc_id) VALUES (?, ?)",
+                [(_to_signed(fp), doc_id) for fp in fingerprints]
+            )
+
+    def remove(self, doc_id):
+        """Remove a submission from the index."""
+        with self._lock, self._conn:
+            self._remove_locked(str(doc_id))
+
+    def query(self, code, language, threshold=0.5, limit=10, exclude=None):
+        """Find indexed submissions similar to a piece of code.
+
+        Only the posting lists of the query's own fingerprints are visited, so
+        the cost depends on the number of candidates rather than the corpus size.
+
+        Args:
+            code (str): Source code to check
+            language (str): Language of the code
+            threshold (float): Minimum similarity (0.0-1.0) to report
+            limit (int): Maximum number of matches to return
+            exclude (callable): Optional predicate on (doc_id, metadata) for
+                submissions to skip, e.g. the student's own work
+
+        Returns:
+            list: Matches with doc_id, similarity, shared fingerprint count and metadata
+        """
+        fingerprints = [_to_signed(fp) for fp in self.fingerprint(code, language)]
+        if not fingerprints:
+            return []
+
+        with self._lock:
+            # One read transaction, so a concurrent writer can't change the counts halfway
+            self._conn.execute("BEGIN")
+            try:
+                total_docs = self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+                postings = {}
+                for chunk in _chunks(fingerprints):
+                    rows = self._conn.execute(
+                        f"SELECT fingerprint, doc_id FROM postings WHERE fingerprint IN ({_placeholders(chunk)})",
+                        chunk
+                    )
+                    for fp, doc_id in rows:
+                        postings.setdefault(fp, []).append(doc_id)
+
+                max_postings = None
+                if total_docs >= 10:
+                    max_postings = max(2, int(total_docs * self.max_fingerprint_frequency))
+
+                shared = {}
+                informative = 0
+                for fp in fingerprints:
+                    doc_ids = postings.get(fp)
+                    if doc_ids and max_postings and len(doc_ids) > max_postings:
+                        continue
+                    informative += 1
+                    for doc_id in doc_ids or ():
+                        shared[doc_id] = shared.get(doc_id, 0) + 1
+
+                documents = {}
+                for chunk in _chunks(list(shared)):
+                    rows = self._conn.execute(
+                        f"SELECT doc_id, metadata, fingerprint_count FROM documents "
+                        f"WHERE doc_id IN ({_placeholders(chunk)})",
+                        chunk
+                    )
+                    for doc_id, metadata, fingerprint_count in rows:
+                        documents[doc_id] = (json.loads(metadata), fingerprint_count)
+            finally:
+                self._conn.rollback()
+
+        matches = []
+        for doc_id, count in shared.items():
+            if doc_id not in documents:
+                continue
+            metadata, fingerprint_count = documents[doc_id]
+            if exclude and exclude(doc_id, metadata):
+                continue
+
+            # Overlap coefficient so partial copies of longer programs still score high
+            smallest = min(informative, fingerprint_count) or 1
+            similarity = min(count / smallest, 1.0)
+            if similarity >= threshold:
+                matches.append({
+                    "doc_id": doc_id,
+                    "similarity": similarity,
+                    "shared_fingerprints": count,
+                    "metadata": metadata
+                })
+
+        matches.sort(key=lambda match: match["similarity"], reverse=True)
+        return matches[:limit]
+
+    def import_json(self, json_path):
+        """Import submissions from an index saved as JSON by earlier versions.
+
+        Returns:
+            int: Number of submissions imported
+        """
+        try:
+            with open(json_path, 'r') as f:
+                data = json.load(f)
+        except Exception as e:
+            print(f"Error loading code fingerprint index {json_path}: {e}")
+            return 0
+
+        if data.get("k") != self.k or data.get("window") != self.window:
+            # Fingerprints from different parameters are not comparable
+            return 0
+
+        documents = data.get("documents", {})
+        for doc_id, document in documents.items():
+            self._add_fingerprints(doc_id, set(document["fingerprints"]), document.get("metadata"))
+        return len(documents)
+
+    def close(self):
+        """Close the database connection."""
+        with self._lock:
+            self._conn.close()
+
+    def _remove_locked(self, doc_id):
+        """Remove a document; the caller must hold the lock and a transaction."""
+        self._conn.execute("DELETE FROM postings WHERE doc_id = ?", (doc_id,))
+        self._conn.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,))
+
+
+def _to_signed(fingerprint):
+    """Map an unsigned 64-bit fingerprint into SQLite's signed INTEGER range."""
+    return fingerprint - (1 << 63)
+
+
+def _chunks(values, size=500):
+    """Split values into lists that fit in one SQL statement's parameters."""
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def _placeholders(values):
+    return ", ".join("?" * len(values))
+
+
+def supported_languages():
+    """Get the languages that can be fingerprinted."""
+    return [language for language in LANGUAGE_EXTENSIONS if language not in ('html', 'css')]
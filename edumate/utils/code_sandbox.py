@@ -0,0 +1,464 @@
+"""Sandboxed code execution with a pool of pre-warmed workers.
+
+run_code used to write a temp file and start a fresh interpreter or compiler
+for every run, with no resource limits and full network access. For the
+small programs students submit, interpreter startup took most of the run
+time. Code now runs through a pool of long-lived worker processes
+(sandbox_worker.py). Each run happens in a child forked from a worker:
+
+- with limits on CPU time, memory, processes, file size and open files;
+- in its own network namespace with no interfaces;
+- in a chroot that holds only read-only system paths (SYSTEM_PATHS and the
+  Python installation) and its writable working directory, so neither the
+  application's files nor other submissions are visible;
+- as the unprivileged sandbox user (CODE_SANDBOX_UID/GID, nobody by
+  default) when the application runs as root, and without any capabilities
+  otherwise;
+- in its own process group, killed on timeout together with anything it started;
+- with an environment that holds no secrets of the application.
+
+The isolation fails closed: where the kernel does not allow the namespaces,
+code is not run. CODE_SANDBOX_REQUIRE_NETNS=0 and
+CODE_SANDBOX_REQUIRE_FS_ISOLATION=0 opt out, e.g. for development machines.
+
+Compiled languages are compiled once, in the same sandbox with more generous
+limits, and the binary is then run as a separate step, as often as needed.
+"""
+
+import os
+import re
+import sys
+import json
+import queue
+import shutil
+import select
+import tempfile
+import threading
+import subprocess
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sandbox_worker.py')
+
+# fork, setrlimit and namespaces are POSIX (namespaces Linux) only
+SANDBOX_SUPPORTED = hasattr(os, 'fork') and sys.platform != 'darwin'
+
+DEFAULT_WORKERS = int(os.getenv('CODE_SANDBOX_WORKERS', str(min(8, os.cpu_count() or 2))))
+DEFAULT_MEMORY_MB = int(os.getenv('CODE_SANDBOX_MEMORY_MB', '256'))
+# RLIMIT_NPROC counts every process and thread of the user (the sandbox user when the app runs as root)
+DEFAULT_MAX_PROCESSES = int(os.getenv('CODE_SANDBOX_MAX_PROCESSES', '256'))
+REQUIRE_NETWORK_ISOLATION = os.getenv('CODE_SANDBOX_REQUIRE_NETNS', '1').lower() not in ('0', 'false', 'no')
+REQUIRE_FILESYSTEM_ISOLATION = os.getenv('CODE_SANDBOX_REQUIRE_FS_ISOLATION', '1').lower() not in ('0', 'false', 'no')
+
+# User programs run as when the application runs as root (default nobody)
+SANDBOX_UID = int(os.getenv('CODE_SANDBOX_UID', '65534'))
+SANDBOX_GID = int(os.getenv('CODE_SANDBOX_GID', '65534'))
+
+# Host paths programs can read; CODE_SANDBOX_READONLY_PATHS adds more (os.pathsep separated)
+SYSTEM_PATHS = (
+    '/usr', '/bin', '/sbin', '/lib', '/lib32', '/lib64',
+    '/etc/alternatives', '/etc/ld.so.cache', '/etc/ld.so.conf', '/etc/ld.so.conf.d',
+    '/etc/localtime', '/etc/passwd', '/etc/group',
+    '/dev/null', '/dev/zero', '/dev/random', '/dev/urandom'
+)
+
+COMPILE_TIMEOUT = 30
+COMPILE_MEMORY_MB = 1024
+MAX_OUTPUT_BYTES = 1024 * 1024
+MAX_FILE_SIZE_BYTES = 16 * 1024 * 1024
+MAX_OPEN_FILES = 64
+
+# Time a worker may take beyond the run timeout before it is considered hung
+WORKER_GRACE_SECONDS = 10
+
+# Commands use {source}, {binary}, {workdir}, {main_class} and {memory_mb}.
+# A language without 'run' is Python, which the worker runs itself. Runtimes
+# that reserve large virtual address spaces (JVM, V8) get their heap limit
+# on the command line instead of RLIMIT_AS.
+LANGUAGES = {
+    'python': {'extension': '.py'},
+    'c': {
+        'extension': '.c',
+        'compile': ['gcc', '{source}', '-O2', '-o', '{binary}', '-lm'],
+        'run': ['{binary}']
+    },
+    'cpp': {
+        'extension': '.cpp',
+        'compile': ['g++', '{source}', '-O2', '-o', '{binary}'],
+        'run': ['{binary}']
+    },
+    'java': {
+        'extension': '.java',
+        'compile': ['javac', '-J-Xmx{memory_mb}m', '-d', '{workdir}', '{source}'],
+        'run': ['java', '-Xmx{memory_mb}m', '-XX:+UseSerialGC', '-cp', '{workdir}', '{main_class}'],
+        'limit_address_space': False
+    },
+    'javascript': {
+        'extension': '.js',
+        'run': ['node', '--max-old-space-size={memory_mb}', '{source}'],
+        'limit_address_space': False
+    },
+    'php': {
+        'extension': '.php',
+        'run': ['php', '{source}']
+    }
+}
+
+_JAVA_CLASS_PATTERN = re.compile(r'public\s+(?:final\s+)?class\s+(\w+)')
+
+
+def get_readonly_paths():
+    """Host paths visible (read-only) to sandboxed programs."""
+    paths = list(SYSTEM_PATHS)
+    # The worker's Python runs student code in-process and needs its standard library
+    for prefix in (sys.base_prefix, sys.prefix, sys.exec_prefix):
+        if prefix not in paths:
+            paths.append(prefix)
+    paths.extend(path for path in os.getenv('CODE_SANDBOX_READONLY_PATHS', '').split(os.pathsep) if path)
+    return paths
+
+
+class Program:
+    """Source code written to a work directory and compiled if needed, ready to run."""
+
+    def __init__(self, language, workdir, source_path, run_argv=None, compile_result=None):
+        self.language = language
+        self.workdir = workdir
+        self.source_path = source_path
+        # None for Python, which the worker runs in-process
+        self.run_argv = run_argv
+        self.compile_result = compile_result
+
+    @property
+    def compiled(self):
+        """Whether the program is ready to run (no compile step or a successful one)."""
+        return self.compile_result is None or self.compile_result['success']
+
+    def cleanup(self):
+        """Remove the work directory."""
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def to_dict(self):
+        """Serializable form of the program, e.g. to reuse a compiled program later."""
+        return {
+            'language': self.language,
+            'workdir': self.workdir,
+            'source_path': self.source_path,
+            'run_argv': self.run_argv,
+            'compile_result': self.compile_result
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Recreate a program saved with to_dict."""
+        return cls(**data)
+
+
+class _Worker:
+    """A sandbox worker process and its request pipe."""
+
+    def __init__(self, env):
+        self.process = subprocess.Popen(
+            [sys.executable, '-I', WORKER_SCRIPT],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            env=env,
+            start_new_session=True
+        )
+        ready = self._read_line(WORKER_GRACE_SECONDS)
+        if not ready or not json.loads(ready).get('ready'):
+            self.kill()
+            raise RuntimeError("Code sandbox worker failed to start")
+
+    def _read_line(self, timeout):
+        readable, _, _ = select.select([self.process.stdout], [], [], timeout)
+        if not readable:
+            return None
+        return self.process.stdout.readline()
+
+    def request(self, request, timeout):
+        """Send a request and wait for its result; raises RuntimeError if the worker is gone or hung."""
+        try:
+            self.process.stdin.write(json.dumps(request).encode('utf-8') + b'\n')
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError) as e:
+            raise RuntimeError(f"Code sandbox worker is not running: {e}")
+
+        line = self._read_line(timeout + WORKER_GRACE_SECONDS)
+        if not line:
+            raise RuntimeError("Code sandbox worker did not respond")
+        return json.loads(line)
+
+    def kill(self):
+        try:
+            self.process.kill()
+            self.process.wait(timeout=5)
+        except Exception:
+            pass
+
+
+class CodeSandbox:
+    """Runs code in resource-limited sandboxes through a pool of pre-warmed workers."""
+
+    def __init__(self,
+                 num_workers=DEFAULT_WORKERS,
+                 memory_mb=DEFAULT_MEMORY_MB,
+                 max_processes=DEFAULT_MAX_PROCESSES,
+                 require_network_isolation=REQUIRE_NETWORK_ISOLATION,
+                 require_filesystem_isolation=REQUIRE_FILESYSTEM_ISOLATION,
+                 sandbox_uid=SANDBOX_UID,
+                 sandbox_gid=SANDBOX_GID,
+                 work_root=None):
+        """Initialize the sandbox and start its workers.
+
+        Args:
+            num_workers: Worker processes, i.e. programs that can run at the same time
+            memory_mb: Memory limit of a program in megabytes
+            max_processes: Process limit (RLIMIT_NPROC) of a program
+            require_network_isolation: Refuse to run code when a network
+                namespace cannot be created, instead of running it with network access
+            require_filesystem_isolation: Refuse to run code when it cannot be
+                confined to its working directory and run without privileges
+            sandbox_uid: User programs run as when the application runs as root
+            sandbox_gid: Group programs run as when the application runs as root
+            work_root: Directory for work directories (default the system temp directory)
+        """
+        self.num_workers = num_workers
+        self.memory_mb = memory_mb
+        self.max_processes = max_processes
+        self.require_network_isolation = require_network_isolation
+        self.require_filesystem_isolation = require_filesystem_isolation
+        self.sandbox_uid = sandbox_uid
+        self.sandbox_gid = sandbox_gid
+        self.readonly_paths = get_readonly_paths()
+        self.work_root = work_root
+        self._env = {
+            'PATH': os.environ.get('PATH', '/usr/local/bin:/usr/bin:/bin'),
+            'LANG': 'C.UTF-8',
+            'PYTHONIOENCODING': 'utf-8'
+        }
+        self._idle = queue.Queue()
+
+        for _ in range(num_workers):
+            self._idle.put(_Worker(self._env))
+
+    def _limits(self, memory_mb, cpu_seconds, limit_address_space=True):
+        return {
+            'cpu_seconds': max(1, int(cpu_seconds + 0.999)),
+            'memory_bytes': memory_mb * 1024 * 1024 if limit_address_space else None,
+            'processes': self.max_processes,
+            'file_size_bytes': MAX_FILE_SIZE_BYTES,
+            'open_files': MAX_OPEN_FILES
+        }
+
+    def _submit(self, request):
+        """Run a request on an idle worker, replacing the worker if it fails."""
+        worker = self._idle.get()
+        try:
+            return worker.request(request, request['timeout'])
+        except RuntimeError:
+            worker.kill()
+            worker = _Worker(self._env)
+            raise
+        finally:
+            self._idle.put(worker)
+
+    def _format(self, argv, program, memory_mb):
+        values = {
+            'source': program.source_path,
+            'binary': os.path.join(program.workdir, 'program'),
+            'workdir': program.workdir,
+            'main_class': os.path.splitext(os.path.basename(program.source_path))[0],
+            'memory_mb': memory_mb
+        }
+        return [part.format(**values) for part in argv]
+
+    def prepare(self, code, language, workdir=None):
+        """Write code to a work directory and compile it if the language needs it.
+
+        Args:
+            code: Source code
+            language: Language name (python, c, cpp, java, javascript, php)
+            workdir: Directory to use; a new temporary directory by default
+
+        Returns:
+            Program: The prepared program; check program.compiled before running it
+
+        Raises:
+            ValueError: If the language is not supported
+        """
+        config = LANGUAGES.get((language or '').lower())
+        if config is None:
+            raise ValueError(f'Unsupported language: {language}')
+
+        if workdir is None:
+            workdir = tempfile.mkdtemp(prefix='edumate-run-', dir=self.work_root)
+        else:
+            # Commands run from other directories, so paths must be absolute
+            workdir = os.path.abspath(workdir)
+            os.makedirs(workdir, exist_ok=True)
+
+        # Java requires the file to be named after its public class
+        name = 'main'
+        if language.lower() == 'java':
+            match = _JAVA_CLASS_PATTERN.search(code)
+            name = match.group(1) if match else 'Main'
+
+        source_path = os.path.join(workdir, name + config['extension'])
+        with open(source_path, 'w', encoding='utf-8') as f:
+            f.write(code)
+
+        program = Program(language.lower(), workdir, source_path)
+        if 'run' in config:
+            program.run_argv = self._format(config['run'], program, self.memory_mb)
+
+        if 'compile' in config:
+            result = self._execute_request({
+                'argv': self._format(config['compile'], program, COMPILE_MEMORY_MB),
+                'cwd': workdir,
+                'timeout': COMPILE_TIMEOUT,
+                'limits': self._limits(COMPILE_MEMORY_MB, COMPILE_TIMEOUT, config.get('limit_address_space', True))
+            })
+            # Show file names as the student wrote them, not the work directory
+            result['error'] = result['error'].replace(workdir + os.sep, '')
+            result['stage'] = 'compile'
+            program.compile_result = result
+
+        self._seal(workdir)
+        return program
+
+    def _seal(self, workdir):
+        """Take the work directory back from the sandbox user and make it read-only to others.
+
+        The compiler runs as the sandbox user and owns what it wrote; runs of
+        the program must not be able to change it.
+        """
+        for directory, _, files in os.walk(workdir):
+            for path in [directory] + [os.path.join(directory, name) for name in files]:
+                if os.geteuid() == 0:
+                    os.lchown(path, 0, 0)
+                if not os.path.islink(path):
+                    executable = os.path.isdir(path) or os.stat(path).st_mode & 0o100
+                    os.chmod(path, 0o755 if executable else 0o644)
+
+    def run(self, program, stdin='', timeout=5, cwd=None):
+        """Run a prepared program.
+
+        Args:
+            program: Program from prepare()
+            stdin: Text passed on standard input
+            timeout: Wall-clock limit in seconds (also the CPU time limit)
+            cwd: Directory the program runs in (default its work directory);
+                lets runs of a shared compiled program not see each other's
+                files. The program's work directory is read-only to such runs
+                and a Python source is copied into cwd.
+
+        Returns:
+            dict: success, output, error, exit_code, timed_out, duration
+                (seconds) and max_memory_kb
+        """
+        if not program.compiled:
+            return program.compile_result
+
+        config = LANGUAGES[program.language]
+        cwd = cwd or program.workdir
+        request = {
+            'cwd': cwd,
+            'timeout': timeout,
+            'limits': self._limits(self.memory_mb, timeout, config.get('limit_address_space', True))
+        }
+        if program.run_argv:
+            request['argv'] = program.run_argv
+            if cwd != program.workdir:
+                # The program's files are visible to the run, read-only
+                request['readonly_paths'] = self.readonly_paths + [program.workdir]
+        elif cwd != program.workdir:
+            # Each run gets its own copy, so a run cannot change the shared source
+            request['python_file'] = shutil.copy(program.source_path, cwd)
+        else:
+            request['python_file'] = program.source_path
+
+        stdin_file = None
+        if stdin:
+            fd, stdin_file = tempfile.mkstemp(prefix='stdin-', dir=cwd)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(stdin)
+            request['stdin_file'] = stdin_file
+
+        try:
+            result = self._execute_request(request)
+        finally:
+            if stdin_file:
+                os.unlink(stdin_file)
+        result['stage'] = 'run'
+        return result
+
+    def execute(self, code, language, stdin='', timeout=5):
+        """Prepare, run and clean up code in one step."""
+        try:
+            program = self.prepare(code, language)
+        except ValueError as e:
+            return {'success': False, 'output': '', 'error': str(e)}
+
+        try:
+            return self.run(program, stdin=stdin, timeout=timeout)
+        finally:
+            program.cleanup()
+
+    def _execute_request(self, request):
+        """Run a request in the sandbox and convert the worker's answer into a result dict."""
+        request.setdefault('readonly_paths', self.readonly_paths)
+        request.update({
+            # The working directory is the only writable place in the sandbox
+            'env': dict(self._env, HOME=request['cwd'], TMPDIR=request['cwd']),
+            'max_output_bytes': MAX_OUTPUT_BYTES,
+            'isolate_network': True,
+            'require_network_isolation': self.require_network_isolation,
+            'isolate_filesystem': True,
+            'require_filesystem_isolation': self.require_filesystem_isolation,
+            'sandbox_uid': self.sandbox_uid,
+            'sandbox_gid': self.sandbox_gid
+        })
+
+        try:
+            response = self._submit(request)
+        except RuntimeError as e:
+            return {'success': False, 'output': '', 'error': str(e)}
+        if 'worker_error' in response:
+            return {'success': False, 'output': '', 'error': response['worker_error']}
+
+        error = response['stderr']
+        if response['timed_out']:
+            error = f"Execution timed out after {request['timeout']} seconds\n{error}".rstrip('\n')
+        elif response['output_truncated']:
+            error = f"Output exceeded {MAX_OUTPUT_BYTES} bytes\n{error}".rstrip('\n')
+
+        return {
+            'success': response['exit_code'] == 0 and not response['timed_out'] and not response['output_truncated'],
+            'output': response['stdout'],
+            'error': error,
+            'exit_code': response['exit_code'],
+            'timed_out': response['timed_out'],
+            'duration': response['duration'],
+            'max_memory_kb': response['max_memory_kb']
+        }
+
+    def close(self):
+        """Stop the workers."""
+        while True:
+            try:
+                self._idle.get_nowait().kill()
+            except queue.Empty:
+                break
+
+
+_sandbox = None
+_sandbox_lock = threading.Lock()
+
+
+def get_code_sandbox():
+    """Get the process-wide code sandbox, starting its workers on first use."""
+    global _sandbox
+    with _sandbox_lock:
+        if _sandbox is None:
+            _sandbox = CodeSandbox()
+        return _sandbox
@@ -4,10 +4,15 @@ import subprocess
 import tempfile
 import re
 import time
+from edumate.utils.code_sandbox import SANDBOX_SUPPORTED, get_code_sandbox
 
 
-def run_code(code, language, timeout=5):
-    """Run code in a safe environment and return the result."""
+def run_code(code, language, timeout=5, stdin=''):
+    """Run code in a safe environment and return the result.
+    
+    On Linux the code runs in the resource-limited sandbox; elsewhere it is
+    run directly with only a timeout.
+    """
     if not code or not language:
         return {
             'success': False,
@@ -15,6 +20,9 @@ def run_code(code, language, timeout=5):
             'error': 'Invalid input'
         }
     
+    if SANDBOX_SUPPORTED:
+        return get_code_sandbox().execute(code, language, stdin=stdin, timeout=timeout)
+    
     # Create a temporary file
     with tempfile.NamedTemporaryFile(delete=False, suffix=get_file_extension(language)) as temp:
         temp_filename = temp.name
@@ -24,7 +32,7 @@ def run_code(code, language, timeout=5):
             temp.flush()
             
             # Run the code based on the language
-            result = execute_code(temp_filename, language, timeout)
+            result = execute_code(temp_filename, language, timeout, stdin)
             
             return result
         except Exception as e:
@@ -35,34 +43,52 @@ def run_code(code, language, timeout=5):
             }
         finally:
             # Clean up
-            try:
-                os.unlink(temp_filename)
-            except:
-                pass
+            for path in (temp_filename, temp_filename + '.out'):
+                try:
+                    os.unlink(path)
+                except:
+                    pass
+
+
+LANGUAGE_EXTENSIONS = {
+    'python': '.py',
+    'java': '.java',
+    'cpp': '.cpp',
+    'c': '.c',
+    'javascript': '.js',
+    'html': '.html',
+    'css': '.css',
+    'php': '.php'
+}
 
 
 def get_file_extension(language):
     """Get the file extension for a language."""
-    extensions = {
-        'python': '.py',
-        'java': '.java',
-        'cpp': '.cpp',
-        'c': '.c',
-        'javascript': '.js',
-        'html': '.html',
-        'css': '.css',
-        'php': '.php'
-    }
-    return extensions.get(language.lower(), '.txt')
+    return LANGUAGE_EXTENSIONS.get(language.lower(), '.txt')
+
 
+def get_language_from_filename(filename):
+    """Get the language of a code file from its extension, or None if unknown."""
+    if not filename:
+        return None
+    ext = os.path.splitext(filename)[1].lower()
+    for language, language_ext in LANGUAGE_EXTENSIONS.items():
+        if language_ext == ext:
+            return language
+    return None
 
-def execute_code(filename, language, timeout):
-    """Execute code in a specific language."""
+
+def execute_code(filename, language, timeout, stdin=''):
+    """Execute code in a specific language without the sandbox."""
+    compile_commands = {
+        'cpp': ['g++', filename, '-o', filename + '.out'],
+        'c': ['gcc', filename, '-o', filename + '.out']
+    }
     commands = {
         'python': ['python', filename],
         'java': ['java', filename],
-        'cpp': ['g++', filename, '-o', filename + '.out', '&&', filename + '.out'],
-        'c': ['gcc', filename, '-o', filename + '.out', '&&', filename + '.out'],
+        'cpp': [filename + '.out'],
+        'c': [filename + '.out'],
         'javascript': ['node', filename],
         'php': ['php', filename]
     }
@@ -76,16 +102,34 @@ def execute_code(filename, language, timeout):
         }
     
     try:
+        # Compile first for compiled languages
+        compile_cmd = compile_commands.get(language.lower())
+        if compile_cmd:
+            compiled = subprocess.run(
+                compile_cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+                timeout=30
+            )
+            if compiled.returncode != 0:
+                return {
+                    'success': False,
+                    'output': compiled.stdout,
+                    'error': compiled.stderr
+                }
+        
         # Execute the command with a timeout
         process = subprocess.Popen(
             cmd,
+            stdin=subprocess.PIPE,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
             text=True
         )
         
         try:
-            stdout, stderr = process.communicate(timeout=timeout)
+            stdout, stderr = process.communicate(input=stdin or None, timeout=timeout)
             
             return {
                 'success': process.returncode == 0,
@@ -1,9 +1,10 @@
 import os
 import json
-import requests
 from typing import List, Dict, Any
 import logging
 from .logger import log_system_event, log_error
+from .http_client import get_http_session
+from .result_cache import get_result_cache, normalize_query
 
 class CourseSearch:
     def __init__(self):
@@ -14,6 +15,9 @@ class CourseSearch:
         """
         Search for courses using Google Search API
         
+        Results are cached per normalized query, so repeated searches don't
+        use up the daily search quota.
+        
         Args:
             query: Search query for courses
             limit: Maximum number of results to return
@@ -26,41 +30,49 @@ class CourseSearch:
             return []
             
         try:
-            # Enhance the query to focus on courses
-            enhanced_query = f"{query} online course tutorial learn"
-            
-            # Make the API request
-            url = "https://www.googleapis.com/customsearch/v1"
-            params = {
-                'key': self.api_key,
-                'cx': self.search_engine_id,
-                'q': enhanced_query,
-                'num': limit
-            }
-            
-            response = requests.get(url, params=params)
-            response.raise_for_status()
-            
-            # Process the results
-            data = response.json()
-            results = []
-            
-            if 'items' in data:
-                for item in data['items']:
-                    result = {
-                        'title': item.get('title', ''),
-                        'link': item.get('link', ''),
-                        'description': item.get('snippet', ''),
-                        'source': self._extract_domain(item.get('link', ''))
-                    }
-                    results.append(result)
-                    
-            return results
+            return get_result_cache().get_or_compute(
+                'course_search',
+                [normalize_query(query), limit],
+                lambda: self._fetch_courses(query, limit)
+            )
         
         except Exception as e:
             log_error(f"Error searching for courses: {str(e)}")
             return []
     
+    def _fetch_courses(self, query: str, limit: int) -> List[Dict[str, Any]]:
+        """Query the Google Search API; raises on request errors"""
+        # Enhance the query to focus on courses
+        enhanced_query = f"{query} online course tutorial learn"
+        
+        # Make the API request
+        url = "https://www.googleapis.com/customsearch/v1"
+        params = {
+            'key': self.api_key,
+            'cx': self.search_engine_id,
+            'q': enhanced_query,
+            'num': limit
+        }
+        
+        response = get_http_session().get(url, params=params)
+        response.raise_for_status()
+        
+        # Process the results
+        data = response.json()
+        results = []
+        
+        if 'items' in data:
+            for item in data['items']:
+                result = {
+                    'title': item.get('title', ''),
+                    'link': item.get('link', ''),
+                    'description': item.get('snippet', ''),
+                    'source': self._extract_domain(item.get('link', ''))
+                }
+                results.append(result)
+                
+        return results
+    
     def search_courses_by_skill(self, skill: str, level: str = "beginner") -> List[Dict[str, Any]]:
         """
         Search for courses based on a specific skill and level
@@ -0,0 +1,156 @@
+"""Persistent key-value cache for EduMate.
+
+Values are stored in a SQLite database and evicted least-recently-used first
+once the total stored size exceeds a configurable limit, so caches survive
+restarts without growing without bound. Entries can optionally expire after
+a fixed time-to-live.
+"""
+
+import os
+import time
+import sqlite3
+import threading
+
+
+class DiskCache:
+    """Size-bounded LRU cache persisted to SQLite."""
+
+    def __init__(self, db_path, max_size_bytes=256 * 1024 * 1024, ttl_seconds=None):
+        """Initialize the cache.
+
+        Args:
+            db_path (str): Path of the SQLite database file
+            max_size_bytes (int): Total size of stored values above which the
+                least recently used entries are evicted
+            ttl_seconds (float, optional): Age after which entries are treated
+                as missing; None keeps entries until they are evicted
+        """
+        self.db_path = db_path
+        self.max_size_bytes = max_size_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self._init_database()
+
+    def _connect(self):
+        """Open a connection; each call uses its own so threads never share one."""
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def _init_database(self):
+        """Create the cache table if needed."""
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS cache (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                );
+
+                CREATE INDEX IF NOT EXISTS idx_cache_last_access ON cache (last_access);
+            """)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def get(self, key):
+        """Get a cached value, or None if it is not cached."""
+        entry = self.get_entry(key)
+        return entry[0] if entry is not None else None
+
+    def get_entry(self, key):
+        """Get a cached value with the time it was stored, or None if it is not cached.
+
+        Returns:
+            tuple: (value, created_at timestamp)
+        """
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT value, created_at FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+
+            now = time.time()
+            if self.ttl_seconds is not None and now - row[1] > self.ttl_seconds:
+                with conn:
+                    conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                return None
+
+            with conn:
+                conn.execute("UPDATE cache SET last_access = ? WHERE key = ?", (now, key))
+            return row[0], row[1]
+        except sqlite3.Error as e:
+            print(f"Error reading from cache {self.db_path}: {e}")
+            return None
+        finally:
+            conn.close()
+
+    def set(self, key, value):
+        """Store a value, evicting old entries if the cache is over its size limit."""
+        size = len(value.encode('utf-8'))
+        if size > self.max_size_bytes:
+            return
+
+        now = time.time()
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    """INSERT OR REPLACE INTO cache (key, value, size, created_at, last_access)
+                       VALUES (?, ?, ?, ?, ?)""",
+                    (key, value, size, now, now)
+                )
+            self._evict(conn)
+        except sqlite3.Error as e:
+            print(f"Error writing to cache {self.db_path}: {e}")
+        finally:
+            conn.close()
+
+    def delete(self, key):
+        """Remove a value from the cache."""
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+        finally:
+            conn.close()
+
+    def clear(self):
+        """Remove every value from the cache."""
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM cache")
+        finally:
+            conn.close()
+
+    def stats(self):
+        """Get the number of entries and total stored size."""
+        conn = self._connect()
+        try:
+            count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache").fetchone()
+        finally:
+            conn.close()
+        return {'entries': count, 'size_bytes': total, 'max_size_bytes': self.max_size_bytes}
+
+    def _evict(self, conn):
+        """Evict least recently used entries until under 90% of the size limit."""
+        with self._lock:
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+            if total <= self.max_size_bytes:
+                return
+
+            target = self.max_size_bytes * 0.9
+            evict_keys = []
+            for key, size in conn.execute("SELECT key, size FROM cache ORDER BY last_access"):
+                if total <= target:
+                    break
+                evict_keys.append((key,))
+                total -= size
+
+            with conn:
+                conn.executemany("DELETE FROM cache WHERE key = ?", evict_keys)
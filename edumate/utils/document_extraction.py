@@ -0,0 +1,193 @@
+"""Streaming text extraction for PDF and DOCX submissions.
+
+PDFs are read page by page with PyMuPDF. Each page gets a text density score
+(characters of extractable text per square inch) so callers can tell pages
+with a real text layer from scanned or handwritten pages that need a
+multimodal model. Long PDFs are split into page ranges that are extracted in
+parallel by a shared pool of worker processes.
+"""
+
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import fitz  # PyMuPDF
+import docx
+
+# A full page of typed text is roughly 30 chars per square inch; scanned pages
+# usually have no text layer at all, or only a header or page number
+MIN_TEXT_DENSITY = 0.5
+
+DEFAULT_MAX_PAGES = 200
+DEFAULT_MAX_CHARS = 500000
+
+# Documents with at least this many pages are extracted in parallel
+PARALLEL_PAGE_THRESHOLD = 40
+PAGES_PER_TASK = 20
+
+# Worker processes of the shared extraction pool
+DEFAULT_EXTRACTION_WORKERS = int(os.getenv('PDF_EXTRACTION_WORKERS', str(min(4, os.cpu_count() or 1))))
+
+_extraction_pool = None
+_extraction_pool_lock = threading.Lock()
+
+
+def get_extraction_pool():
+    """Get the process-wide pool for parallel PDF extraction.
+
+    Workers are spawned rather than forked, so they don't inherit the
+    threads and open handles of the web app.
+    """
+    global _extraction_pool
+    with _extraction_pool_lock:
+        if _extraction_pool is None:
+            _extraction_pool = ProcessPoolExecutor(
+                max_workers=DEFAULT_EXTRACTION_WORKERS,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return _extraction_pool
+
+
+def text_density(text, width, height):
+    """Get characters of text per square inch of page area."""
+    area = (width / 72.0) * (height / 72.0)
+    if area <= 0:
+        return 0.0
+    return len(text.strip()) / area
+
+
+def _page_info(page, page_number, min_density):
+    """Extract a page's text and classify whether it has a usable text layer."""
+    text = page.get_text("text")
+    density = text_density(text, page.rect.width, page.rect.height)
+    return {
+        'page_number': page_number,
+        'text': text,
+        'char_count': len(text),
+        'density': density,
+        'has_text_layer': density >= min_density
+    }
+
+
+def _apply_char_budget(info, remaining):
+    """Cut a page's text to the remaining character budget, keeping its metadata."""
+    remaining = max(remaining, 0)
+    info['text_truncated'] = info['char_count'] > remaining
+    if info['text_truncated']:
+        info['text'] = info['text'][:remaining]
+        info['char_count'] = remaining
+    return info
+
+
+def _extract_page_range(file_path, start, end, min_density):
+    """Extract pages [start, end) in a worker process."""
+    pages = []
+    with fitz.open(file_path) as document:
+        for page_index in range(start, min(end, document.page_count)):
+            pages.append(_page_info(document[page_index], page_index + 1, min_density))
+    return pages
+
+
+def iter_pdf_pages(file_path, max_pages=DEFAULT_MAX_PAGES, max_chars=DEFAULT_MAX_CHARS,
+                   min_density=MIN_TEXT_DENSITY):
+    """Yield page information one page at a time within the page/char budget.
+
+    Pages past the character budget are still yielded with their metadata
+    (so scanned pages are still detected), just without their text.
+
+    Args:
+        file_path (str): Path of the PDF
+        max_pages (int): Maximum number of pages to read
+        max_chars (int): Maximum number of characters of text to keep
+        min_density (float): Density below which a page is treated as scanned
+
+    Yields:
+        dict: page_number, text, char_count, density, has_text_layer and
+            text_truncated (text was cut to fit the budget)
+    """
+    total_chars = 0
+    with fitz.open(file_path) as document:
+        for page_index in range(min(document.page_count, max_pages)):
+            info = _page_info(document[page_index], page_index + 1, min_density)
+            _apply_char_budget(info, max_chars - total_chars)
+            total_chars += info['char_count']
+            yield info
+
+
+def extract_pdf_pages(file_path, max_pages=DEFAULT_MAX_PAGES, max_chars=DEFAULT_MAX_CHARS,
+                      min_density=MIN_TEXT_DENSITY):
+    """Extract all pages of a PDF within the page/char budget.
+
+    Large documents are split into page ranges processed in parallel on the
+    shared extraction pool.
+
+    Returns:
+        list: Page information dictionaries in page order
+    """
+    with fitz.open(file_path) as document:
+        page_count = min(document.page_count, max_pages)
+
+    if page_count < PARALLEL_PAGE_THRESHOLD:
+        return list(iter_pdf_pages(file_path, max_pages, max_chars, min_density))
+
+    ranges = [(start, min(start + PAGES_PER_TASK, page_count))
+              for start in range(0, page_count, PAGES_PER_TASK)]
+
+    executor = get_extraction_pool()
+    futures = [executor.submit(_extract_page_range, file_path, start, end, min_density)
+               for start, end in ranges]
+    pages = []
+    for future in futures:
+        pages.extend(future.result())
+
+    # Apply the character budget in page order
+    total_chars = 0
+    for info in pages:
+        _apply_char_budget(info, max_chars - total_chars)
+        total_chars += info['char_count']
+
+    return pages
+
+
+def pages_without_text(pages):
+    """Get the page numbers that lack a usable text layer."""
+    return [info['page_number'] for info in pages if not info['has_text_layer']]
+
+
+def write_pdf_subset(file_path, page_numbers, output_path):
+    """Write the given (1-based) pages of a PDF to a new PDF file.
+
+    Returns:
+        str: The output path
+    """
+    with fitz.open(file_path) as source, fitz.open() as subset:
+        for page_number in page_numbers:
+            subset.insert_pdf(source, from_page=page_number - 1, to_page=page_number - 1)
+        subset.save(output_path, garbage=3, deflate=True)
+    return output_path
+
+
+def extract_docx_text(file_path, max_chars=DEFAULT_MAX_CHARS):
+    """Extract paragraph and table text from a DOCX file within a character budget."""
+    document = docx.Document(file_path)
+
+    parts = []
+    total_chars = 0
+
+    def add(text):
+        nonlocal total_chars
+        if not text or total_chars >= max_chars:
+            return
+        text = text[:max_chars - total_chars]
+        parts.append(text)
+        total_chars += len(text)
+
+    for paragraph in document.paragraphs:
+        add(paragraph.text)
+
+    for table in document.tables:
+        for row in table.rows:
+            add(" | ".join(cell.text.strip() for cell in row.cells))
+
+    return "\n".join(parts)
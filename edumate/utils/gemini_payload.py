@@ -0,0 +1,346 @@
+"""Request payloads for Gemini file analysis.
+
+Sending a file to Gemini used to mean reading it whole and base64-encoding
+it into memory for every call, so a scanned PDF evaluated by three models
+cost three full reads and three encoded copies in RAM. Files are now:
+
+- hashed once per (path, size, mtime) and base64-encoded once per content
+  hash into an on-disk cache, in fixed-size chunks so memory stays bounded;
+- streamed from that cache into the HTTP request body, so the encoded file
+  is never held in memory;
+- or, above a size threshold, uploaded once through the Gemini File API (its
+  REST endpoint, on the shared HTTP session) and referenced by its handle
+  until the upload expires.
+"""
+
+import os
+import io
+import json
+import time
+import base64
+import hashlib
+import threading
+
+# Bytes read per block; a multiple of 3 so encoded blocks join without padding
+READ_CHUNK_BYTES = 3 * 256 * 1024
+
+DEFAULT_CACHE_DIR = os.path.join('data', 'cache', 'gemini_payloads')
+DEFAULT_MAX_CACHE_BYTES = int(os.getenv('GEMINI_PAYLOAD_CACHE_BYTES', str(512 * 1024 * 1024)))
+
+# Files at least this large are uploaded with the File API instead of sent inline
+DEFAULT_UPLOAD_THRESHOLD_BYTES = int(os.getenv('GEMINI_UPLOAD_THRESHOLD_BYTES', str(8 * 1024 * 1024)))
+
+# Uploaded files are deleted by the service after 48 hours
+FILE_HANDLE_TTL_SECONDS = 47 * 3600
+
+GEMINI_FILES_UPLOAD_URL = "https://generativelanguage.googleapis.com/upload/v1beta/files"
+GEMINI_FILES_API_URL = "https://generativelanguage.googleapis.com/v1beta"
+
+# Seconds to wait for an uploaded file to finish processing
+FILE_PROCESSING_TIMEOUT = 60
+
+_DATA_PLACEHOLDER = "__EDUMATE_INLINE_DATA__"
+
+
+def file_content_hash(path):
+    """SHA-256 of a file's content, read in blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(READ_CHUNK_BYTES), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class StreamedBody:
+    """HTTP request body made of byte strings and files, read block by block.
+
+    It has a known length, so requests sends a normal Content-Length request
+    without ever holding the files in memory.
+    """
+
+    def __init__(self, parts):
+        """Initialize the body.
+
+        Args:
+            parts: bytes, or paths (str) of files to include verbatim
+        """
+        self._parts = list(parts)
+        self._length = sum(len(part) if isinstance(part, bytes) else os.path.getsize(part)
+                           for part in self._parts)
+        self._index = 0
+        self._current = None
+        self._position = 0
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        while True:
+            block = self.read(READ_CHUNK_BYTES)
+            if not block:
+                return
+            yield block
+
+    def read(self, size=-1):
+        """Read up to size bytes (everything that is left if size is negative)."""
+        blocks = []
+        remaining = size
+        while self._index < len(self._parts) and (size < 0 or remaining > 0):
+            if self._current is None:
+                part = self._parts[self._index]
+                self._current = io.BytesIO(part) if isinstance(part, bytes) else open(part, 'rb')
+
+            block = self._current.read(-1 if size < 0 else remaining)
+            if block:
+                blocks.append(block)
+                remaining -= len(block)
+            else:
+                self._current.close()
+                self._current = None
+                self._index += 1
+
+        data = b''.join(blocks)
+        self._position += len(data)
+        return data
+
+    def tell(self):
+        """Number of bytes read so far."""
+        return self._position
+
+    def seek(self, offset, whence=0):
+        """Move to an absolute position, so the HTTP client can rewind the body to retry a request."""
+        if whence != 0:
+            raise io.UnsupportedOperation("StreamedBody only supports absolute seeks")
+        self.close()
+        self._index = 0
+        self._position = 0
+        while offset > 0:
+            skipped = self.read(min(offset, READ_CHUNK_BYTES))
+            if not skipped:
+                break
+            offset -= len(skipped)
+        return self._position
+
+    def close(self):
+        """Close the file being read, if any."""
+        if self._current is not None:
+            self._current.close()
+            self._current = None
+
+
+class PayloadCache:
+    """Caches base64-encoded files on disk and File API handles by content hash."""
+
+    def __init__(self,
+                 cache_dir=DEFAULT_CACHE_DIR,
+                 max_size_bytes=DEFAULT_MAX_CACHE_BYTES,
+                 upload_threshold_bytes=DEFAULT_UPLOAD_THRESHOLD_BYTES):
+        """Initialize the payload cache.
+
+        Args:
+            cache_dir: Directory holding encoded files and the handle index
+            max_size_bytes: Total size of encoded files kept before the least recently used are removed
+            upload_threshold_bytes: File size from which the File API is used; None disables uploads
+        """
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        self.upload_threshold_bytes = upload_threshold_bytes
+        self._hashes = {}
+        self._lock = threading.Lock()
+        self._handles_path = os.path.join(cache_dir, 'file_handles.json')
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def content_hash(self, path):
+        """Content hash of a file, computed once per (path, size, modification time)."""
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            digest = self._hashes.get(key)
+        if digest is None:
+            digest = file_content_hash(path)
+            with self._lock:
+                self._hashes[key] = digest
+        return digest
+
+    def encoded_path(self, path):
+        """Path of the base64 encoding of a file, encoding it on first use."""
+        digest = self.content_hash(path)
+        encoded = os.path.join(self.cache_dir, f"{digest}.b64")
+
+        if os.path.exists(encoded):
+            # Mark as recently used for eviction
+            os.utime(encoded)
+            return encoded
+
+        temp_path = f"{encoded}.{threading.get_ident()}.tmp"
+        with open(path, 'rb') as source, open(temp_path, 'wb') as target:
+            for block in iter(lambda: source.read(READ_CHUNK_BYTES), b''):
+                target.write(base64.b64encode(block))
+        os.replace(temp_path, encoded)
+
+        self._evict(keep=encoded)
+        return encoded
+
+    def _evict(self, keep=None):
+        """Remove the least recently used encoded files above the size limit, except keep."""
+        try:
+            entries = []
+            for name in os.listdir(self.cache_dir):
+                if name.endswith('.b64'):
+                    entry_path = os.path.join(self.cache_dir, name)
+                    stat = os.stat(entry_path)
+                    entries.append((stat.st_mtime, stat.st_size, entry_path))
+        except OSError as e:
+            print(f"Error reading payload cache: {e}")
+            return
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry_path in sorted(entries):
+            if total <= self.max_size_bytes:
+                break
+            if entry_path == keep:
+                continue
+            try:
+                os.remove(entry_path)
+                total -= size
+            except OSError:
+                pass
+
+    def _load_handles(self):
+        if os.path.exists(self._handles_path):
+            try:
+                with open(self._handles_path, 'r') as f:
+                    return json.load(f)
+            except (OSError, json.JSONDecodeError):
+                pass
+        return {}
+
+    def _save_handles(self, handles):
+        temp_path = f"{self._handles_path}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(handles, f)
+        os.replace(temp_path, self._handles_path)
+
+    def file_handle(self, path, mime_type, api_key):
+        """URI of the file uploaded with the Gemini File API, uploading it on first use.
+
+        Returns:
+            str: The file URI, or None if the upload failed
+        """
+        digest = self.content_hash(path)
+        # Uploads belong to the project of the key they were made with
+        key = f"{hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]}:{digest}"
+
+        with self._lock:
+            handles = self._load_handles()
+            handle = handles.get(key)
+            if handle and handle['expires_at'] > time.time():
+                return handle['uri']
+
+        try:
+            uploaded = _upload_file(path, mime_type, api_key)
+
+            # Wait briefly for large files to finish processing
+            deadline = time.time() + FILE_PROCESSING_TIMEOUT
+            while uploaded.get('state') == 'PROCESSING' and time.time() < deadline:
+                time.sleep(2)
+                uploaded = _get_file(uploaded['name'], api_key)
+            if uploaded.get('state', 'ACTIVE') != 'ACTIVE':
+                print(f"Error uploading file to Gemini: file is {uploaded.get('state')}")
+                return None
+        except Exception as e:
+            print(f"Error uploading file to Gemini: {e}")
+            return None
+
+        with self._lock:
+            handles = {k: v for k, v in self._load_handles().items() if v['expires_at'] > time.time()}
+            handles[key] = {'uri': uploaded['uri'], 'expires_at': time.time() + FILE_HANDLE_TTL_SECONDS}
+            self._save_handles(handles)
+        return uploaded['uri']
+
+    def build_request_body(self, prompt, file_path=None, mime_type=None, api_key=None):
+        """Build a generateContent request body for a prompt and an optional file.
+
+        Large files are referenced by File API handle when an API key is
+        given; other files are streamed inline from the encoded cache.
+
+        Returns:
+            bytes or StreamedBody: The JSON request body
+        """
+        parts = [{"text": prompt}]
+        if not file_path:
+            return json.dumps({"contents": [{"parts": parts}]}).encode('utf-8')
+
+        if (api_key and self.upload_threshold_bytes is not None
+                and os.path.getsize(file_path) >= self.upload_threshold_bytes):
+            uri = self.file_handle(file_path, mime_type, api_key)
+            if uri:
+                parts.append({"file_data": {"mime_type": mime_type, "file_uri": uri}})
+                return json.dumps({"contents": [{"parts": parts}]}).encode('utf-8')
+
+        parts.append({"inline_data": {"mime_type": mime_type, "data": _DATA_PLACEHOLDER}})
+        prefix, suffix = json.dumps({"contents": [{"parts": parts}]}).split(_DATA_PLACEHOLDER)
+        return StreamedBody([prefix.encode('utf-8'), self.encoded_path(file_path), suffix.encode('utf-8')])
+
+
+def _upload_file(path, mime_type, api_key):
+    """Upload a file with the File API's resumable protocol (start, then upload and finalize).
+
+    Returns:
+        dict: The file resource (name, uri, state, ...)
+    """
+    from edumate.utils.http_client import get_http_session
+
+    session = get_http_session()
+    size = os.path.getsize(path)
+    start = session.post(
+        GEMINI_FILES_UPLOAD_URL,
+        params={'key': api_key},
+        headers={
+            'X-Goog-Upload-Protocol': 'resumable',
+            'X-Goog-Upload-Command': 'start',
+            'X-Goog-Upload-Header-Content-Length': str(size),
+            'X-Goog-Upload-Header-Content-Type': mime_type
+        },
+        json={'file': {'display_name': os.path.basename(path)}}
+    )
+    start.raise_for_status()
+    upload_url = start.headers.get('X-Goog-Upload-URL')
+    if not upload_url:
+        raise ValueError("File API did not return an upload URL")
+
+    # The file object is streamed, not read into memory
+    with open(path, 'rb') as f:
+        response = session.post(
+            upload_url,
+            headers={
+                'Content-Length': str(size),
+                'X-Goog-Upload-Offset': '0',
+                'X-Goog-Upload-Command': 'upload, finalize'
+            },
+            data=f
+        )
+    response.raise_for_status()
+    return response.json()['file']
+
+
+def _get_file(name, api_key):
+    """Get the current state of an uploaded file (name is 'files/...')."""
+    from edumate.utils.http_client import get_http_session
+
+    response = get_http_session().get(f"{GEMINI_FILES_API_URL}/{name}", params={'key': api_key})
+    response.raise_for_status()
+    return response.json()
+
+
+_payload_cache = None
+_payload_cache_lock = threading.Lock()
+
+
+def get_payload_cache():
+    """Get the process-wide payload cache."""
+    global _payload_cache
+    with _payload_cache_lock:
+        if _payload_cache is None:
+            _payload_cache = PayloadCache(cache_dir=os.getenv('GEMINI_PAYLOAD_CACHE_DIR', DEFAULT_CACHE_DIR))
+        return _payload_cache
@@ -0,0 +1,97 @@
+"""Shared HTTP client for calls to external REST APIs.
+
+Calling requests.get/post directly opens a new TCP and TLS connection for
+every request and waits forever if the server stops responding. All REST
+callers (Gemini, course search) share one session instead, which:
+
+- keeps connections alive in a pool per host, so only the first call to a
+  host pays for the TLS handshake;
+- applies default connect and read timeouts to every request;
+- retries connection failures with exponential backoff, and 429/5xx
+  responses to GET requests honouring Retry-After.
+
+POST requests (LLM calls, uploads) are only retried when the connection
+fails. Their callers already retry 429/5xx through the rate limiter, batch
+grader or provider router, and retrying here as well would multiply the
+attempts and hide them from the limiter and the LLM metrics.
+"""
+
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Seconds to establish a connection and to wait for response data
+DEFAULT_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '5'))
+DEFAULT_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', '120'))
+
+# Connections kept open per host; should cover the number of concurrent workers
+DEFAULT_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '32'))
+
+DEFAULT_MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES', '2'))
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+class TimeoutSession(requests.Session):
+    """Session that applies a default timeout to requests made without one."""
+
+    def __init__(self, timeout=(DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT)):
+        super().__init__()
+        self.default_timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.default_timeout
+        return super().request(method, url, **kwargs)
+
+
+def create_session(pool_size=DEFAULT_POOL_SIZE,
+                   max_retries=DEFAULT_MAX_RETRIES,
+                   timeout=(DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT)):
+    """Create a pooled session with timeouts and a retry policy.
+
+    Args:
+        pool_size: Connections kept open per host
+        max_retries: Retries for connection errors, and for retryable status
+            codes of GET requests
+        timeout: Default (connect, read) timeout in seconds
+
+    Returns:
+        TimeoutSession: The configured session
+    """
+    retry = Retry(
+        total=max_retries,
+        connect=max_retries,
+        # A read timeout may mean the server is still working; don't send the request again
+        read=0,
+        status=max_retries,
+        status_forcelist=RETRY_STATUS_CODES,
+        # Status retries apply only to these methods; POSTs get connection retries only
+        allowed_methods=frozenset(['GET']),
+        backoff_factor=0.5,
+        respect_retry_after_header=True,
+        # Return the last response so callers can inspect the status themselves
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=10, pool_maxsize=pool_size, max_retries=retry)
+
+    session = TimeoutSession(timeout)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_http_session():
+    """Get the process-wide pooled HTTP session."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = create_session()
+        return _session
@@ -0,0 +1,150 @@
+"""Image and scanned-page preprocessing for multimodal AI analysis.
+
+Phone photos and scans of handwritten work are usually 3000-4000 pixels on
+the long edge with EXIF metadata and wide blank margins, while the model
+reads handwriting just as well at a fraction of that resolution. Before a
+file is sent for analysis it is:
+
+- rotated upright using its EXIF orientation, then stripped of metadata;
+- cropped to the written area, removing blank margins;
+- downscaled to a maximum long edge and recompressed as JPEG.
+
+Scanned PDF pages are rendered at a target DPI and go through the same
+steps, and are written back as a compact image-only PDF.
+"""
+
+import io
+import os
+
+import fitz  # PyMuPDF
+from PIL import Image, ImageOps
+
+# Long edge in pixels; enough for handwriting on a full page
+DEFAULT_MAX_EDGE = int(os.getenv('AI_IMAGE_MAX_EDGE', '1600'))
+
+DEFAULT_JPEG_QUALITY = int(os.getenv('AI_IMAGE_JPEG_QUALITY', '80'))
+
+# Render resolution for scanned PDF pages (an A4 page is about 1240x1750 px at 150 DPI)
+DEFAULT_RENDER_DPI = int(os.getenv('AI_PDF_RENDER_DPI', '150'))
+
+# Pixels lighter than this count as blank paper when cropping margins
+BLANK_THRESHOLD = 235
+
+# Margin kept around the written area, in pixels
+CROP_PADDING = 24
+
+
+def crop_blank_margins(image, threshold=BLANK_THRESHOLD, padding=CROP_PADDING):
+    """Crop the blank margins around the content of a page image."""
+    grayscale = image.convert('L')
+    # Content becomes white on black so getbbox finds it
+    mask = grayscale.point(lambda value: 255 if value < threshold else 0)
+    bbox = mask.getbbox()
+    if not bbox:
+        return image
+
+    left, top, right, bottom = bbox
+    box = (max(0, left - padding), max(0, top - padding),
+           min(image.width, right + padding), min(image.height, bottom + padding))
+
+    # Don't crop when only a sliver would be removed
+    if (box[2] - box[0]) * (box[3] - box[1]) > 0.95 * image.width * image.height:
+        return image
+    return image.crop(box)
+
+
+def prepare_image(image, max_edge=DEFAULT_MAX_EDGE, crop=True):
+    """Rotate, crop and downscale an image for a multimodal model.
+
+    Returns:
+        Image: An RGB or grayscale image no larger than max_edge on its long side
+    """
+    image = ImageOps.exif_transpose(image)
+
+    if image.mode not in ('RGB', 'L'):
+        if 'A' in image.getbands():
+            # Flatten transparency onto white paper
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        else:
+            image = image.convert('RGB')
+
+    if crop:
+        image = crop_blank_margins(image)
+
+    if max(image.size) > max_edge:
+        image = image.copy()
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    return image
+
+
+def _jpeg_bytes(image, quality):
+    """Encode an image as JPEG; metadata is not copied."""
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+def preprocess_image_file(image_path, output_path, max_edge=DEFAULT_MAX_EDGE, quality=DEFAULT_JPEG_QUALITY):
+    """Write a downscaled, metadata-free JPEG of an image for AI analysis.
+
+    Returns:
+        str: output_path, or image_path when preprocessing would not make the file smaller
+    """
+    try:
+        with Image.open(image_path) as image:
+            data = _jpeg_bytes(prepare_image(image, max_edge), quality)
+    except Exception as e:
+        print(f"Error preprocessing image {image_path}: {e}")
+        return image_path
+
+    if len(data) >= os.path.getsize(image_path):
+        return image_path
+
+    with open(output_path, 'wb') as f:
+        f.write(data)
+    return output_path
+
+
+def render_pdf_for_model(pdf_path, output_path, page_numbers=None, dpi=DEFAULT_RENDER_DPI,
+                         max_edge=DEFAULT_MAX_EDGE, quality=DEFAULT_JPEG_QUALITY):
+    """Render PDF pages as downscaled images into a compact image-only PDF.
+
+    Meant for scanned or handwritten pages, which have no text layer to
+    lose. Blank margins are cropped from each page.
+
+    Args:
+        pdf_path: Source PDF
+        output_path: Where to write the new PDF
+        page_numbers: 1-based pages to include (default all)
+        dpi: Render resolution before downscaling
+
+    Returns:
+        str: output_path, or pdf_path when rendering would not make the file smaller
+    """
+    try:
+        with fitz.open(pdf_path) as source, fitz.open() as rendered:
+            numbers = page_numbers or range(1, source.page_count + 1)
+            for page_number in numbers:
+                page = source[page_number - 1]
+                pixmap = page.get_pixmap(dpi=dpi)
+                image = Image.frombytes('RGB', (pixmap.width, pixmap.height), pixmap.samples)
+
+                # Size the new page to the cropped area so the aspect ratio is kept
+                points_per_pixel = page.rect.width / pixmap.width
+                image = crop_blank_margins(image)
+                width, height = image.width * points_per_pixel, image.height * points_per_pixel
+                image = prepare_image(image, max_edge, crop=False)
+
+                new_page = rendered.new_page(width=width, height=height)
+                new_page.insert_image(new_page.rect, stream=_jpeg_bytes(image, quality))
+
+            rendered.save(output_path, garbage=3, deflate=True)
+    except Exception as e:
+        print(f"Error rendering PDF {pdf_path}: {e}")
+        return pdf_path
+
+    if page_numbers is None and os.path.getsize(output_path) >= os.path.getsize(pdf_path):
+        return pdf_path
+    return output_path
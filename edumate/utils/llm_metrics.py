@@ -0,0 +1,300 @@
+"""Instrumentation for LLM calls.
+
+Every call to an AI provider is recorded with the feature that made it, the
+provider and model, prompt and completion token counts, wall time, retries
+and outcome. Each record is written to AdvancedLogger's performance log and
+kept in memory for aggregates (p50/p95 latency, tokens and estimated cost per
+feature, tokens per feature per hour) used for capacity planning and for
+finding slow prompts.
+
+The feature tag is set by the code that starts a piece of AI work:
+
+    @llm_feature('quiz_generation')
+    def generate_quiz(...):
+        ...
+
+and is picked up by every LLM call made underneath it, including calls made
+through GeminiService and AIService. The outermost tag wins, so a grading
+feature that generates feedback internally is still billed to grading.
+Streaming generators are tagged with iter_with_feature, which holds the tag
+only while the stream is advanced, not while the consumer handles a chunk.
+"""
+
+import time
+import hashlib
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+from edumate.utils.advanced_logger import get_logger
+from edumate.utils.token_budget import estimate_tokens
+
+# Maximum number of call records kept in memory for aggregates
+MAX_RECORDS = 50000
+
+# Approximate list prices in USD per million (input, output) tokens
+MODEL_PRICES = {
+    'gemini-pro': (0.50, 1.50),
+    'gemini-1.5-pro': (1.25, 5.00),
+    'gemini-1.5-flash': (0.075, 0.30),
+    'gemini-2.0-flash': (0.10, 0.40),
+    'gpt-3.5-turbo': (0.50, 1.50),
+    'gpt-3.5-turbo-instruct': (1.50, 2.00),
+    'gpt-4': (30.00, 60.00),
+}
+
+UNTAGGED_FEATURE = 'untagged'
+
+_feature = contextvars.ContextVar('llm_feature', default=None)
+_retries = contextvars.ContextVar('llm_retries', default=0)
+
+
+@contextmanager
+def llm_feature(name):
+    """Tag the LLM calls made inside this block (or decorated function) with a feature name."""
+    token = _feature.set(name) if _feature.get() is None else None
+    try:
+        yield
+    finally:
+        if token is not None:
+            _feature.reset(token)
+
+
+def iter_with_feature(name, iterable):
+    """Iterate a stream with the LLM calls it makes tagged with a feature name.
+
+    The tag is set around each step of the underlying iterator and reset
+    before the chunk is yielded, so it never leaks into the consumer's code
+    between chunks (a `with llm_feature(...)` around a yield would).
+    """
+    iterator = iter(iterable)
+    try:
+        while True:
+            with llm_feature(name):
+                try:
+                    chunk = next(iterator)
+                except StopIteration:
+                    return
+            yield chunk
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            with llm_feature(name):
+                close()
+
+
+@contextmanager
+def llm_retries(count):
+    """Mark the LLM calls made inside this block as retries of an earlier attempt."""
+    token = _retries.set(count)
+    try:
+        yield
+    finally:
+        _retries.reset(token)
+
+
+def current_feature():
+    """Get the feature tag of the current context, or None."""
+    return _feature.get()
+
+
+def estimate_cost(model, prompt_tokens, completion_tokens):
+    """Estimate the cost of a call in USD; 0 for models without a known price."""
+    prices = MODEL_PRICES.get(model)
+    if prices is None:
+        # Versioned names such as gemini-1.5-pro-002
+        prices = next((price for name, price in MODEL_PRICES.items() if model.startswith(name)), (0.0, 0.0))
+    return (prompt_tokens * prices[0] + completion_tokens * prices[1]) / 1000000
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+class LLMCall:
+    """Details of one LLM call, filled in by the caller while the call runs."""
+
+    def __init__(self, feature, provider, model, prompt):
+        self.feature = feature
+        self.provider = provider
+        self.model = model
+        self.prompt_tokens = estimate_tokens(prompt)
+        self.prompt_fingerprint = hashlib.blake2b(prompt.encode('utf-8', errors='ignore'),
+                                                  digest_size=6).hexdigest()
+        self.prompt_preview = " ".join(prompt.split())[:80]
+        self.completion_tokens = 0
+        self.retries = _retries.get()
+        self.outcome = 'ok'
+
+    def set_response(self, text):
+        """Count completion tokens from the response text."""
+        self.completion_tokens = estimate_tokens(text or "")
+
+    def set_usage(self, prompt_tokens=None, completion_tokens=None):
+        """Use exact token counts reported by the provider where available."""
+        if prompt_tokens:
+            self.prompt_tokens = int(prompt_tokens)
+        if completion_tokens:
+            self.completion_tokens = int(completion_tokens)
+
+    def set_usage_from(self, response):
+        """Read token counts from a Gemini (SDK or REST) or OpenAI response, if it reports them."""
+        try:
+            if isinstance(response, dict):
+                usage = response.get('usageMetadata') or response.get('usage') or {}
+                self.set_usage(usage.get('promptTokenCount') or usage.get('prompt_tokens'),
+                               usage.get('candidatesTokenCount') or usage.get('completion_tokens'))
+                return
+
+            usage = getattr(response, 'usage_metadata', None)
+            if usage is not None:
+                self.set_usage(getattr(usage, 'prompt_token_count', None),
+                               getattr(usage, 'candidates_token_count', None))
+        except Exception as e:
+            print(f"Error reading token usage: {e}")
+
+    def fail(self, reason):
+        """Mark the call as failed without raising (e.g. an error response)."""
+        self.outcome = reason
+
+
+class LLMMetrics:
+    """Records LLM calls and computes aggregates over the recent ones."""
+
+    def __init__(self, max_records=MAX_RECORDS):
+        """Initialize an empty metrics store."""
+        self._records = deque(maxlen=max_records)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def track(self, provider, model, prompt, feature=None):
+        """Time an LLM call and record it when the block exits.
+
+        Yields an LLMCall on which the caller reports the response and, if
+        the provider returns them, exact token counts. An exception escaping
+        the block marks the call as failed.
+        """
+        call = LLMCall(current_feature() or feature or UNTAGGED_FEATURE, provider, model, prompt or "")
+        start = time.time()
+        try:
+            yield call
+        except Exception as e:
+            call.outcome = type(e).__name__
+            raise
+        finally:
+            self.record(call, time.time() - start)
+
+    def record(self, call, duration):
+        """Store a finished call and write it to the performance log."""
+        record = {
+            'timestamp': time.time(),
+            'feature': call.feature,
+            'provider': call.provider,
+            'model': call.model,
+            'prompt_tokens': call.prompt_tokens,
+            'completion_tokens': call.completion_tokens,
+            'duration': duration,
+            'retries': call.retries,
+            'outcome': call.outcome,
+            'prompt_fingerprint': call.prompt_fingerprint,
+            'prompt_preview': call.prompt_preview,
+        }
+        with self._lock:
+            self._records.append(record)
+
+        try:
+            get_logger().log_performance(
+                f"llm.{call.feature}",
+                duration,
+                success=call.outcome == 'ok',
+                details=(f"provider={call.provider} model={call.model} "
+                         f"prompt_tokens={call.prompt_tokens} completion_tokens={call.completion_tokens} "
+                         f"retries={call.retries} outcome={call.outcome} prompt={call.prompt_fingerprint}")
+            )
+        except Exception as e:
+            print(f"Error logging LLM call: {e}")
+
+    def _recent(self, hours):
+        cutoff = time.time() - hours * 3600
+        with self._lock:
+            return [record for record in self._records if record['timestamp'] >= cutoff]
+
+    def summary(self, hours=24):
+        """Aggregate calls per feature over the last hours.
+
+        Returns:
+            dict: Feature name -> calls, errors, error rate, p50/p95 latency,
+                token totals, retries and estimated cost in USD
+        """
+        by_feature = {}
+        for record in self._recent(hours):
+            by_feature.setdefault(record['feature'], []).append(record)
+
+        summary = {}
+        for feature, records in by_feature.items():
+            durations = sorted(record['duration'] for record in records)
+            errors = sum(1 for record in records if record['outcome'] != 'ok')
+            summary[feature] = {
+                'calls': len(records),
+                'errors': errors,
+                'error_rate': errors / len(records),
+                'p50_latency': _percentile(durations, 0.50),
+                'p95_latency': _percentile(durations, 0.95),
+                'prompt_tokens': sum(record['prompt_tokens'] for record in records),
+                'completion_tokens': sum(record['completion_tokens'] for record in records),
+                'retries': sum(record['retries'] for record in records),
+                'cost_usd': round(sum(estimate_cost(record['model'], record['prompt_tokens'],
+                                                    record['completion_tokens']) for record in records), 6)
+            }
+        return summary
+
+    def tokens_per_hour(self, hours=24):
+        """Total tokens per feature per clock hour.
+
+        Returns:
+            dict: Feature name -> {hour start (ISO format): tokens}
+        """
+        usage = {}
+        for record in self._recent(hours):
+            hour = datetime.fromtimestamp(record['timestamp']).replace(minute=0, second=0, microsecond=0)
+            feature_usage = usage.setdefault(record['feature'], {})
+            key = hour.isoformat()
+            feature_usage[key] = feature_usage.get(key, 0) + record['prompt_tokens'] + record['completion_tokens']
+        return usage
+
+    def slowest_prompts(self, limit=10, hours=24):
+        """Prompts with the highest p95 latency, grouped by prompt fingerprint."""
+        by_prompt = {}
+        for record in self._recent(hours):
+            by_prompt.setdefault((record['feature'], record['prompt_fingerprint']), []).append(record)
+
+        prompts = []
+        for (feature, fingerprint), records in by_prompt.items():
+            durations = sorted(record['duration'] for record in records)
+            prompts.append({
+                'feature': feature,
+                'prompt_fingerprint': fingerprint,
+                'prompt_preview': records[-1]['prompt_preview'],
+                'model': records[-1]['model'],
+                'calls': len(records),
+                'p95_latency': _percentile(durations, 0.95)
+            })
+        prompts.sort(key=lambda prompt: prompt['p95_latency'], reverse=True)
+        return prompts[:limit]
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_llm_metrics():
+    """Get the process-wide LLM call metrics."""
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = LLMMetrics()
+        return _metrics
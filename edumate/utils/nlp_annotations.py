@@ -0,0 +1,169 @@
+"""Shared NLP annotations for submission text.
+
+Tokenization is the dominant CPU cost when grading, and the same text used to
+be run through sent_tokenize/word_tokenize by several modules (plagiarism
+detection, analytics, text utilities, the AI tutor). Each distinct text is
+now annotated once - sentences with character offsets, lowercased tokens,
+stopword-filtered terms and word counts - and every consumer reads the
+shared annotation, keyed by a hash of the text.
+"""
+
+import os
+import re
+import sys
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+
+import nltk
+from nltk.tokenize import sent_tokenize, word_tokenize
+from nltk.corpus import stopwords
+
+# Approximate memory (bytes) of the annotations kept in memory; a few long
+# theses weigh as much as thousands of short answers, so count size, not entries
+MAX_CACHED_BYTES = int(os.getenv('NLP_ANNOTATION_CACHE_BYTES', str(128 * 1024 * 1024)))
+
+# Pointers to a token in the token tuple and the two term tuples derived from it
+_BYTES_PER_TOKEN = 24
+
+_NON_WORD_PATTERN = re.compile(r'[^\w\s]|\d')
+
+_stop_words = None
+_cache = OrderedDict()
+_cache_size = 0
+_cache_lock = threading.Lock()
+
+
+def get_stop_words():
+    """Get the English stopword set, loading it once per process."""
+    global _stop_words
+    if _stop_words is None:
+        try:
+            _stop_words = frozenset(stopwords.words('english'))
+        except LookupError:
+            nltk.download('stopwords')
+            _stop_words = frozenset(stopwords.words('english'))
+    return _stop_words
+
+
+def content_hash(text):
+    """Get the cache key for a text."""
+    return hashlib.blake2b(text.encode('utf-8', errors='ignore'), digest_size=16).hexdigest()
+
+
+class DocumentAnnotation:
+    """Tokenization results for one text.
+
+    Sentences are stored as character offsets into the text and tokens as
+    interned strings with per-sentence token boundaries, so an annotation
+    costs little more than the text itself.
+    """
+
+    __slots__ = ('content_hash', 'text', 'sentence_spans', 'token_bounds', 'tokens',
+                 'word_count', '_terms', '_clean_terms')
+
+    def __init__(self, text):
+        self.content_hash = content_hash(text)
+        self.text = text
+        self.sentence_spans = array('I')
+        self.token_bounds = array('I', [0])
+
+        tokens = []
+        position = 0
+        for sentence in sent_tokenize(text):
+            start = text.find(sentence, position)
+            if start < 0:
+                start = position
+            end = start + len(sentence)
+            position = end
+
+            self.sentence_spans.extend((start, end))
+            tokens.extend(sys.intern(token) for token in word_tokenize(sentence.lower(), preserve_line=True))
+            self.token_bounds.append(len(tokens))
+
+        self.tokens = tuple(tokens)
+        self.word_count = sum(1 for token in self.tokens if token.isalpha())
+        self._terms = None
+        self._clean_terms = None
+
+    @property
+    def approximate_size(self):
+        """Approximate memory used by the annotation in bytes (token strings are interned and shared)."""
+        return len(self.text) + _BYTES_PER_TOKEN * len(self.tokens) + self.sentence_spans.itemsize * (
+            len(self.sentence_spans) + len(self.token_bounds))
+
+    @property
+    def sentence_count(self):
+        """Number of sentences."""
+        return len(self.sentence_spans) // 2
+
+    @property
+    def sentences(self):
+        """Sentences as strings, in document order."""
+        spans = self.sentence_spans
+        return [self.text[spans[i]:spans[i + 1]] for i in range(0, len(spans), 2)]
+
+    def sentence_tokens(self, index):
+        """Lowercased tokens of one sentence."""
+        return self.tokens[self.token_bounds[index]:self.token_bounds[index + 1]]
+
+    def sentence_terms(self, index):
+        """Stopword-filtered alphanumeric tokens of one sentence."""
+        stop_words = get_stop_words()
+        return [token for token in self.sentence_tokens(index)
+                if token.isalnum() and token not in stop_words]
+
+    @property
+    def terms(self):
+        """Stopword-filtered alphanumeric tokens of the whole text."""
+        if self._terms is None:
+            stop_words = get_stop_words()
+            self._terms = tuple(token for token in self.tokens
+                                if token.isalnum() and token not in stop_words)
+        return self._terms
+
+    @property
+    def clean_terms(self):
+        """Tokens with punctuation and digits removed, without stopwords."""
+        if self._clean_terms is None:
+            stop_words = get_stop_words()
+            terms = []
+            for token in self.tokens:
+                token = _NON_WORD_PATTERN.sub('', token)
+                if token and token not in stop_words:
+                    terms.append(token)
+            self._clean_terms = tuple(terms)
+        return self._clean_terms
+
+
+def annotate(text):
+    """Get the annotation for a text, tokenizing it only the first time it is seen."""
+    global _cache_size
+    text = text or ""
+    key = content_hash(text)
+
+    with _cache_lock:
+        annotation = _cache.get(key)
+        if annotation is not None:
+            _cache.move_to_end(key)
+            return annotation
+
+    annotation = DocumentAnnotation(text)
+
+    size = annotation.approximate_size
+    if size > MAX_CACHED_BYTES:
+        # Would evict everything else and still not fit
+        return annotation
+
+    with _cache_lock:
+        previous = _cache.pop(key, None)
+        if previous is not None:
+            _cache_size -= previous.approximate_size
+        _cache[key] = annotation
+        _cache_size += size
+        while _cache_size > MAX_CACHED_BYTES:
+            _, evicted = _cache.popitem(last=False)
+            _cache_size -= evicted.approximate_size
+
+    return annotation
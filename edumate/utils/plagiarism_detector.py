@@ -7,23 +7,24 @@ using advanced NLP techniques.
 
 import os
 import json
-import numpy as np
 from datetime import datetime
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
 import nltk
-from nltk.tokenize import sent_tokenize
 import difflib
-import requests
+
+from edumate.utils.reference_corpus import ReferenceCorpus
+from edumate.utils.nlp_annotations import annotate
+from edumate.utils.text_utils import similarity_one_to_many
 
 class PlagiarismDetector:
     """Class to detect plagiarism in student submissions."""
     
-    def __init__(self, data_dir="data/plagiarism"):
+    def __init__(self, data_dir="data/plagiarism", reference_corpus=None):
         """Initialize the PlagiarismDetector class.
         
         Args:
             data_dir (str): Directory to store plagiarism detection data
+            reference_corpus (ReferenceCorpus): Offline reference corpus to check
+                submissions against (defaults to the index under data_dir)
         """
         self.data_dir = data_dir
         os.makedirs(data_dir, exist_ok=True)
@@ -35,13 +36,18 @@ class PlagiarismDetector:
         os.makedirs(self.reports_dir, exist_ok=True)
         os.makedirs(self.database_dir, exist_ok=True)
         
+        self.reference_corpus = reference_corpus or ReferenceCorpus(
+            os.path.join(data_dir, "reference_index")
+        )
+        
         # Download NLTK data if needed
         try:
             nltk.data.find('tokenizers/punkt')
         except LookupError:
             nltk.download('punkt')
     
-    def check_plagiarism(self, submission_text, student_id, assignment_id, check_web=True, threshold=0.8):
+    def check_plagiarism(self, submission_text, student_id, assignment_id, check_web=True, threshold=0.8,
+                         submission_id=None):
         """Check a submission for plagiarism against previous submissions and optionally the web.
         
         Args:
@@ -50,6 +56,9 @@ class PlagiarismDetector:
             assignment_id (str): ID of the assignment
             check_web (bool): Whether to check for plagiarism against web sources
             threshold (float): Similarity threshold above which to flag plagiarism (0.0-1.0)
+            submission_id (str): ID of the stored submission, if any. Checking the
+                same submission again replaces its database entry and never
+                matches it against itself
             
         Returns:
             dict: Plagiarism detection results
@@ -65,7 +74,7 @@ class PlagiarismDetector:
         }
         
         # Check against previous submissions
-        database_matches = self._check_against_database(submission_text, threshold)
+        database_matches = self._check_against_database(submission_text, threshold, exclude_submission_id=submission_id)
         if database_matches:
             results["plagiarism_detected"] = True
             results["matched_sources"] = database_matches
@@ -87,7 +96,7 @@ class PlagiarismDetector:
                     results["similarity_score"] = web_max_score
         
         # Add the submission to the database
-        self._add_to_database(submission_text, student_id, assignment_id)
+        self._add_to_database(submission_text, student_id, assignment_id, submission_id)
         
         # Generate a detailed report
         report_path = self._generate_report(results, submission_text)
@@ -95,12 +104,13 @@ class PlagiarismDetector:
         
         return results
     
-    def _check_against_database(self, submission_text, threshold):
+    def _check_against_database(self, submission_text, threshold, exclude_submission_id=None):
         """Check submission against the database of previous submissions.
         
         Args:
             submission_text (str): The text to check
             threshold (float): Similarity threshold
+            exclude_submission_id (str): Submission whose own entry is skipped
             
         Returns:
             list: List of matched sources
@@ -109,23 +119,16 @@ class PlagiarismDetector:
         
         # Get all submissions from the database
         submissions = self._get_all_submissions()
+        if exclude_submission_id is not None:
+            submissions = [sub for sub in submissions if sub.get("submission_id") != exclude_submission_id]
         
         if not submissions:
             return matches
         
-        # Prepare the texts for comparison
-        texts = [sub["text"] for sub in submissions]
-        texts.append(submission_text)
-        
-        # Calculate TF-IDF vectors
-        vectorizer = TfidfVectorizer().fit_transform(texts)
-        vectors = vectorizer.toarray()
+        # Score the submission against all previous submissions with one TF-IDF fit
+        similarities = similarity_one_to_many(submission_text, [sub["text"] for sub in submissions])
         
-        # Calculate similarity between the submission and all previous submissions
-        submission_vector = vectors[-1]
-        for i, sub in enumerate(submissions):
-            similarity = cosine_similarity([vectors[i]], [submission_vector])[0][0]
-            
+        for sub, similarity in zip(submissions, similarities):
             if similarity >= threshold:
                 # Find matching sentences
                 matching_sentences = self._find_matching_sentences(
@@ -144,65 +147,39 @@ class PlagiarismDetector:
         return matches
     
     def _check_against_web(self, submission_text, threshold):
-        """Check submission against web sources.
+        """Check submission against the offline reference corpus.
+        
+        The corpus (textbooks, answer keys, encyclopedia dumps) is indexed
+        locally, so this check works without network access.
         
         Args:
             submission_text (str): The text to check
             threshold (float): Similarity threshold
             
         Returns:
-            list: List of matched web sources
+            list: List of matched reference sources
         """
         matches = []
         
-        # Split the submission into sentences
-        sentences = sent_tokenize(submission_text)
+        if not self.reference_corpus.is_available():
+            return matches
         
-        # Check each sentence (or group of sentences) against web sources
-        # In a real implementation, this would use a search API or specialized service
+        # Split the submission into sentences
+        sentences = annotate(submission_text).sentences
         
-        # Simulate web checking with a mock implementation
-        # In a production environment, you would integrate with a real service
         for i in range(0, len(sentences), 3):
             # Take groups of 3 sentences to check
             sentence_group = " ".join(sentences[i:i+3])
             if len(sentence_group.split()) < 10:
                 continue  # Skip very short groups
-                
-            # Simulate a web search result
-            # In reality, this would call a search API
-            web_match = self._simulate_web_search(sentence_group)
             
-            if web_match and web_match["similarity_score"] >= threshold:
-                matches.append(web_match)
+            # Look the window up in the reference index
+            window_matches = self.reference_corpus.find_matches(sentence_group, threshold, limit=1)
+            if window_matches:
+                matches.append(window_matches[0])
         
         return matches
     
-    def _simulate_web_search(self, text):
-        """Simulate a web search for plagiarism detection.
-        
-        In a real implementation, this would call a search API or specialized service.
-        
-        Args:
-            text (str): The text to search for
-            
-        Returns:
-            dict: Simulated web match result, or None if no match
-        """
-        # This is a mock implementation
-        # In a real system, you would integrate with a search API
-        
-        # Randomly determine if this text has a web match (for demonstration)
-        if len(text) > 100 and np.random.random() < 0.1:
-            return {
-                "source_url": f"https://example.com/article{np.random.randint(1000)}",
-                "source_title": f"Example Article {np.random.randint(100)}",
-                "similarity_score": np.random.uniform(0.8, 0.95),
-                "matched_text": text
-            }
-        
-        return None
-    
     def _find_matching_sentences(self, text1, text2, threshold):
         """Find matching sentences between two texts.
         
@@ -215,8 +192,8 @@ class PlagiarismDetector:
             list: List of matching sentence pairs
         """
         # Split texts into sentences
-        sentences1 = sent_tokenize(text1)
-        sentences2 = sent_tokenize(text2)
+        sentences1 = annotate(text1).sentences
+        sentences2 = annotate(text2).sentences
         
         matches = []
         
@@ -235,20 +212,26 @@ class PlagiarismDetector:
         
         return matches
     
-    def _add_to_database(self, submission_text, student_id, assignment_id):
+    def _add_to_database(self, submission_text, student_id, assignment_id, submission_id=None):
         """Add a submission to the database for future plagiarism checks.
         
         Args:
             submission_text (str): The text content
             student_id (str): ID of the student
             assignment_id (str): ID of the assignment
+            submission_id (str): ID of the stored submission; its entry is
+                replaced if it was added before
         """
-        # Create a unique ID for the submission
-        submission_id = f"{student_id}_{assignment_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}"
+        # Create a unique ID for the entry
+        if submission_id is not None:
+            entry_id = f"submission_{submission_id}"
+        else:
+            entry_id = f"{student_id}_{assignment_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}"
         
         # Prepare submission data
         submission_data = {
-            "id": submission_id,
+            "id": entry_id,
+            "submission_id": submission_id,
             "student_id": student_id,
             "assignment_id": assignment_id,
             "timestamp": datetime.now().isoformat(),
@@ -256,7 +239,7 @@ class PlagiarismDetector:
         }
         
         # Save to database
-        file_path = os.path.join(self.database_dir, f"{submission_id}.json")
+        file_path = os.path.join(self.database_dir, f"{entry_id}.json")
         with open(file_path, 'w') as f:
             json.dump(submission_data, f, indent=4)
     
@@ -0,0 +1,406 @@
+"""
+Reference Corpus module for EduMate.
+
+This module builds an offline inverted n-gram index over a local reference
+corpus (textbooks, past-year answer keys, encyclopedia dumps) so that
+submissions can be checked for copied passages without any network access.
+
+The index is stored as a series of immutable segments. Each segment holds a
+sorted array of shingle hashes, an offsets array and a flat postings array of
+document IDs, all saved as ``.npy`` files and memory-mapped at query time.
+
+Build or extend the index from the command line::
+
+    python -m edumate.utils.reference_corpus textbooks/ answer_keys.jsonl
+    python -m edumate.utils.reference_corpus --rebuild   # REFERENCE_CORPUS_PATHS
+"""
+
+import os
+import re
+import json
+import hashlib
+import argparse
+import numpy as np
+
+WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+# Multiplier used to combine word hashes into n-gram hashes (wraps mod 2**64)
+NGRAM_HASH_MULTIPLIER = np.uint64(1099511628211)
+
+
+class ReferenceCorpus:
+    """Offline reference corpus backed by a memory-mapped n-gram index."""
+
+    TEXT_EXTENSIONS = {'.txt', '.md'}
+    DOCUMENT_EXTENSIONS = {'.pdf', '.docx'}
+    JSONL_EXTENSIONS = {'.jsonl'}
+
+    def __init__(self, index_dir="data/plagiarism/reference_index", ngram_size=5,
+                 max_posting_length=5000):
+        """Initialize the ReferenceCorpus class.
+
+        Args:
+            index_dir (str): Directory holding the index segments
+            ngram_size (int): Number of words per shingle
+            max_posting_length (int): Shingles that occur in more documents than
+                this are treated as common phrases and ignored at query time
+        """
+        self.index_dir = index_dir
+        self.ngram_size = ngram_size
+        self.max_posting_length = max_posting_length
+
+        self._segments = None
+        self._documents = None
+        self._word_hashes = {}
+
+    def build(self, source_paths=None, rebuild=False, segment_size=5000000, chunk_chars=1000000):
+        """Ingest reference files into the index.
+
+        Args:
+            source_paths (list): Files or directories to ingest. Defaults to the
+                ``REFERENCE_CORPUS_PATHS`` environment variable (os.pathsep separated)
+            rebuild (bool): Whether to discard the existing index first. Without
+                it, files that are already in the index are skipped
+            segment_size (int): Maximum (shingle, document) pairs held in memory
+                before a segment is written to disk
+            chunk_chars (int): Plain-text files are split into documents of
+                roughly this many characters so large dumps stay bounded in memory
+
+        Returns:
+            int: Number of documents added to the index
+        """
+        if source_paths is None:
+            env_paths = os.environ.get('REFERENCE_CORPUS_PATHS', '')
+            source_paths = [p for p in env_paths.split(os.pathsep) if p]
+
+        os.makedirs(self.index_dir, exist_ok=True)
+
+        meta = {"ngram_size": self.ngram_size, "segments": [], "sources": {}}
+        documents = []
+        if not rebuild:
+            meta = self._load_meta() or meta
+            documents = self._load_documents()
+        else:
+            self._remove_segments(self._load_meta())
+
+        if meta.get("ngram_size") != self.ngram_size:
+            raise ValueError(
+                f"Existing index uses {meta.get('ngram_size')}-grams; rebuild it to change ngram_size"
+            )
+        # Files already ingested, by absolute path, with the size and mtime they had
+        sources = meta.setdefault("sources", {})
+
+        pending_hashes = []
+        pending_docs = []
+        pending_count = 0
+        added = 0
+
+        for file_path in self._iter_files(source_paths):
+            source = os.path.abspath(file_path)
+            stat = os.stat(file_path)
+            version = {"size": stat.st_size, "mtime": stat.st_mtime}
+            if source in sources:
+                if sources[source] != version:
+                    print(f"Reference file {file_path} changed since it was indexed; rebuild the index to update it")
+                continue
+
+            for title, location, url, text in self._iter_file(file_path, chunk_chars):
+                shingles = np.unique(self._shingle_hashes(text))
+                if len(shingles) == 0:
+                    continue
+
+                doc_id = len(documents)
+                documents.append({"id": doc_id, "title": title, "path": location, "url": url})
+                added += 1
+
+                pending_hashes.append(shingles)
+                pending_docs.append(np.full(len(shingles), doc_id, dtype=np.uint32))
+                pending_count += len(shingles)
+
+                if pending_count >= segment_size:
+                    meta["segments"].append(self._write_segment(pending_hashes, pending_docs, len(meta["segments"])))
+                    pending_hashes, pending_docs, pending_count = [], [], 0
+            sources[source] = version
+
+        if pending_count:
+            meta["segments"].append(self._write_segment(pending_hashes, pending_docs, len(meta["segments"])))
+
+        with open(os.path.join(self.index_dir, "documents.json"), 'w') as f:
+            json.dump(documents, f)
+        with open(os.path.join(self.index_dir, "meta.json"), 'w') as f:
+            json.dump(meta, f, indent=4)
+
+        # Force the next query to reopen the segments
+        self._segments = None
+        self._documents = None
+        self._word_hashes = {}
+
+        return added
+
+    def is_available(self):
+        """Check whether an index has been built.
+
+        Returns:
+            bool: True if at least one segment exists
+        """
+        return bool(self._get_segments())
+
+    def find_matches(self, text, threshold=0.8, limit=3):
+        """Find reference documents sharing a large fraction of the text's n-grams.
+
+        Args:
+            text (str): The passage to look up (typically a 3-sentence window)
+            threshold (float): Minimum fraction of the passage's shingles that
+                must occur in a single reference document
+            limit (int): Maximum number of matches to return
+
+        Returns:
+            list: Matches sorted by similarity, each with source details
+        """
+        segments = self._get_segments()
+        if not segments:
+            return []
+
+        query = np.unique(self._shingle_hashes(text))
+        if len(query) == 0:
+            return []
+
+        doc_counts = {}
+        for keys, offsets, postings in segments:
+            positions = np.searchsorted(keys, query)
+            in_range = positions < len(keys)
+            positions = positions[in_range]
+            positions = positions[keys[positions] == query[in_range]]
+
+            hits = []
+            for pos in positions:
+                start, end = offsets[pos], offsets[pos + 1]
+                if end - start > self.max_posting_length:
+                    continue
+                hits.append(postings[start:end])
+
+            if not hits:
+                continue
+
+            doc_ids, counts = np.unique(np.concatenate(hits), return_counts=True)
+            for doc_id, count in zip(doc_ids.tolist(), counts.tolist()):
+                doc_counts[doc_id] = doc_counts.get(doc_id, 0) + count
+
+        documents = self._get_documents()
+        matches = []
+        for doc_id, count in doc_counts.items():
+            similarity = count / len(query)
+            if similarity < threshold:
+                continue
+
+            document = documents[doc_id]
+            matches.append({
+                "source_url": document.get("url") or f"file://{os.path.abspath(document['path'])}",
+                "source_title": document["title"],
+                "similarity_score": float(similarity),
+                "matched_text": text
+            })
+
+        matches.sort(key=lambda match: match["similarity_score"], reverse=True)
+        return matches[:limit]
+
+    def _shingle_hashes(self, text):
+        """Hash every n-word shingle of a text.
+
+        Args:
+            text (str): Text to shingle
+
+        Returns:
+            numpy.ndarray: uint64 shingle hashes (may contain duplicates)
+        """
+        words = WORD_PATTERN.findall(text.lower()) if text else []
+        if len(words) < self.ngram_size:
+            return np.empty(0, dtype=np.uint64)
+
+        if len(self._word_hashes) > 2000000:
+            self._word_hashes = {}
+
+        word_hashes = np.fromiter(
+            (self._hash_word(word) for word in words),
+            dtype=np.uint64,
+            count=len(words)
+        )
+
+        count = len(words) - self.ngram_size + 1
+        shingles = np.zeros(count, dtype=np.uint64)
+        for offset in range(self.ngram_size):
+            shingles = shingles * NGRAM_HASH_MULTIPLIER + word_hashes[offset:offset + count]
+
+        return shingles
+
+    def _hash_word(self, word):
+        """Return a stable 64-bit hash for a word."""
+        value = self._word_hashes.get(word)
+        if value is None:
+            digest = hashlib.blake2b(word.encode('utf-8'), digest_size=8).digest()
+            value = int.from_bytes(digest, 'little')
+            self._word_hashes[word] = value
+        return value
+
+    def _iter_files(self, source_paths):
+        """Yield every file in the sources (files or directories)."""
+        for source in source_paths:
+            if os.path.isdir(source):
+                for root, _, filenames in os.walk(source):
+                    for filename in sorted(filenames):
+                        yield os.path.join(root, filename)
+            elif os.path.isfile(source):
+                yield source
+            else:
+                print(f"Reference corpus source not found: {source}")
+
+    def _iter_file(self, file_path, chunk_chars):
+        """Yield the documents contained in a single file."""
+        ext = os.path.splitext(file_path)[1].lower()
+        title = os.path.splitext(os.path.basename(file_path))[0]
+
+        try:
+            if ext in self.TEXT_EXTENSIONS:
+                # Stream large dumps in chunks, breaking on line boundaries
+                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+                    part = 1
+                    buffer = []
+                    size = 0
+                    for line in f:
+                        buffer.append(line)
+                        size += len(line)
+                        if size >= chunk_chars:
+                            yield f"{title} (part {part})", file_path, None, ''.join(buffer)
+                            part += 1
+                            buffer, size = [], 0
+                    if buffer:
+                        part_title = title if part == 1 else f"{title} (part {part})"
+                        yield part_title, file_path, None, ''.join(buffer)
+
+            elif ext in self.JSONL_EXTENSIONS:
+                # One article per line, e.g. {"title": ..., "text": ..., "url": ...}
+                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+                    for line_num, line in enumerate(f, 1):
+                        line = line.strip()
+                        if not line:
+                            continue
+                        try:
+                            record = json.loads(line)
+                        except ValueError as e:
+                            print(f"Skipping malformed line {line_num} of {file_path}: {e}")
+                            continue
+                        if not isinstance(record, dict):
+                            print(f"Skipping line {line_num} of {file_path}: not a JSON object")
+                            continue
+                        yield (
+                            record.get("title") or f"{title} #{line_num}",
+                            file_path,
+                            record.get("url"),
+                            record.get("text", "")
+                        )
+
+            elif ext in self.DOCUMENT_EXTENSIONS:
+                from edumate.utils.text_utils import extract_text_from_file
+                yield title, file_path, None, extract_text_from_file(file_path)
+        except Exception as e:
+            print(f"Error ingesting reference file {file_path}: {e}")
+
+    def _write_segment(self, hash_chunks, doc_chunks, segment_num):
+        """Sort pending (shingle, document) pairs and write them as a segment.
+
+        Returns:
+            str: Name of the written segment
+        """
+        hashes = np.concatenate(hash_chunks)
+        docs = np.concatenate(doc_chunks)
+
+        order = np.lexsort((docs, hashes))
+        hashes = hashes[order]
+        docs = docs[order]
+
+        keys, starts = np.unique(hashes, return_index=True)
+        offsets = np.append(starts, len(hashes)).astype(np.int64)
+
+        name = f"segment_{segment_num:05d}"
+        np.save(os.path.join(self.index_dir, f"{name}.keys.npy"), keys)
+        np.save(os.path.join(self.index_dir, f"{name}.offsets.npy"), offsets)
+        np.save(os.path.join(self.index_dir, f"{name}.postings.npy"), docs)
+
+        return name
+
+    def _get_segments(self):
+        """Open (memory-map) all index segments."""
+        if self._segments is None:
+            self._segments = []
+            meta = self._load_meta()
+            if meta:
+                self.ngram_size = meta.get("ngram_size", self.ngram_size)
+                for name in meta.get("segments", []):
+                    base = os.path.join(self.index_dir, name)
+                    try:
+                        self._segments.append((
+                            np.load(f"{base}.keys.npy", mmap_mode='r'),
+                            np.load(f"{base}.offsets.npy", mmap_mode='r'),
+                            np.load(f"{base}.postings.npy", mmap_mode='r')
+                        ))
+                    except Exception as e:
+                        print(f"Error loading reference index segment {name}: {e}")
+        return self._segments
+
+    def _get_documents(self):
+        """Load the document table."""
+        if self._documents is None:
+            self._documents = self._load_documents()
+        return self._documents
+
+    def _load_meta(self):
+        """Load index metadata, or None if no index exists."""
+        meta_path = os.path.join(self.index_dir, "meta.json")
+        if not os.path.exists(meta_path):
+            return None
+
+        try:
+            with open(meta_path, 'r') as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"Error loading reference index metadata: {e}")
+            return None
+
+    def _load_documents(self):
+        """Load the list of indexed documents."""
+        documents_path = os.path.join(self.index_dir, "documents.json")
+        if not os.path.exists(documents_path):
+            return []
+
+        with open(documents_path, 'r') as f:
+            return json.load(f)
+
+    def _remove_segments(self, meta):
+        """Delete the segment files listed in the metadata."""
+        if not meta:
+            return
+
+        for name in meta.get("segments", []):
+            for suffix in ("keys", "offsets", "postings"):
+                path = os.path.join(self.index_dir, f"{name}.{suffix}.npy")
+                if os.path.exists(path):
+                    os.remove(path)
+
+
+def main(argv=None):
+    """Build or extend the reference index from the command line."""
+    parser = argparse.ArgumentParser(description="Ingest reference files into the offline plagiarism index.")
+    parser.add_argument('sources', nargs='*',
+                        help="Files or directories to ingest (default: REFERENCE_CORPUS_PATHS)")
+    parser.add_argument('--index-dir', default=os.path.join("data", "plagiarism", "reference_index"),
+                        help="Index directory (default: %(default)s)")
+    parser.add_argument('--rebuild', action='store_true', help="Discard the existing index first")
+    args = parser.parse_args(argv)
+
+    corpus = ReferenceCorpus(args.index_dir)
+    added = corpus.build(args.sources or None, rebuild=args.rebuild)
+    print(f"Added {added} documents to {args.index_dir}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+"""Shared cache for results of external searches and AI advice.
+
+Course searches and career advice used to be fetched again on every page
+view, even though the answers change slowly: the Custom Search quota of 100
+queries a day ran out by mid-morning and unchanged student profiles got the
+same advice regenerated. Results are now stored in a persistent cache keyed
+by the normalized query or a fingerprint of the profile, with a TTL per
+source:
+
+- within the fresh period a cached result is returned as is;
+- within the stale period it is still returned immediately, and refreshed
+  in the background for the next request (stale-while-revalidate);
+- after that it is fetched again while the caller waits.
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from edumate.utils.disk_cache import DiskCache
+
+DEFAULT_CACHE_PATH = os.path.join('data', 'cache', 'results.db')
+DEFAULT_MAX_CACHE_BYTES = int(os.getenv('RESULT_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+
+# Bump to invalidate every cached result
+RESULT_CACHE_VERSION = "v1"
+
+# (fresh seconds, stale seconds) per source
+SOURCE_TTLS = {
+    'course_search': (7 * 86400, 30 * 86400),
+    'career_skill_analysis': (7 * 86400, 30 * 86400),
+    'career_advice': (86400, 7 * 86400),
+}
+
+DEFAULT_TTL = (3600, 86400)
+
+# Background refreshes running at the same time
+MAX_REFRESH_WORKERS = 2
+
+
+def normalize_query(query):
+    """Lowercase a query and collapse its whitespace."""
+    return " ".join(str(query or "").lower().split())
+
+
+def _normalize_value(value):
+    if isinstance(value, str):
+        return normalize_query(value)
+    if isinstance(value, dict):
+        return {str(key): _normalize_value(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple, set)):
+        items = [_normalize_value(item) for item in value]
+        # Order of interests or skills doesn't change the advice
+        return sorted(items, key=lambda item: json.dumps(item, sort_keys=True, default=str))
+    return value
+
+
+def profile_fingerprint(profile, fields=None):
+    """Fingerprint of a student profile, ignoring case, whitespace and list order.
+
+    Args:
+        profile: Student profile data
+        fields: Only include these top-level fields (default all)
+    """
+    if fields is not None:
+        profile = {field: profile.get(field) for field in fields}
+    data = json.dumps(_normalize_value(profile), sort_keys=True, default=str)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """Persistent result cache with per-source TTLs and background refresh."""
+
+    def __init__(self, db_path=DEFAULT_CACHE_PATH, max_size_bytes=DEFAULT_MAX_CACHE_BYTES, ttls=None):
+        """Initialize the result cache.
+
+        Args:
+            db_path: Path of the SQLite database file
+            max_size_bytes: Total size of stored results before the least recently used are evicted
+            ttls: Overrides of SOURCE_TTLS
+        """
+        self.store = DiskCache(db_path, max_size_bytes=max_size_bytes)
+        self.ttls = dict(SOURCE_TTLS, **(ttls or {}))
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=MAX_REFRESH_WORKERS, thread_name_prefix='result-refresh')
+
+    def _key(self, source, key_data):
+        data = json.dumps([RESULT_CACHE_VERSION, key_data], sort_keys=True, default=str)
+        return f"{source}:{hashlib.sha256(data.encode('utf-8')).hexdigest()}"
+
+    def get_or_compute(self, source, key_data, compute, should_cache=None):
+        """Get a cached result, computing it when missing or expired.
+
+        Args:
+            source: Name of the result source; selects the TTL
+            key_data: JSON-serializable data identifying the result
+                (e.g. the normalized query or a profile fingerprint)
+            compute: Function returning the result (JSON-serializable)
+            should_cache: Predicate deciding whether a result is stored
+                (default: every result that is not None)
+
+        Returns:
+            The cached or newly computed result
+        """
+        key = self._key(source, key_data)
+        fresh_seconds, stale_seconds = self.ttls.get(source, DEFAULT_TTL)
+
+        entry = self.store.get_entry(key)
+        if entry is not None:
+            value, created_at = entry
+            age = time.time() - created_at
+            if age <= stale_seconds:
+                if age > fresh_seconds:
+                    self._refresh(key, compute, should_cache)
+                try:
+                    return json.loads(value)
+                except json.JSONDecodeError:
+                    pass
+
+        return self._compute_and_store(key, compute, should_cache)
+
+    def _compute_and_store(self, key, compute, should_cache):
+        result = compute()
+        cacheable = should_cache(result) if should_cache is not None else result is not None
+        if cacheable:
+            try:
+                self.store.set(key, json.dumps(result))
+            except (TypeError, ValueError) as e:
+                print(f"Error caching result {key}: {e}")
+        return result
+
+    def _refresh(self, key, compute, should_cache):
+        """Recompute a stale result in the background, once per key at a time."""
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                self._compute_and_store(key, compute, should_cache)
+            except Exception as e:
+                print(f"Error refreshing cached result {key}: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        # Keep context such as the LLM feature tag
+        context = contextvars.copy_context()
+        self._executor.submit(context.run, refresh)
+
+    def invalidate(self, source, key_data):
+        """Remove a cached result."""
+        self.store.delete(self._key(source, key_data))
+
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """Get the process-wide result cache."""
+    global _result_cache
+    with _result_cache_lock:
+        if _result_cache is None:
+            _result_cache = ResultCache(db_path=os.getenv('RESULT_CACHE_PATH', DEFAULT_CACHE_PATH))
+        return _result_cache
@@ -0,0 +1,419 @@
+"""Sandbox worker process for code execution.
+
+Started by code_sandbox.CodeSandbox with a scrubbed environment and run as a
+standalone script (it imports nothing from edumate). It reads one JSON
+request per line on stdin and answers with one JSON line on stdout.
+
+Every request runs in a child forked from this process. The child moves to
+its own process group, drops network access (new network namespace), sees
+only read-only system paths and its writable working directory (new mount
+namespace and chroot), gives up its privileges (the sandbox user when the
+worker runs as root, no capabilities otherwise), sets resource limits and
+then either executes a command or, for Python, runs the source directly in
+the already warm interpreter, which saves the interpreter startup that
+dominates the run time of small programs.
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import ctypes
+import signal
+import tempfile
+import resource
+import selectors
+import traceback
+
+# Imported once here so student programs that use them start faster
+PRELOAD_MODULES = ('math', 'random', 're', 'string', 'collections', 'itertools', 'functools',
+                   'heapq', 'bisect', 'statistics', 'fractions', 'decimal', 'datetime')
+
+CLONE_NEWNS = 0x00020000
+CLONE_NEWUSER = 0x10000000
+CLONE_NEWNET = 0x40000000
+
+MS_RDONLY = 0x1
+MS_NOSUID = 0x2
+MS_NODEV = 0x4
+MS_NOEXEC = 0x8
+MS_REMOUNT = 0x20
+MS_NOATIME = 0x400
+MS_NODIRATIME = 0x800
+MS_BIND = 0x1000
+MS_REC = 0x4000
+MS_PRIVATE = 0x40000
+MS_RELATIME = 0x200000
+
+PR_SET_NO_NEW_PRIVS = 38
+_LINUX_CAPABILITY_VERSION_3 = 0x20080522
+
+# Child exit code when setting up the sandbox failed
+SETUP_FAILED_EXIT = 121
+
+_libc = None
+
+# Empty directory the child mounts its new root on (in its own mount namespace)
+_sandbox_root = None
+
+
+class _CapHeader(ctypes.Structure):
+    _fields_ = [('version', ctypes.c_uint32), ('pid', ctypes.c_int)]
+
+
+class _CapData(ctypes.Structure):
+    _fields_ = [('effective', ctypes.c_uint32), ('permitted', ctypes.c_uint32), ('inheritable', ctypes.c_uint32)]
+
+
+def _get_libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(None, use_errno=True)
+        _libc.mount.argtypes = [ctypes.c_char_p, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_ulong, ctypes.c_char_p]
+    return _libc
+
+
+def _unshare(flags):
+    """Move the calling process into new namespaces (CLONE_* flags).
+
+    Returns:
+        bool: Whether the namespaces were created
+    """
+    libc = _get_libc()
+    if not hasattr(libc, 'unshare'):
+        return False
+
+    if os.geteuid() == 0:
+        return libc.unshare(flags) == 0
+
+    # Unprivileged: a user namespace grants the right to create the other namespaces
+    uid, gid = os.geteuid(), os.getegid()
+    if libc.unshare(CLONE_NEWUSER | flags) != 0:
+        return False
+    try:
+        # Keep the same uid and gid inside, so the work directory stays accessible
+        with open('/proc/self/setgroups', 'w') as f:
+            f.write('deny')
+        with open('/proc/self/uid_map', 'w') as f:
+            f.write(f'{uid} {uid} 1')
+        with open('/proc/self/gid_map', 'w') as f:
+            f.write(f'{gid} {gid} 1')
+    except OSError:
+        pass
+    return True
+
+
+def _mount(source, target, fstype=None, flags=0, data=None):
+    def encode(value):
+        return None if value is None else os.fsencode(value)
+
+    if _get_libc().mount(encode(source), encode(target), encode(fstype), flags, encode(data)) != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, f'Cannot mount {target}: {os.strerror(errno)}')
+
+
+def _bind(path, root, writable=False):
+    """Make path visible at the same place under root."""
+    target = root + path
+    if os.path.islink(path):
+        # e.g. /bin -> usr/bin on merged /usr systems
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if not os.path.lexists(target):
+            os.symlink(os.readlink(path), target)
+        return
+    if not os.path.exists(path):
+        return
+
+    if os.path.isdir(path):
+        os.makedirs(target, exist_ok=True)
+    else:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        open(target, 'a').close()
+    _mount(path, target, flags=MS_BIND | MS_REC)
+
+    if not writable:
+        # A read-only remount has to keep the flags the original mount is locked to
+        mount_flags = os.statvfs(path).f_flag
+        flags = MS_REMOUNT | MS_BIND | MS_RDONLY
+        for stat_flag, mount_flag in (('ST_NOSUID', MS_NOSUID), ('ST_NODEV', MS_NODEV), ('ST_NOEXEC', MS_NOEXEC),
+                                      ('ST_NOATIME', MS_NOATIME), ('ST_NODIRATIME', MS_NODIRATIME),
+                                      ('ST_RELATIME', MS_RELATIME)):
+            if mount_flags & getattr(os, stat_flag, 0):
+                flags |= mount_flag
+        _mount(None, target, flags=flags)
+
+
+def _isolate_filesystem(request):
+    """Change root to a tree of the read-only paths and the writable working directory.
+
+    Must run in a new mount namespace.
+    """
+    root = _sandbox_root
+    # Keep the mounts below out of the worker's namespace
+    _mount(None, '/', flags=MS_REC | MS_PRIVATE)
+    _mount('tmpfs', root, 'tmpfs', MS_NOSUID, 'size=1m,mode=755')
+    for path in request.get('readonly_paths', []):
+        _bind(path, root)
+    _bind(request['cwd'], root, writable=True)
+    _mount(None, root, flags=MS_REMOUNT | MS_RDONLY | MS_NOSUID)
+
+    os.chroot(root)
+    os.chdir(request['cwd'])
+
+
+def _drop_privileges(request):
+    """Give up the worker's privileges before running untrusted code.
+
+    As root, switch to the sandbox user, which owns nothing but the working
+    directory. Otherwise drop the capabilities the user namespace granted.
+    """
+    libc = _get_libc()
+    if os.geteuid() == 0:
+        uid, gid = request['sandbox_uid'], request['sandbox_gid']
+        if uid == 0:
+            raise OSError('the sandbox user must not be root')
+        os.chown('.', uid, gid)
+        os.setgroups([])
+        os.setgid(gid)
+        os.setuid(uid)
+    else:
+        header = _CapHeader(_LINUX_CAPABILITY_VERSION_3, 0)
+        data = (_CapData * 2)()
+        if libc.capset(ctypes.byref(header), data) != 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f'Cannot drop capabilities: {os.strerror(errno)}')
+    # setuid programs would give the privileges back
+    if libc.prctl(PR_SET_NO_NEW_PRIVS, 1, 0, 0, 0) != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, f'Cannot set no_new_privs: {os.strerror(errno)}')
+
+
+def _set_limits(limits):
+    """Apply resource limits to the calling process."""
+    def set_limit(name, value, hard=None):
+        if value is not None and hasattr(resource, name):
+            resource.setrlimit(getattr(resource, name), (value, value if hard is None else hard))
+
+    cpu_seconds = limits.get('cpu_seconds')
+    # SIGXCPU at the soft limit, SIGKILL a second later if it is ignored
+    set_limit('RLIMIT_CPU', cpu_seconds, None if cpu_seconds is None else cpu_seconds + 1)
+    set_limit('RLIMIT_AS', limits.get('memory_bytes'))
+    set_limit('RLIMIT_NPROC', limits.get('processes'))
+    set_limit('RLIMIT_FSIZE', limits.get('file_size_bytes'))
+    set_limit('RLIMIT_NOFILE', limits.get('open_files'))
+    set_limit('RLIMIT_CORE', 0)
+
+
+def _run_child(request, stdin_fd, stdout_fd, stderr_fd):
+    """Set up the sandbox in the forked child and run the program; never returns."""
+    try:
+        os.setsid()
+        os.dup2(stdin_fd, 0)
+        os.dup2(stdout_fd, 1)
+        os.dup2(stderr_fd, 2)
+        os.closerange(3, 1024)
+        os.chdir(request['cwd'])
+
+        isolate_network = request.get('isolate_network', True)
+        isolate_filesystem = request.get('isolate_filesystem', True)
+        flags = (CLONE_NEWNET if isolate_network else 0) | (CLONE_NEWNS if isolate_filesystem else 0)
+        isolated = bool(flags) and _unshare(flags)
+        if not isolated and (
+                (isolate_network and request.get('require_network_isolation', True))
+                or (isolate_filesystem and request.get('require_filesystem_isolation', True))):
+            os.write(2, b'Sandbox error: could not create namespaces to isolate the program\n')
+            os._exit(SETUP_FAILED_EXIT)
+
+        if isolate_filesystem:
+            try:
+                if isolated:
+                    _isolate_filesystem(request)
+                _drop_privileges(request)
+            except OSError as e:
+                if request.get('require_filesystem_isolation', True):
+                    raise
+                os.write(2, f'Sandbox warning: {e}\n'.encode('utf-8', errors='replace'))
+
+        _set_limits(request.get('limits', {}))
+        os.environ.clear()
+        os.environ.update(request.get('env', {}))
+    except Exception as e:
+        os.write(2, f'Sandbox error: {e}\n'.encode('utf-8', errors='replace'))
+        os._exit(SETUP_FAILED_EXIT)
+
+    if request.get('argv'):
+        try:
+            os.execvp(request['argv'][0], request['argv'])
+        except OSError as e:
+            os.write(2, f"Cannot execute {request['argv'][0]}: {e}\n".encode('utf-8', errors='replace'))
+            os._exit(127)
+
+    # Python source: run it here as __main__, like `python <file>`
+    exit_code = 0
+    try:
+        sys.stdin = io.TextIOWrapper(io.FileIO(0, 'r', closefd=False), encoding='utf-8')
+        sys.stdout = io.TextIOWrapper(io.FileIO(1, 'w', closefd=False), encoding='utf-8', write_through=False)
+        sys.stderr = io.TextIOWrapper(io.FileIO(2, 'w', closefd=False), encoding='utf-8', write_through=True)
+        sys.argv = [request['python_file']]
+        sys.path[0:0] = [request['cwd']]
+
+        with open(request['python_file'], 'rb') as f:
+            code = compile(f.read(), request['python_file'], 'exec')
+
+        main = type(sys)('__main__')
+        main.__file__ = request['python_file']
+        main.__builtins__ = __builtins__
+        sys.modules['__main__'] = main
+        exec(code, main.__dict__)
+    except SystemExit as e:
+        if e.code is None:
+            exit_code = 0
+        elif isinstance(e.code, int):
+            exit_code = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            exit_code = 1
+    except BaseException as e:
+        # Leave this file's frame out of the traceback
+        traceback.print_exception(type(e), e, e.__traceback__.tb_next)
+        exit_code = 1
+
+    try:
+        sys.stdout.flush()
+        sys.stderr.flush()
+    except Exception:
+        pass
+    os._exit(exit_code & 0xFF)
+
+
+def _kill_group(pid):
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+
+def _collect(pid, stdout_fd, stderr_fd, timeout, max_output_bytes):
+    """Read a child's output until it exits, the deadline passes or the output limit is hit."""
+    selector = selectors.DefaultSelector()
+    outputs = {stdout_fd: bytearray(), stderr_fd: bytearray()}
+    for fd in outputs:
+        os.set_blocking(fd, False)
+        selector.register(fd, selectors.EVENT_READ)
+
+    start = time.monotonic()
+    deadline = start + timeout
+    timed_out = False
+    truncated = False
+
+    def read_available(timeout):
+        nonlocal truncated
+        events = selector.select(timeout)
+        for key, _ in events:
+            try:
+                block = os.read(key.fd, 65536)
+            except BlockingIOError:
+                continue
+            if not block:
+                selector.unregister(key.fd)
+                continue
+            buffer = outputs[key.fd]
+            buffer.extend(block[:max(0, max_output_bytes - len(buffer))])
+            if len(buffer) >= max_output_bytes:
+                truncated = True
+        return len(events)
+
+    # Read until the program exits (without reaping it yet: the unreaped
+    # leader keeps its process group id reserved), times out or writes too much
+    while not truncated:
+        if os.waitid(os.P_PID, pid, os.WEXITED | os.WNOHANG | os.WNOWAIT) is not None:
+            # Take what is left in the pipes; a background process may hold them open
+            while selector.get_map() and not truncated and read_available(0):
+                pass
+            break
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            timed_out = True
+            break
+        if selector.get_map():
+            read_available(min(remaining, 0.05))
+        else:
+            time.sleep(min(remaining, 0.002))
+
+    # Stop the program on timeout and any background processes it left behind
+    _kill_group(pid)
+    _, status, usage = os.wait4(pid, 0)
+    duration = time.monotonic() - start
+
+    selector.close()
+    for fd in outputs:
+        os.close(fd)
+
+    exit_code = os.WEXITSTATUS(status) if os.WIFEXITED(status) else None
+    term_signal = os.WTERMSIG(status) if os.WIFSIGNALED(status) else None
+    return {
+        'exit_code': exit_code,
+        'signal': term_signal,
+        'timed_out': timed_out or term_signal == signal.SIGXCPU,
+        'output_truncated': truncated,
+        'stdout': outputs[stdout_fd].decode('utf-8', errors='replace'),
+        'stderr': outputs[stderr_fd].decode('utf-8', errors='replace'),
+        'duration': duration,
+        # ru_maxrss is in kilobytes on Linux
+        'max_memory_kb': usage.ru_maxrss
+    }
+
+
+def handle(request):
+    """Run one request in a sandboxed child and return its result."""
+    stdin_path = request.get('stdin_file')
+    stdin_fd = os.open(stdin_path if stdin_path else os.devnull, os.O_RDONLY)
+    stdout_read, stdout_write = os.pipe()
+    stderr_read, stderr_write = os.pipe()
+
+    pid = os.fork()
+    if pid == 0:
+        _run_child(request, stdin_fd, stdout_write, stderr_write)
+
+    os.close(stdin_fd)
+    os.close(stdout_write)
+    os.close(stderr_write)
+    result = _collect(pid, stdout_read, stderr_read, request.get('timeout', 5), request.get('max_output_bytes', 1048576))
+    result['sandbox_error'] = result['exit_code'] == SETUP_FAILED_EXIT
+    return result
+
+
+def main():
+    global _sandbox_root
+    for name in PRELOAD_MODULES:
+        try:
+            __import__(name)
+        except ImportError:
+            pass
+
+    # Keep the protocol streams away from fds 0 and 1, which children replace
+    requests_in = os.fdopen(os.dup(0), 'rb')
+    responses_out = os.fdopen(os.dup(1), 'wb')
+    null_fd = os.open(os.devnull, os.O_RDWR)
+    os.dup2(null_fd, 0)
+    os.dup2(null_fd, 1)
+
+    _sandbox_root = tempfile.mkdtemp(prefix='edumate-sandbox-root-')
+    responses_out.write(b'{"ready": true}\n')
+    responses_out.flush()
+
+    try:
+        for line in requests_in:
+            try:
+                response = handle(json.loads(line))
+            except Exception as e:
+                response = {'worker_error': f'{type(e).__name__}: {e}'}
+            responses_out.write(json.dumps(response).encode('utf-8') + b'\n')
+            responses_out.flush()
+    finally:
+        os.rmdir(_sandbox_root)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,7 @@ from datetime import datetime, timedelta
 import random
 from typing import List, Dict, Optional
 from .logger import log_system_event
+from .llm_metrics import get_llm_metrics, llm_feature
 import speech_recognition as sr
 from gtts import gTTS
 import docx
@@ -753,6 +754,7 @@ class TeacherTools:
             }
         ]
 
+    @llm_feature('lesson_plan')
     def generate_ai_lesson_plan(self, topic: str, grade_level: str, duration: int) -> Dict:
         """Generate a lesson plan using AI"""
         try:
@@ -782,6 +784,7 @@ class TeacherTools:
             log_system_event(f"Error generating AI lesson plan: {str(e)}")
             raise
 
+    @llm_feature('question_generation')
     def generate_ai_questions(self, topic: str, difficulty: str, count: int) -> List[Dict]:
         """Generate questions using AI"""
         try:
@@ -812,6 +815,7 @@ class TeacherTools:
             log_system_event(f"Error generating AI questions: {str(e)}")
             raise
 
+    @llm_feature('performance_analysis')
     def analyze_student_performance(self, student_id: str) -> Dict:
         """Analyze student performance using AI"""
         try:
@@ -843,6 +847,7 @@ class TeacherTools:
             log_system_event(f"Error analyzing student performance: {str(e)}")
             raise
 
+    @llm_feature('feedback')
     def generate_ai_feedback(self, submission_id: str) -> Dict:
         """Generate AI-powered feedback for student submissions"""
         try:
@@ -871,6 +876,7 @@ class TeacherTools:
             log_system_event(f"Error generating AI feedback: {str(e)}")
             raise
 
+    @llm_feature('rubric_generation')
     def generate_ai_rubric(self, assignment_type: str) -> Dict:
         """Generate AI-powered rubric for assignments"""
         try:
@@ -892,6 +898,7 @@ class TeacherTools:
             log_system_event(f"Error generating AI rubric: {str(e)}")
             raise
 
+    @llm_feature('resource_suggestions')
     def generate_ai_resources(self, topic: str, grade_level: str) -> List[Dict]:
         """Generate AI-recommended teaching resources"""
         try:
@@ -927,7 +934,8 @@ class TeacherTools:
         # This is a placeholder for actual AI service integration
         # In a real implementation, this would call an AI service like OpenAI's GPT
         import time
-        time.sleep(1)  # Simulate API call
+        with get_llm_metrics().track('simulated', 'mock', prompt, feature='teacher_tools'):
+            time.sleep(1)  # Simulate API call
         
         # Return mock AI response
         return {
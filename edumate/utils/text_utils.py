@@ -1,13 +1,14 @@
 """Utility functions for text processing."""
 import os
 import re
+import hashlib
 from docx import Document  # Ensure this works with python-docx
 import PyPDF2
+import numpy as np
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
 import nltk
-from nltk.tokenize import word_tokenize
-from nltk.corpus import stopwords
+from edumate.utils.disk_cache import DiskCache
+from edumate.utils.nlp_annotations import annotate
 
 # Download NLTK resources if not already downloaded
 try:
@@ -21,13 +22,78 @@ except LookupError:
     nltk.download('stopwords')
 
 
-def extract_text_from_file(file_path):
-    """Extract text from a file based on its extension."""
+# Parsed PDF/DOCX text, keyed by file content hash (bump the version to invalidate)
+EXTRACTION_CACHE_VERSION = "v1"
+CACHED_EXTENSIONS = {'.pdf', '.docx'}
+
+_extraction_cache = None
+_file_hashes = {}
+
+
+def _get_extraction_cache():
+    """Get the shared text extraction cache."""
+    global _extraction_cache
+    if _extraction_cache is None:
+        _extraction_cache = DiskCache(
+            os.getenv('TEXT_CACHE_PATH', os.path.join('data', 'cache', 'text_extraction.db')),
+            max_size_bytes=int(os.getenv('TEXT_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+        )
+    return _extraction_cache
+
+
+def file_content_hash(file_path):
+    """Get the SHA-256 hash of a file's content.
+    
+    Hashes are remembered per (path, size, mtime) so unchanged files are only
+    read once per process.
+    """
+    stat = os.stat(file_path)
+    stat_key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+    
+    file_hash = _file_hashes.get(stat_key)
+    if file_hash is None:
+        hasher = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                hasher.update(chunk)
+        file_hash = hasher.hexdigest()
+        _file_hashes[stat_key] = file_hash
+    
+    return file_hash
+
+
+def extract_text_from_file(file_path, use_cache=True):
+    """Extract text from a file based on its extension.
+    
+    PDF and DOCX files are parsed once per distinct content; later calls for
+    the same bytes (under any path) are served from the extraction cache.
+    """
     if not os.path.exists(file_path):
         return ""
     
     ext = os.path.splitext(file_path)[1].lower()
     
+    if not use_cache or ext not in CACHED_EXTENSIONS:
+        return _extract_text(file_path, ext) or ""
+    
+    cache = _get_extraction_cache()
+    key = f"{EXTRACTION_CACHE_VERSION}:{ext}:{file_content_hash(file_path)}"
+    
+    text = cache.get(key)
+    if text is not None:
+        return text
+    
+    text = _extract_text(file_path, ext)
+    if text is None:
+        # Parsing failed; don't cache so a fixed parser can retry
+        return ""
+    
+    cache.set(key, text)
+    return text
+
+
+def _extract_text(file_path, ext):
+    """Parse a file and return its text, or None if parsing failed."""
     if ext == '.txt':
         with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
             return f.read()
@@ -38,7 +104,7 @@ def extract_text_from_file(file_path):
             return '\n'.join([paragraph.text for paragraph in doc.paragraphs])
         except Exception as e:
             print(f"Error extracting text from DOCX: {e}")
-            return ""
+            return None
     
     elif ext == '.pdf':
         try:
@@ -50,7 +116,7 @@ def extract_text_from_file(file_path):
             return text
         except Exception as e:
             print(f"Error extracting text from PDF: {e}")
-            return ""
+            return None
     
     else:
         # For code files and other text-based files
@@ -59,7 +125,7 @@ def extract_text_from_file(file_path):
                 return f.read()
         except Exception as e:
             print(f"Error extracting text from file: {e}")
-            return ""
+            return None
 
 
 def preprocess_text(text):
@@ -67,22 +133,80 @@ def preprocess_text(text):
     if not text:
         return ""
     
-    # Convert to lowercase
-    text = text.lower()
+    # Lowercased tokens without punctuation, numbers or stopwords
+    return ' '.join(annotate(text).clean_terms)
+
+
+def preprocess_many(texts):
+    """Preprocess an iterable of texts, returning a list of processed strings."""
+    return [preprocess_text(text) for text in texts]
+
+
+def _tfidf_vectors(texts):
+    """Fit one TF-IDF model over the texts and return their L2-normalized rows.
     
-    # Remove special characters and numbers
-    text = re.sub(r'[^\w\s]', '', text)
-    text = re.sub(r'\d+', '', text)
+    Returns None when none of the texts has any terms left after preprocessing.
+    """
+    processed = preprocess_many(texts)
+    if not any(processed):
+        return None
     
-    # Tokenize
-    tokens = word_tokenize(text)
+    try:
+        return TfidfVectorizer().fit_transform(processed)
+    except ValueError:
+        # Empty vocabulary
+        return None
+
+
+def similarity_one_to_many(text, candidates):
+    """Calculate the similarity of a text to each candidate text.
+    
+    All texts share a single TF-IDF fit and the scores come from one sparse
+    matrix product, so comparing against n candidates costs one vectorization
+    instead of n.
+    
+    Returns:
+        numpy.ndarray: One cosine similarity per candidate (0.0 for empty texts)
+    """
+    candidates = list(candidates)
+    scores = np.zeros(len(candidates))
+    if not text or not candidates:
+        return scores
+    
+    try:
+        vectors = _tfidf_vectors([text] + candidates)
+        if vectors is None:
+            return scores
+        
+        # TF-IDF rows are L2-normalized, so the dot product is the cosine similarity
+        scores = (vectors[1:] @ vectors[0].T).toarray().ravel()
+        return np.clip(scores, 0.0, 1.0)
+    except Exception as e:
+        print(f"Error calculating similarity: {e}")
+        return np.zeros(len(candidates))
+
+
+def similarity_matrix(texts):
+    """Calculate pairwise similarities between all texts with a single TF-IDF fit.
     
-    # Remove stopwords
-    stop_words = set(stopwords.words('english'))
-    tokens = [word for word in tokens if word not in stop_words]
+    Returns:
+        numpy.ndarray: Symmetric n x n matrix of cosine similarities
+    """
+    texts = list(texts)
+    matrix = np.zeros((len(texts), len(texts)))
+    if not texts:
+        return matrix
     
-    # Join tokens back into a string
-    return ' '.join(tokens)
+    try:
+        vectors = _tfidf_vectors(texts)
+        if vectors is None:
+            return matrix
+        
+        matrix = (vectors @ vectors.T).toarray()
+        return np.clip(matrix, 0.0, 1.0)
+    except Exception as e:
+        print(f"Error calculating similarity matrix: {e}")
+        return np.zeros((len(texts), len(texts)))
 
 
 def similarity_score(text1, text2):
@@ -90,24 +214,24 @@ def similarity_score(text1, text2):
     if not text1 or not text2:
         return 0.0
     
-    # Preprocess texts
-    processed_text1 = preprocess_text(text1)
-    processed_text2 = preprocess_text(text2)
+    return float(similarity_one_to_many(text1, [text2])[0])
+
+
+def rank_similar_texts(text, candidates, top_k=5, threshold=0.3):
+    """Rank candidate texts by similarity to a text.
     
-    if not processed_text1 or not processed_text2:
-        return 0.0
+    Returns (index, score) pairs for at most top_k candidates scoring at least
+    threshold, most similar first. Used to decide which references are worth
+    sending to the LLM for a detailed plagiarism analysis.
+    """
+    if not text or not candidates:
+        return []
     
-    # Create TF-IDF vectors
-    vectorizer = TfidfVectorizer()
-    try:
-        tfidf_matrix = vectorizer.fit_transform([processed_text1, processed_text2])
-        
-        # Calculate cosine similarity
-        similarity = cosine_similarity(tfidf_matrix[0:1], tfidf_matrix[1:2])[0][0]
-        return similarity
-    except Exception as e:
-        print(f"Error calculating similarity: {e}")
-        return 0.0
+    scores = similarity_one_to_many(text, candidates)
+    scored = [(i, float(score)) for i, score in enumerate(scores) if score >= threshold]
+    
+    scored.sort(key=lambda item: item[1], reverse=True)
+    return scored[:top_k]
 
 
 def count_words(text):
@@ -115,13 +239,7 @@ def count_words(text):
     if not text:
         return 0
     
-    # Tokenize the text
-    tokens = word_tokenize(text)
-    
-    # Filter out punctuation and other non-word tokens
-    words = [word for word in tokens if word.isalpha()]
-    
-    return len(words)
+    return annotate(text).word_count
 
 
 def summarize_text(text, max_sentences=3):
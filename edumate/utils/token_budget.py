@@ -0,0 +1,139 @@
+"""Token budgeting for LLM prompts.
+
+Estimates token counts locally (no API call), trims text to a budget at
+paragraph or sentence boundaries, and splits long documents into coherent
+chunks that can be processed in parallel and combined afterwards
+(map-reduce), so long submissions are analyzed completely instead of being
+cut off at an arbitrary character count.
+"""
+
+import os
+import re
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+# Tokens of submission text per grading call
+DEFAULT_CHUNK_TOKENS = int(os.getenv('LLM_CHUNK_TOKENS', '6000'))
+
+# Maximum number of chunks processed at the same time
+DEFAULT_PARALLELISM = int(os.getenv('LLM_CHUNK_PARALLELISM', '4'))
+
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+_PARAGRAPH_PATTERN = re.compile(r'\n\s*\n')
+_SENTENCE_PATTERN = re.compile(r'(?<=[.!?])\s+')
+
+
+def estimate_tokens(text):
+    """Estimate the number of LLM tokens in a text.
+
+    Uses the larger of a word/punctuation count (plus a margin for words split
+    into several sub-word tokens) and the common 4-characters-per-token rule,
+    which keeps code and long identifiers from being underestimated.
+    """
+    if not text:
+        return 0
+    word_estimate = int(len(_TOKEN_PATTERN.findall(text)) * 1.3)
+    return max(word_estimate, len(text) // 4) + 1
+
+
+def _split_sentences(text):
+    """Split a paragraph into sentences."""
+    return [sentence for sentence in _SENTENCE_PATTERN.split(text) if sentence.strip()]
+
+
+def _split_words(text, max_tokens):
+    """Split text without usable sentence boundaries into pieces within the budget."""
+    pieces = []
+    current = []
+    current_tokens = 0
+    for word in text.split():
+        word_tokens = estimate_tokens(word)
+        if current and current_tokens + word_tokens > max_tokens:
+            pieces.append(" ".join(current))
+            current, current_tokens = [], 0
+        current.append(word)
+        current_tokens += word_tokens
+    if current:
+        pieces.append(" ".join(current))
+    return pieces
+
+
+def _units(text, max_tokens):
+    """Break text into paragraphs, or sentences/words where a paragraph is too long."""
+    units = []
+    for paragraph in _PARAGRAPH_PATTERN.split(text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if estimate_tokens(paragraph) <= max_tokens:
+            units.append((paragraph, "\n\n"))
+            continue
+        for sentence in _split_sentences(paragraph):
+            if estimate_tokens(sentence) <= max_tokens:
+                units.append((sentence, " "))
+            else:
+                units.extend((piece, " ") for piece in _split_words(sentence, max_tokens))
+        # Keep the paragraph break after the last sentence
+        if units:
+            units[-1] = (units[-1][0], "\n\n")
+    return units
+
+
+def split_into_chunks(text, max_tokens=DEFAULT_CHUNK_TOKENS):
+    """Split text into chunks of at most max_tokens estimated tokens.
+
+    Chunks are built from whole paragraphs where possible, then whole
+    sentences, so each chunk reads as a coherent section of the document.
+
+    Returns:
+        list: Chunk strings in document order
+    """
+    if not text or not text.strip():
+        return []
+    if estimate_tokens(text) <= max_tokens:
+        return [text]
+
+    chunks = []
+    current = ""
+    current_tokens = 0
+    for unit, separator in _units(text, max_tokens):
+        unit_tokens = estimate_tokens(unit)
+        if current and current_tokens + unit_tokens > max_tokens:
+            chunks.append(current.strip())
+            current, current_tokens = "", 0
+        current += unit + separator
+        current_tokens += unit_tokens
+    if current.strip():
+        chunks.append(current.strip())
+
+    return chunks
+
+
+def truncate_to_budget(text, max_tokens):
+    """Trim text to at most max_tokens estimated tokens at a paragraph or sentence boundary."""
+    if not text or estimate_tokens(text) <= max_tokens:
+        return text or ""
+
+    chunks = split_into_chunks(text, max_tokens)
+    return chunks[0] if chunks else ""
+
+
+def map_chunks(fn, chunks, max_workers=DEFAULT_PARALLELISM):
+    """Apply fn to every chunk in parallel, returning results in chunk order."""
+    chunks = list(chunks)
+    if len(chunks) <= 1:
+        return [fn(chunk) for chunk in chunks]
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks)), thread_name_prefix="chunk") as executor:
+        # Run each chunk in a copy of the caller's context (e.g. its LLM feature tag)
+        futures = [executor.submit(contextvars.copy_context().run, fn, chunk) for chunk in chunks]
+        return [future.result() for future in futures]
+
+
+def weighted_mean(values, weights):
+    """Weighted mean that ignores missing (None) values; None if nothing is left."""
+    pairs = [(value, weight) for value, weight in zip(values, weights) if value is not None]
+    total_weight = sum(weight for _, weight in pairs)
+    if not pairs or total_weight <= 0:
+        return None
+    return sum(value * weight for value, weight in pairs) / total_weight
@@ -0,0 +1,34 @@
+"""Tests for AI grading of long submissions."""
+import json
+
+import pytest
+
+# The services package imports every provider SDK
+pytest.importorskip('openai')
+
+from edumate.services.ai_service import AIService
+from edumate.utils.token_budget import DEFAULT_CHUNK_TOKENS, split_into_chunks
+
+
+def test_long_submission_is_graded_in_sections(monkeypatch):
+    prompts = []
+
+    def generate_text(cls, prompt, **kwargs):
+        prompts.append(prompt)
+        grade = 80 if 'PART 1 OF' in prompt else 60
+        return json.dumps({'grade': grade, 'rubric_scores': {'clarity': grade / 10},
+                           'strengths': ['structure'], 'improvements': ['examples'],
+                           'feedback': f'graded {grade}'})
+
+    monkeypatch.setattr(AIService, 'generate_text', classmethod(generate_text))
+    content = 'word. ' * (DEFAULT_CHUNK_TOKENS * 2)
+    sections = split_into_chunks(content, DEFAULT_CHUNK_TOKENS)
+    assert len(sections) > 1
+
+    result = AIService.grade_assignment(content, 'essay', {'clarity': 10}, max_points=100)
+
+    assert result['sections_graded'] == len(sections) == len(prompts)
+    assert 60 < result['grade'] < 80
+    assert 6 < result['rubric_scores']['clarity'] < 8
+    assert result['strengths'] == ['structure']
+    assert 'Part 1: graded 80' in result['feedback']
@@ -0,0 +1,95 @@
+"""Tests for the local short-answer scorer."""
+import json
+import os
+
+import pytest
+from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+
+from edumate.utils import answer_matching
+from edumate.utils.answer_matching import (
+    CORRECT, INCORRECT, UNCERTAIN, DEFAULT_ACCEPT_THRESHOLD, DEFAULT_REJECT_THRESHOLD,
+    calibrate_thresholds, extract_numbers, normalize_answer, score_answer
+)
+
+SAMPLE_PATH = os.path.join(os.path.dirname(__file__), 'data', 'short_answers.json')
+
+
+@pytest.fixture(autouse=True)
+def stop_words(monkeypatch):
+    # Don't depend on the NLTK corpus being downloaded
+    monkeypatch.setattr(answer_matching, 'get_stop_words', lambda: ENGLISH_STOP_WORDS)
+
+
+def load_sample():
+    with open(SAMPLE_PATH, 'r') as f:
+        return [(row['answer'], row['expected'], row['correct']) for row in json.load(f)]
+
+
+def test_normalize_answer_keeps_numbers_whole():
+    assert normalize_answer("The answer is -2.5, not 1,000!") == "answer is -2.5 not 1000"
+    assert normalize_answer("5-3") == "5 3"
+
+
+def test_extract_numbers():
+    assert extract_numbers("x = -2, y = 0.5 and z = 1,000") == [-2.0, 0.5, 1000.0]
+    assert extract_numbers("1, 2, 3") == [1.0, 2.0, 3.0]
+    assert extract_numbers("no numbers") == []
+
+
+@pytest.mark.parametrize('student, expected, verdict', [
+    ('Carbon Dioxide.', 'carbon dioxide', CORRECT),
+    ('the heart', 'heart', CORRECT),
+    ('', 'heart', INCORRECT),
+    ('-5', '5', INCORRECT),
+    ('0.5', '5', INCORRECT),
+    ('1,000', '1000', CORRECT),
+    ('1000 meters', '1,000', CORRECT),
+    ('56.0', '56', CORRECT),
+    ('x = -2', 'x = -2', CORRECT),
+])
+def test_clear_answers_are_decided_locally(student, expected, verdict):
+    assert score_answer(student, expected)['verdict'] == verdict
+
+
+@pytest.mark.parametrize('student, expected', [
+    ('x = -2', 'x = 2'),
+    ('10', 'ten'),
+    ('H2O', 'water'),
+    ('gravitation', 'gravity'),
+    ('whale is not a mammal', 'no, a whale is a mammal'),
+    # Hedged answers list the expected one among others
+    ('oxygen or carbon dioxide', 'carbon dioxide'),
+    ('carbon dioxide and oxygen', 'carbon dioxide'),
+    ('oxygen, nitrogen, carbon dioxide', 'carbon dioxide'),
+])
+def test_ambiguous_answers_are_escalated(student, expected):
+    assert score_answer(student, expected)['verdict'] == UNCERTAIN
+
+
+def test_long_unrelated_answer_is_rejected():
+    result = score_answer('kidneys filter waste products out of circulating blood', 'the heart')
+    assert result['verdict'] == INCORRECT
+
+
+def test_default_thresholds_make_no_mistakes_on_sample():
+    decided = wrong = 0
+    for student, expected, is_correct in load_sample():
+        verdict = score_answer(student, expected)['verdict']
+        if verdict != UNCERTAIN:
+            decided += 1
+            wrong += (verdict == CORRECT) != is_correct
+    assert wrong / decided <= 0.02
+    # Most clear answers are still decided without the LLM
+    assert decided >= 40
+
+
+def test_calibration_supports_default_thresholds():
+    accept, reject = calibrate_thresholds(load_sample())
+    assert reject < accept
+    # The defaults are at least as strict as the calibrated thresholds
+    assert DEFAULT_ACCEPT_THRESHOLD >= accept
+    assert DEFAULT_REJECT_THRESHOLD == pytest.approx(reject, abs=0.005)
+
+
+def test_calibration_without_answers_returns_defaults():
+    assert calibrate_thresholds([]) == (DEFAULT_ACCEPT_THRESHOLD, DEFAULT_REJECT_THRESHOLD)
@@ -0,0 +1,43 @@
+"""Tests for the offline reference corpus index."""
+from edumate.utils.reference_corpus import ReferenceCorpus, main
+
+PASSAGE = "the mitochondria is the powerhouse of the cell and produces most of its energy"
+
+
+def write_sources(tmp_path):
+    (tmp_path / "biology.txt").write_text(PASSAGE)
+    (tmp_path / "articles.jsonl").write_text(
+        '{"title": "Photosynthesis", "text": "plants absorb carbon dioxide and release oxygen into the air"}\n'
+        '{"title": "Broken", "text": \n'
+        '{"title": "Gravity", "text": "objects with mass attract each other with a force called gravity"}\n'
+    )
+    return [str(tmp_path / "biology.txt"), str(tmp_path / "articles.jsonl")]
+
+
+def test_malformed_jsonl_line_is_skipped(tmp_path):
+    corpus = ReferenceCorpus(str(tmp_path / "index"))
+    assert corpus.build(write_sources(tmp_path)) == 3
+
+    matches = corpus.find_matches("objects with mass attract each other with a force called gravity")
+    assert [match["source_title"] for match in matches] == ["Gravity"]
+
+
+def test_second_build_skips_ingested_sources(tmp_path):
+    sources = write_sources(tmp_path)
+    corpus = ReferenceCorpus(str(tmp_path / "index"))
+    corpus.build(sources)
+
+    assert corpus.build(sources) == 0
+    assert len(corpus.find_matches(PASSAGE)) == 1
+
+    # A rebuild ingests everything again, once
+    assert corpus.build(sources, rebuild=True) == 3
+    assert len(corpus.find_matches(PASSAGE)) == 1
+
+
+def test_command_line_builds_index(tmp_path, capsys):
+    sources = write_sources(tmp_path)
+    main(sources + ["--index-dir", str(tmp_path / "index")])
+
+    assert "Added 3 documents" in capsys.readouterr().out
+    assert ReferenceCorpus(str(tmp_path / "index")).is_available()